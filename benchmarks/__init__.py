@@ -0,0 +1,7 @@
+"""
+Offline benchmarking tools for the Prompthash FastAPI service.
+
+The package contains a local OpenAI-compatible stub of ASI Cloud, a load
+generator for the public API routes, and a runner that wires both together
+so the service's own overhead can be measured without upstream spend.
+"""
@@ -0,0 +1,298 @@
+"""
+Load generator for ``/api/chat``, ``/api/improve`` and ``/api/models``.
+
+Two driving modes are supported:
+
+- closed loop: ``--concurrency N`` workers issue requests back to back;
+- open loop: ``--rate R`` starts R requests per second (Poisson arrivals)
+  regardless of how fast earlier ones complete, bounded by ``--max-inflight``.
+
+Results (throughput, latency and TTFB percentiles, error counts) are printed
+and written as JSON so runs can be compared with ``--compare``.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.stats import summarize
+
+ENDPOINTS = ("chat", "improve", "models")
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+_PROMPTS = [
+    "Write a short story about a lighthouse keeper.",
+    "Explain how HTTP caching headers interact with CDNs.",
+    "Summarize the trade-offs between threads and asyncio in Python.",
+    "A cat sitting on a windowsill at sunset, watercolor.",
+    "Draft an onboarding email for new API customers.",
+    "What is a token bucket rate limiter?",
+]
+
+
+class Sample:
+    __slots__ = ("endpoint", "status", "latency", "ttfb", "app_error", "transport_error")
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self.status = 0
+        self.latency = 0.0
+        self.ttfb = 0.0
+        self.app_error = False
+        self.transport_error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and not self.app_error and self.transport_error is None
+
+
+class RequestFactory:
+    """Builds request payloads with a stable pseudo-random mix of senders and prompts."""
+
+    def __init__(self, endpoints: List[str], weights: List[int], senders: int, model: Optional[str], seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.endpoints = endpoints
+        self.weights = weights
+        self.senders = max(1, senders)
+        self.model = model
+        self._counter = itertools.count()
+
+    def next(self) -> Tuple[str, str, str, Optional[Dict[str, Any]]]:
+        endpoint = self.rng.choices(self.endpoints, weights=self.weights)[0]
+        index = next(self._counter)
+        prompt = self.rng.choice(_PROMPTS)
+        if endpoint == "chat":
+            payload: Dict[str, Any] = {"sender": f"bench-{index % self.senders}", "message": prompt}
+            if self.model:
+                payload["model"] = self.model
+            return endpoint, "POST", "/api/chat", payload
+        if endpoint == "improve":
+            target = "image" if "watercolor" in prompt else "text"
+            return endpoint, "POST", "/api/improve", {"prompt": prompt, "target": target}
+        return endpoint, "GET", "/api/models", None
+
+
+async def _issue(client: httpx.AsyncClient, factory: RequestFactory) -> Sample:
+    endpoint, method, path, payload = factory.next()
+    sample = Sample(endpoint)
+    started = time.perf_counter()
+    try:
+        request = client.build_request(method, path, json=payload)
+        response = await client.send(request, stream=True)
+        sample.ttfb = time.perf_counter() - started
+        try:
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        sample.latency = time.perf_counter() - started
+        sample.status = response.status_code
+        if response.status_code == 200:
+            try:
+                sample.app_error = bool(json.loads(body).get("error"))
+            except ValueError:
+                sample.app_error = True
+    except httpx.HTTPError as exc:
+        sample.latency = time.perf_counter() - started
+        sample.transport_error = type(exc).__name__
+    return sample
+
+
+async def run_closed_loop(client: httpx.AsyncClient, factory: RequestFactory, concurrency: int, deadline: float, limit: Optional[int]) -> List[Sample]:
+    samples: List[Sample] = []
+    issued = itertools.count()
+
+    async def _worker() -> None:
+        while time.perf_counter() < deadline:
+            if limit is not None and next(issued) >= limit:
+                return
+            samples.append(await _issue(client, factory))
+
+    await asyncio.gather(*(_worker() for _ in range(max(1, concurrency))))
+    return samples
+
+
+async def run_open_loop(client: httpx.AsyncClient, factory: RequestFactory, rate: float, deadline: float, limit: Optional[int], max_inflight: int) -> Tuple[List[Sample], int]:
+    samples: List[Sample] = []
+    tasks = set()
+    dropped = 0
+    rng = random.Random(factory.rng.random())
+    next_at = time.perf_counter()
+    issued = 0
+
+    while time.perf_counter() < deadline and (limit is None or issued < limit):
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        next_at += rng.expovariate(rate)
+        issued += 1
+        if len(tasks) >= max_inflight:
+            # Count arrivals the generator could not admit instead of silently slowing down.
+            dropped += 1
+            continue
+        task = asyncio.create_task(_issue(client, factory))
+        tasks.add(task)
+        task.add_done_callback(lambda done: (tasks.discard(done), samples.append(done.result())))
+
+    if tasks:
+        await asyncio.gather(*list(tasks), return_exceptions=True)
+    return samples, dropped
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(samples: List[Sample], elapsed: float, config: Dict[str, Any], dropped: int = 0) -> Dict[str, Any]:
+    def _section(group: List[Sample]) -> Dict[str, Any]:
+        ok = [sample for sample in group if sample.ok]
+        statuses = Counter(str(sample.status or sample.transport_error) for sample in group)
+        return {
+            "requests": len(group),
+            "ok": len(ok),
+            "app_errors": sum(1 for sample in group if sample.app_error),
+            "statuses": dict(statuses),
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+            "latency": summarize([sample.latency for sample in ok]),
+            "ttfb": summarize([sample.ttfb for sample in ok]),
+        }
+
+    by_endpoint: Dict[str, List[Sample]] = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample.endpoint].append(sample)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": config,
+        "elapsed_s": round(elapsed, 3),
+        "dropped_arrivals": dropped,
+        "overall": _section(samples),
+        "endpoints": {name: _section(group) for name, group in sorted(by_endpoint.items())},
+    }
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    rows = [("overall", report["overall"])] + list(report["endpoints"].items())
+    print(f"{'scope':<10}{'reqs':>8}{'ok':>8}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'ttfb95':>10}")
+    for name, section in rows:
+        latency = section["latency"]
+        print(
+            f"{name:<10}{section['requests']:>8}{section['ok']:>8}{section['throughput_rps']:>10.1f}"
+            f"{latency['p50_ms']:>10.1f}{latency['p95_ms']:>10.1f}{latency['p99_ms']:>10.1f}{section['ttfb']['p95_ms']:>10.1f}"
+        )
+        previous = (baseline or {}).get("endpoints", {}).get(name) if name != "overall" else (baseline or {}).get("overall")
+        if previous:
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                before = previous["latency"][key]
+                after = latency[key]
+                change = ((after - before) / before * 100) if before else 0.0
+                print(f"{'':<10}{key} {before:.1f} -> {after:.1f} ms ({change:+.1f}%)")
+            before_rps = previous["throughput_rps"]
+            change_rps = ((section["throughput_rps"] - before_rps) / before_rps * 100) if before_rps else 0.0
+            print(f"{'':<10}rps {before_rps:.1f} -> {section['throughput_rps']:.1f} ({change_rps:+.1f}%)")
+    if report["dropped_arrivals"]:
+        print(f"dropped arrivals (max in-flight reached): {report['dropped_arrivals']}")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    endpoints = [name.strip() for name in args.endpoint.split(",") if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoint(s): {', '.join(unknown)}")
+    weights = [int(value) for value in args.mix.split(",")] if args.mix else [1] * len(endpoints)
+    if len(weights) != len(endpoints):
+        raise SystemExit("--mix needs one weight per endpoint")
+
+    factory = RequestFactory(endpoints, weights, args.senders, args.model, args.seed)
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.max_inflight), max_keepalive_connections=max(args.concurrency, args.max_inflight))
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        for _ in range(args.warmup):
+            await _issue(client, factory)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        dropped = 0
+        if args.rate:
+            samples, dropped = await run_open_loop(client, factory, args.rate, deadline, args.requests, args.max_inflight)
+        else:
+            samples = await run_closed_loop(client, factory, args.concurrency, deadline, args.requests)
+        elapsed = time.perf_counter() - started
+
+    config = {
+        "base_url": args.base_url,
+        "endpoints": endpoints,
+        "mix": weights,
+        "mode": "open" if args.rate else "closed",
+        "concurrency": None if args.rate else args.concurrency,
+        "rate": args.rate,
+        "duration_s": args.duration,
+        "requests_limit": args.requests,
+        "senders": args.senders,
+        "label": args.label,
+    }
+    return build_report(samples, elapsed, config, dropped)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Drive the Prompthash API at fixed concurrency or arrival rate.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", default="chat", help="Comma-separated subset of chat,improve,models.")
+    parser.add_argument("--mix", default=None, help="Comma-separated weights matching --endpoint.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Closed-loop worker count.")
+    parser.add_argument("--rate", type=float, default=None, help="Open-loop arrivals per second.")
+    parser.add_argument("--max-inflight", type=int, default=512, help="Open-loop cap on outstanding requests.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run.")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after this many requests.")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before the run.")
+    parser.add_argument("--senders", type=int, default=50, help="Distinct chat sender ids to rotate through.")
+    parser.add_argument("--model", default=None, help="Model id sent with chat requests.")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default=None, help="Free-form tag stored with the results.")
+    parser.add_argument("--output", default=None, help="Result path; defaults to benchmarks/results/<timestamp>.json.")
+    parser.add_argument("--compare", default=None, help="Previous result JSON to diff against.")
+    return parser
+
+
+def save_report(report: Dict[str, Any], output: Optional[str]) -> Path:
+    if output:
+        path = Path(output)
+    else:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        suffix = f"-{report['config']['label']}" if report["config"].get("label") else ""
+        path = RESULTS_DIR / f"{stamp}-{'-'.join(report['config']['endpoints'])}{suffix}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return path
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = build_parser().parse_args(argv)
+    report = asyncio.run(run(args))
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_report(report, baseline)
+    print(f"results written to {save_report(report, args.output)}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
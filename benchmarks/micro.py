@@ -0,0 +1,243 @@
+"""
+Microbenchmarks for the pure functions that run on every request.
+
+Each case is timed (best of several repeats, reported as calls per second)
+and its per-call peak allocation is measured with ``tracemalloc``. Results
+are compared against ``benchmarks/baselines/micro.json``; the command exits
+non-zero when throughput drops or allocations grow beyond the thresholds:
+
+    python -m benchmarks.micro                      # compare with the baseline
+    python -m benchmarks.micro --update-baseline    # record a new baseline
+    python -m benchmarks.micro --only chat --throughput-threshold 0.3
+"""
+
+import argparse
+import asyncio
+import atexit
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from prompthash_api.core.state import ChatState
+from prompthash_api.services.chat_service import ChatService
+from prompthash_api.services.model_list_service import ModelListService
+from prompthash_api.services.prompt_improver_service import PromptImproverService
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "micro.json"
+
+
+@dataclass
+class Case:
+    name: str
+    func: Callable[[], Any]
+    # Number of logical operations one call of ``func`` performs (for batched async cases).
+    ops_per_call: int = 1
+
+
+def _history(turns: int = 10) -> List[Dict[str, str]]:
+    history: List[Dict[str, str]] = []
+    for index in range(turns):
+        history.append({"role": "user", "text": f"Question {index}: how do I tune connection pools for service {index}? " * 3})
+        history.append({"role": "assistant", "text": f"Answer {index}: size the pool to concurrency and watch queueing. " * 12})
+    return history[-10:]
+
+
+def _think_block(size_kb: int = 8) -> str:
+    thought = "Let me reason about the request step by step and consider trade-offs. "
+    body = "The final answer uses bounded pools, backpressure and timeouts. "
+    return f"<think>{thought * (size_kb * 1024 // len(thought))}</think>\n{body * 20}"
+
+
+def _catalogue(count: int = 500):
+    kinds = ["", "-vision", "-tts", "-video", "-image", "-audio", "-instruct", "-live"]
+    names = [f"vendor{index % 7}/model-{index:03d}{kinds[index % len(kinds)]}" for index in range(count)]
+    details = {
+        name: {"name": name, "display_name": name.split("/")[-1].replace("-", " ").title(), "description": "Mock model"}
+        for name in names
+    }
+    return names, details
+
+
+def build_cases() -> List[Case]:
+    chat = ChatService(client=object())
+    improver = PromptImproverService(client=object())
+    history = _history()
+    think_reply = _think_block()
+    plain_reply = "Plain answer without reasoning tags. " * 40
+    long_prompt = "Write a product description for a waterproof hiking backpack with 30L capacity. " * 10
+    names, details = _catalogue()
+
+    loop = asyncio.new_event_loop()
+    # Closed before interpreter teardown, which otherwise closes its self-pipe first and logs a traceback.
+    atexit.register(loop.close)
+    batch = 200
+
+    async def _record_batch() -> None:
+        state = ChatState()
+        for index in range(batch):
+            await state.record_exchange(f"sender-{index % 50}", "hello there", plain_reply)
+
+    async def _history_batch(state: ChatState) -> None:
+        for index in range(batch):
+            await state.get_history(f"sender-{index % 50}")
+
+    warm_state = ChatState()
+    loop.run_until_complete(_record_batch())
+    for index in range(50):
+        loop.run_until_complete(warm_state.record_exchange(f"sender-{index}", "hello", plain_reply))
+
+    return [
+        Case("chat.build_messages.10_turns", lambda: chat._build_messages(history, "And what about timeouts?")),
+        Case("chat.format_output.think_8kb", lambda: ChatService._format_assistant_output(think_reply)),
+        Case("chat.format_output.plain", lambda: ChatService._format_assistant_output(plain_reply)),
+        Case("improver.build_prompt.text", lambda: improver._build_improvement_prompt(long_prompt, "text")),
+        Case("improver.build_prompt.image", lambda: improver._build_improvement_prompt(long_prompt, "image")),
+        Case("models.categorize.500", lambda: ModelListService._categorize_models(names, details)),
+        Case("state.record_exchange", lambda: loop.run_until_complete(_record_batch()), ops_per_call=batch),
+        Case("state.get_history", lambda: loop.run_until_complete(_history_batch(warm_state)), ops_per_call=batch),
+    ]
+
+
+def _time_case(case: Case, min_time: float, repeats: int) -> float:
+    """Return the best observed operations per second across ``repeats`` runs."""
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            case.func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= 0.01:
+            break
+        calls *= 2
+    calls = max(1, int(calls * min_time / elapsed))
+
+    best = float("inf")
+    # Mirror timeit: keep the collector from adding noise to the timed loop.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            for _ in range(calls):
+                case.func()
+            best = min(best, time.perf_counter() - started)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return calls * case.ops_per_call / best
+
+
+def _peak_allocation(case: Case) -> int:
+    """Peak bytes allocated by a single operation of ``case``."""
+    case.func()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        case.func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0, peak - base) // case.ops_per_call
+
+
+def run_cases(cases: List[Case], min_time: float, repeats: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for case in cases:
+        results[case.name] = {
+            "ops_per_sec": round(_time_case(case, min_time, repeats), 1),
+            "peak_bytes": _peak_allocation(case),
+        }
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    throughput_threshold: float,
+    alloc_threshold: float,
+) -> List[str]:
+    """Return human-readable regression messages (empty when within thresholds)."""
+    regressions: List[str] = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        floor = previous["ops_per_sec"] * (1 - throughput_threshold)
+        if current["ops_per_sec"] < floor:
+            regressions.append(f"{name}: throughput {current['ops_per_sec']:.0f}/s below {floor:.0f}/s (baseline {previous['ops_per_sec']:.0f}/s)")
+        # Small absolute slack keeps tiny allocations from tripping on interpreter noise.
+        ceiling = previous["peak_bytes"] * (1 + alloc_threshold) + 256
+        if current["peak_bytes"] > ceiling:
+            regressions.append(f"{name}: peak allocation {current['peak_bytes']} B above {ceiling:.0f} B (baseline {previous['peak_bytes']} B)")
+    return regressions
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'case':<34}{'ops/s':>14}{'vs base':>10}{'peak B':>10}{'vs base':>10}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        ops_delta = bytes_delta = ""
+        if previous:
+            ops_delta = f"{(current['ops_per_sec'] / previous['ops_per_sec'] - 1) * 100:+.1f}%"
+            if previous["peak_bytes"]:
+                bytes_delta = f"{(current['peak_bytes'] / previous['peak_bytes'] - 1) * 100:+.1f}%"
+        print(f"{name:<34}{current['ops_per_sec']:>14.0f}{ops_delta:>10}{current['peak_bytes']:>10}{bytes_delta:>10}")
+
+
+def load_baseline(path: Path) -> Dict[str, Dict[str, float]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8")).get("cases", {})
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run hot-path microbenchmarks and check for regressions.")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--throughput-threshold", type=float, default=0.25, help="Allowed fractional ops/s drop.")
+    parser.add_argument("--alloc-threshold", type=float, default=0.10, help="Allowed fractional peak-allocation growth.")
+    parser.add_argument("--min-time", type=float, default=0.1, help="Approximate seconds per timing repeat.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--confirm", type=int, default=2, help="Re-runs of a case before reporting a throughput regression.")
+    parser.add_argument("--only", default=None, help="Substring filter on case names.")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in build_cases() if not args.only or args.only in case.name]
+    results = run_cases(cases, args.min_time, args.repeats)
+    baseline_path = Path(args.baseline)
+    baseline = load_baseline(baseline_path)
+    print_results(results, baseline)
+
+    if args.update_baseline:
+        merged = {**baseline, **results}
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(
+            json.dumps({"python": platform.python_version(), "machine": platform.machine(), "cases": merged}, indent=2) + "\n",
+            encoding="utf-8",
+        )
+        print(f"baseline written to {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline, args.throughput_threshold, args.alloc_threshold)
+    # Re-measure suspected throughput regressions so a single noisy run does not fail the check.
+    for _ in range(args.confirm):
+        suspects = [case for case in cases if any(message.startswith(f"{case.name}: throughput") for message in regressions)]
+        if not suspects:
+            break
+        for case in suspects:
+            results[case.name]["ops_per_sec"] = max(results[case.name]["ops_per_sec"], round(_time_case(case, args.min_time, args.repeats), 1))
+        regressions = compare(results, baseline, args.throughput_threshold, args.alloc_threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
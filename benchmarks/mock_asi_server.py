@@ -0,0 +1,265 @@
+"""
+Local OpenAI-compatible stand-in for ASI Cloud.
+
+Point the service at it with ``ASICLOUD_BASE_URL=http://127.0.0.1:9100/v1``
+and any non-empty ``ASICLOUD_API_KEY``. Latency, token rate, streaming and
+error injection are configurable so the service can be load tested offline:
+
+    python -m benchmarks.mock_asi_server --port 9100 --latency-dist lognormal \
+        --latency-ms 250 --latency-spread-ms 120 --tokens-per-sec 80 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+_VOCABULARY = (
+    "prompt model latency token stream answer context request response cache upstream service "
+    "clear specific concise example detail structure image text style lighting camera format"
+).split()
+
+
+@dataclass
+class MockConfig:
+    """Behavior knobs for the stub upstream."""
+
+    latency_dist: str = "fixed"
+    latency_ms: float = 200.0
+    latency_spread_ms: float = 50.0
+    tokens_per_sec: float = 0.0
+    output_tokens: int = 120
+    output_tokens_max: Optional[int] = None
+    chunk_tokens: int = 4
+    think_rate: float = 0.0
+    error_rate: float = 0.0
+    error_statuses: List[int] = field(default_factory=lambda: [500, 503, 429])
+    hang_rate: float = 0.0
+    hang_seconds: float = 120.0
+    model_count: int = 40
+    seed: Optional[int] = None
+
+    def sample_ttfb(self, rng: random.Random) -> float:
+        """Time to first byte in seconds, drawn from the configured distribution."""
+        mean = self.latency_ms
+        spread = self.latency_spread_ms
+        if self.latency_dist == "uniform":
+            value = rng.uniform(max(0.0, mean - spread), mean + spread)
+        elif self.latency_dist == "normal":
+            value = rng.gauss(mean, spread)
+        elif self.latency_dist == "lognormal":
+            # Parameterize by median and spread so tails grow with the spread.
+            sigma = spread / mean if mean > 0 else 0.0
+            value = rng.lognormvariate(0.0, sigma) * mean
+        elif self.latency_dist == "exponential":
+            value = rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+        else:
+            value = mean
+        return max(0.0, value) / 1000.0
+
+    def sample_output_tokens(self, rng: random.Random, max_tokens: Optional[int]) -> int:
+        upper = self.output_tokens_max or self.output_tokens
+        count = rng.randint(min(self.output_tokens, upper), max(self.output_tokens, upper))
+        if max_tokens:
+            count = min(count, int(max_tokens))
+        return max(1, count)
+
+
+class MockUpstream:
+    """Request counters plus the random source shared by all handlers."""
+
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.counters: Dict[str, int] = {"requests": 0, "streamed": 0, "errors": 0, "hangs": 0}
+
+    def model_ids(self) -> List[str]:
+        kinds = ["", "-vision", "-tts", "-video", "-image", "-audio"]
+        ids = ["openai/gpt-oss-20b"]
+        for index in range(max(0, self.config.model_count - 1)):
+            ids.append(f"mock/model-{index:03d}{kinds[index % len(kinds)]}")
+        return ids
+
+    def completion_text(self, tokens: int) -> List[str]:
+        words = [self.rng.choice(_VOCABULARY) for _ in range(tokens)]
+        if self.config.think_rate and self.rng.random() < self.config.think_rate and tokens > 4:
+            split = tokens // 3
+            words = ["<think>"] + words[:split] + ["</think>"] + words[split:]
+        return words
+
+
+def _estimate_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(max(1, len(str(message.get("content") or "")) // 4) for message in messages)
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def create_mock_app(config: MockConfig) -> FastAPI:
+    upstream = MockUpstream(config)
+    app = FastAPI(title="Mock ASI Cloud", version="1.0.0")
+    app.state.upstream = upstream
+
+    async def _maybe_fail() -> Optional[JSONResponse]:
+        if config.hang_rate and upstream.rng.random() < config.hang_rate:
+            upstream.counters["hangs"] += 1
+            await asyncio.sleep(config.hang_seconds)
+        if config.error_rate and upstream.rng.random() < config.error_rate:
+            upstream.counters["errors"] += 1
+            status_code = upstream.rng.choice(config.error_statuses)
+            return JSONResponse(
+                status_code=status_code,
+                content={"error": {"message": "injected upstream failure", "type": "mock_error", "code": status_code}},
+            )
+        return None
+
+    @app.get("/v1/models")
+    async def list_models():
+        upstream.counters["requests"] += 1
+        await asyncio.sleep(config.sample_ttfb(upstream.rng))
+        failure = await _maybe_fail()
+        if failure is not None:
+            return failure
+        created = int(time.time())
+        return {
+            "object": "list",
+            "data": [{"id": model_id, "object": "model", "created": created, "owned_by": "mock"} for model_id in upstream.model_ids()],
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        upstream.counters["requests"] += 1
+        body = await request.json()
+        model = body.get("model") or "mock/model"
+        messages = body.get("messages") or []
+        prompt_tokens = _estimate_prompt_tokens(messages)
+        completion_tokens = config.sample_output_tokens(upstream.rng, body.get("max_tokens"))
+        finish_reason = "length" if body.get("max_tokens") and completion_tokens >= int(body["max_tokens"]) else "stop"
+        words = upstream.completion_text(completion_tokens)
+        per_token = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        await asyncio.sleep(config.sample_ttfb(upstream.rng))
+        failure = await _maybe_fail()
+        if failure is not None:
+            return failure
+
+        if not body.get("stream"):
+            await asyncio.sleep(per_token * completion_tokens)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(words)},
+                        "finish_reason": finish_reason,
+                    }
+                ],
+                "usage": _usage(prompt_tokens, completion_tokens),
+            }
+
+        upstream.counters["streamed"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def _chunk(delta: Dict[str, Any], finish: Optional[str] = None, usage: Optional[Dict[str, Any]] = None) -> str:
+            payload: Dict[str, Any] = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if usage is not None else [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def _events() -> AsyncIterator[str]:
+            yield _chunk({"role": "assistant", "content": ""})
+            step = max(1, config.chunk_tokens)
+            for start in range(0, len(words), step):
+                piece = words[start : start + step]
+                if per_token:
+                    await asyncio.sleep(per_token * len(piece))
+                prefix = "" if start == 0 else " "
+                yield _chunk({"content": prefix + " ".join(piece)})
+            yield _chunk({}, finish=finish_reason)
+            if include_usage:
+                yield _chunk({}, usage=_usage(prompt_tokens, completion_tokens))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(_events(), media_type="text/event-stream")
+
+    @app.get("/mock/stats")
+    async def stats():
+        return {"config": asdict(config), "counters": dict(upstream.counters)}
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible ASI Cloud stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Mean (or median for lognormal) TTFB.")
+    parser.add_argument("--latency-spread-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Generation rate; 0 means instant.")
+    parser.add_argument("--output-tokens", type=int, default=120)
+    parser.add_argument("--output-tokens-max", type=int, default=None, help="Sample uniformly up to this length.")
+    parser.add_argument("--chunk-tokens", type=int, default=4, help="Tokens per streamed chunk.")
+    parser.add_argument("--think-rate", type=float, default=0.0, help="Share of replies wrapped in <think> blocks.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-statuses", default="500,503,429", help="Comma-separated HTTP statuses to inject.")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests that stall before replying.")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--models", type=int, default=40, dest="model_count")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_spread_ms=args.latency_spread_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        output_tokens=args.output_tokens,
+        output_tokens_max=args.output_tokens_max,
+        chunk_tokens=args.chunk_tokens,
+        think_rate=args.think_rate,
+        error_rate=args.error_rate,
+        error_statuses=[int(code) for code in args.error_statuses.split(",") if code.strip()],
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        model_count=args.model_count,
+        seed=args.seed,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    args = build_parser().parse_args(argv)
+    uvicorn.run(create_mock_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+End-to-end offline benchmark: mock upstream + service + load generator.
+
+Starts ``benchmarks.mock_asi_server`` and the FastAPI app (pointed at the
+mock through ``ASICLOUD_BASE_URL``) as subprocesses, waits for both to be
+ready, runs ``benchmarks.loadgen`` and tears everything down. The service
+gets a fresh temporary data directory and runs with its response caches
+off, so each run starts cold and measures upstream calls, not cache hits.
+Arguments not recognized here are forwarded to the load generator:
+
+    python -m benchmarks.run_e2e --mock-args "--latency-ms 150 --tokens-per-sec 200" \
+        --endpoint chat,improve,models --mix 8,1,1 --concurrency 32 --duration 20
+"""
+
+import argparse
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+from benchmarks import loadgen
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _wait_ready(url: str, timeout: float, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"process for {url} exited early with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise SystemExit(f"timed out waiting for {url}")
+
+
+def _stop(process: Optional[subprocess.Popen]) -> None:
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the service against the local mock upstream and load test it.")
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-args", default="", help="Extra arguments for benchmarks.mock_asi_server.")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--app-workers", type=int, default=1)
+    parser.add_argument("--ready-timeout", type=float, default=30.0)
+    args, loadgen_args = parser.parse_known_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="prompthash-bench-")
+    env = dict(os.environ)
+    # Persisted state follows the data directory; explicit paths would point back at the real one.
+    for name in ("USAGE_DB_PATH", "JOBS_DB_PATH", "SNAPSHOT_PATH"):
+        env.pop(name, None)
+    env.update(
+        {
+            "ASICLOUD_API_KEY": env.get("BENCH_API_KEY", "mock-key"),
+            "ASICLOUD_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+            "PYTHONPATH": str(REPO_ROOT) + os.pathsep + env.get("PYTHONPATH", ""),
+            "PROMPTHASH_DATA_DIR": data_dir,
+            "IMPROVE_CACHE_SIZE": "0",
+            "CHAT_ANSWER_CACHE_SIZE": "0",
+        }
+    )
+
+    mock = app = None
+    try:
+        mock = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.mock_asi_server", "--port", str(args.mock_port), *shlex.split(args.mock_args)],
+            cwd=REPO_ROOT,
+            env=env,
+        )
+        _wait_ready(f"http://127.0.0.1:{args.mock_port}/mock/stats", args.ready_timeout, mock)
+
+        app = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "prompthash_api.main:app",
+                "--host", "127.0.0.1", "--port", str(args.app_port),
+                "--workers", str(args.app_workers), "--log-level", "warning", "--no-access-log",
+            ],
+            cwd=REPO_ROOT,
+            env=env,
+        )
+        _wait_ready(f"http://127.0.0.1:{args.app_port}/api/health/raw", args.ready_timeout, app)
+
+        loadgen.main(["--base-url", f"http://127.0.0.1:{args.app_port}", *loadgen_args])
+        print("mock upstream:", httpx.get(f"http://127.0.0.1:{args.mock_port}/mock/stats", timeout=5.0).json()["counters"])
+    finally:
+        _stop(app)
+        _stop(mock)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Offline bulk prompt improvement.
+
+Streams prompts from a JSONL or CSV file (or stdin) through
+:class:`PromptImproverService` and appends one JSON line per result as items
+complete. Only a small bounded queue of items is in memory at a time.
+
+    python -m prompthash_api.bulk_improve prompts.jsonl -o improved.jsonl --concurrency 16 --rate 5
+
+Each input record needs a ``prompt`` field, and may carry ``id`` (defaults to
+the 1-based record number) and ``target`` (``text`` or ``image``). The output
+file doubles as the checkpoint: rerunning with the same ``-o`` skips ids
+that already succeeded, and with ``--retry-failed`` it also redoes failures.
+A throughput, latency and token summary is printed to stderr at the end.
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO
+
+from prompthash_api.clients.asi_client import build_openai_client
+from prompthash_api.core.admission import BULK, AdmissionController, TokenBucket
+from prompthash_api.core.deadlines import deadline_scope
+from prompthash_api.core.usage import get_usage_tracker
+from prompthash_api.schemas.improver import ImproveRequest
+from prompthash_api.services.prompt_improver_service import PromptImproverService
+
+_DONE = object()
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yield input records one at a time, filling in ``id`` from the record number."""
+    if fmt == "csv":
+        rows: Iterator[Dict[str, Any]] = csv.DictReader(stream)
+    else:
+        rows = (json.loads(line) for line in stream if line.strip())
+    for number, row in enumerate(rows, start=1):
+        record = dict(row)
+        if not record.get("id"):
+            record["id"] = str(number)
+        yield record
+
+
+def load_checkpoint(path: Path, retry_failed: bool) -> Set[str]:
+    """Ids already present in the output file that should not be processed again."""
+    done: Set[str] = set()
+    if not path.exists():
+        return done
+    with path.open("r", encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run; that item is redone.
+                continue
+            if not (retry_failed and item.get("error")):
+                done.add(str(item.get("id")))
+    return done
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))]
+
+
+class RateLimiter:
+    """Async wrapper around a token bucket; ``rate`` <= 0 disables it."""
+
+    def __init__(self, rate: float) -> None:
+        self._bucket = TokenBucket(rate, max(1.0, rate), time.monotonic()) if rate > 0 else None
+
+    async def acquire(self) -> None:
+        while self._bucket is not None:
+            wait = self._bucket.try_take(1, time.monotonic())
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class BulkRun:
+    """One bulk improvement run: a reader feeding a bounded queue drained by a worker pool."""
+
+    def __init__(
+        self,
+        service: PromptImproverService,
+        concurrency: int,
+        rate: float,
+        retries: int,
+        timeout: float,
+        sender: str,
+        default_target: str,
+    ) -> None:
+        self.service = service
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.timeout = timeout
+        self.sender = sender
+        self.default_target = default_target
+
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.latencies: List[float] = []
+
+    async def _improve(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        request = ImproveRequest(
+            prompt=str(record.get("prompt") or ""),
+            target=record.get("target") or self.default_target,
+            sender=self.sender,
+        )
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                with deadline_scope(self.timeout):
+                    response = await self.service.improve_prompt(request, priority=BULK)
+                error = response.error
+            except Exception as exc:
+                response, error = None, str(exc) or type(exc).__name__
+            if not error or attempt >= self.retries or not request.prompt:
+                break
+            attempt += 1
+            await asyncio.sleep(min(30.0, 2**attempt))
+
+        latency = time.perf_counter() - started
+        self.latencies.append(latency)
+        if error:
+            self.failed += 1
+        else:
+            self.succeeded += 1
+        return {
+            "id": record["id"],
+            "target": response.target if response else request.target,
+            "prompt": request.prompt,
+            "response": response.response if response else "",
+            "error": error,
+            "attempts": attempt + 1,
+            "latency_ms": round(latency * 1000, 1),
+        }
+
+    async def run(self, records: Iterator[Dict[str, Any]], done: Set[str], output: TextIO, progress_every: float) -> None:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker() -> None:
+            while True:
+                record = await queue.get()
+                if record is _DONE:
+                    return
+                result = await self._improve(record)
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+
+        async def report() -> None:
+            while True:
+                await asyncio.sleep(progress_every)
+                print(f"progress: {self.succeeded} ok, {self.failed} failed, {self.skipped} skipped", file=sys.stderr)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(report()) if progress_every > 0 else None
+        try:
+            for record in records:
+                if str(record["id"]) in done:
+                    self.skipped += 1
+                    continue
+                await queue.put(record)
+            for _ in workers:
+                await queue.put(_DONE)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            if reporter is not None:
+                reporter.cancel()
+
+    def summary(self, elapsed: float, window_seconds: int) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        _, totals = get_usage_tracker().top(by="endpoint", window_seconds=window_seconds)
+        processed = self.succeeded + self.failed
+        return {
+            "processed": processed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed_s": round(elapsed, 3),
+            "items_per_s": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "mean": round(sum(ordered) / len(ordered) * 1000, 1) if ordered else 0.0,
+                "p50": round(_percentile(ordered, 50) * 1000, 1),
+                "p95": round(_percentile(ordered, 95) * 1000, 1),
+                "p99": round(_percentile(ordered, 99) * 1000, 1),
+                "max": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+            },
+            "tokens": {
+                "prompt": totals["prompt_tokens"],
+                "completion": totals["completion_tokens"],
+                "total": totals["total_tokens"],
+            },
+        }
+
+
+async def _main(args: argparse.Namespace) -> Dict[str, Any]:
+    # The run bounds its own concurrency, so the server-side admission limits are turned off.
+    service = PromptImproverService(
+        client=build_openai_client(require_api_key=True),
+        admission=AdmissionController(enabled=False),
+    )
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.concurrency + 4))
+
+    output_path = Path(args.output)
+    done = set() if args.no_resume else load_checkpoint(output_path, args.retry_failed)
+    if output_path.exists() and output_path.stat().st_size:
+        # Terminate a line left half-written by an interrupted run before appending.
+        with output_path.open("rb") as handle:
+            handle.seek(-1, io.SEEK_END)
+            needs_newline = handle.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    fmt = args.format or ("csv" if args.input.endswith(".csv") else "jsonl")
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8", newline="")
+    bulk = BulkRun(service, args.concurrency, args.rate, args.retries, args.timeout, args.sender, args.target)
+    started = time.perf_counter()
+    try:
+        with output_path.open("w" if args.no_resume else "a", encoding="utf-8") as output:
+            if needs_newline and not args.no_resume:
+                output.write("\n")
+            await bulk.run(read_records(source, fmt), done, output, args.progress_every)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    elapsed = time.perf_counter() - started
+    await get_usage_tracker().flush()
+    return bulk.summary(elapsed, int(elapsed) + 60)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Improve prompts from a JSONL/CSV dataset in bulk.")
+    parser.add_argument("input", help="JSONL or CSV file with a 'prompt' column, or - for stdin.")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results file; also the resume checkpoint.")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="Input format (default: by extension).")
+    parser.add_argument("--target", choices=["text", "image"], default="text", help="Target for records without one.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Prompts improved in parallel.")
+    parser.add_argument("--rate", type=float, default=0.0, help="Maximum upstream requests per second (0 = unlimited).")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per item after a failed attempt.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds allowed per attempt.")
+    parser.add_argument("--sender", default="bulk-cli", help="Sender id used for usage accounting.")
+    parser.add_argument("--retry-failed", action="store_true", help="On resume, redo items whose last result was an error.")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore and overwrite an existing output file.")
+    parser.add_argument("--progress-every", type=float, default=10.0, help="Seconds between progress lines (0 = off).")
+    parser.add_argument("--summary", default=None, help="Also write the final summary JSON to this path.")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        print("interrupted; rerun the same command to resume", file=sys.stderr)
+        return 130
+    text = json.dumps(summary, indent=2)
+    print(text, file=sys.stderr)
+    if args.summary:
+        Path(args.summary).write_text(text + "\n", encoding="utf-8")
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
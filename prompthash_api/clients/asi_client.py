@@ -1,9 +1,19 @@
+import asyncio
+import time
+from dataclasses import dataclass
 from functools import lru_cache
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, TypeVar
 
 from openai import OpenAI
 
+from prompthash_api.core.admission import Ticket
 from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import DEADLINE, DeadlineExceeded, current_deadline
+from prompthash_api.core.metrics import UPSTREAM_IN_FLIGHT, observe_upstream
+from prompthash_api.core.timing import record_phase, tag_request, to_thread
+from prompthash_api.core.usage import get_usage_tracker
+
+T = TypeVar("T")
 
 
 @lru_cache
@@ -25,3 +35,151 @@ def build_openai_client(require_api_key: bool = False) -> Optional[OpenAI]:
 
     return OpenAI(api_key=api_key, base_url=settings.asi_base_url)
 
+
+@dataclass
+class ChatCompletionResult:
+    """Normalized outcome of one upstream chat completion."""
+
+    content: str
+    model: str
+    finish_reason: Optional[str] = None
+    usage: Optional[Dict[str, int]] = None
+
+
+def _usage_dict(usage: Any) -> Optional[Dict[str, int]]:
+    if usage is None:
+        return None
+    # Prompt tokens the upstream served from its prefix cache; absent on providers without one.
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+        "total_tokens": getattr(usage, "total_tokens", None) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+    }
+
+
+def create_chat_completion(client: OpenAI, model: str, messages: List[Dict[str, str]], **params: Any) -> ChatCompletionResult:
+    """
+    Run a blocking chat completion and record upstream timing phases.
+
+    With streaming enabled the first chunk marks the upstream time to first
+    byte (``ttfb``) and the rest is generation (``gen``); otherwise the whole
+    call is recorded as ``upstream``. Call this from a worker thread.
+
+    The request's remaining deadline becomes the HTTP timeout, with SDK
+    retries off so the call cannot outlive it. A cancelled request
+    (deadline or client disconnect) stops reading the stream, which closes
+    the upstream connection. A non-streaming call cannot be aborted once
+    sent; it runs until the upstream answers or the timeout passes.
+    """
+    settings = get_settings()
+    started = time.perf_counter()
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check()
+        remaining = deadline.remaining()
+        if remaining is not None:
+            client = client.with_options(max_retries=0, timeout=remaining)
+
+    if not settings.upstream_streaming:
+        response = client.chat.completions.create(model=model, messages=messages, **params)
+        record_phase("upstream", time.perf_counter() - started)
+        choice = response.choices[0]
+        return ChatCompletionResult(
+            content=(choice.message.content or "").strip(),
+            model=getattr(response, "model", None) or model,
+            finish_reason=choice.finish_reason,
+            usage=_usage_dict(getattr(response, "usage", None)),
+        )
+
+    parts: List[str] = []
+    reported_model: Optional[str] = None
+    finish_reason: Optional[str] = None
+    usage: Optional[Dict[str, int]] = None
+    first_chunk_at: Optional[float] = None
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **params,
+    )
+    with stream:
+        for chunk in stream:
+            if deadline is not None and deadline.is_cancelled():
+                raise DeadlineExceeded("The upstream call was abandoned.")
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+                record_phase("ttfb", first_chunk_at - started)
+            if not reported_model:
+                reported_model = getattr(chunk, "model", None)
+            if getattr(chunk, "usage", None) is not None:
+                usage = _usage_dict(chunk.usage)
+            for choice in chunk.choices:
+                if choice.delta and choice.delta.content:
+                    parts.append(choice.delta.content)
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+    record_phase("gen", time.perf_counter() - (first_chunk_at or started))
+
+    return ChatCompletionResult(
+        content="".join(parts).strip(),
+        model=reported_model or model,
+        finish_reason=finish_reason,
+        usage=usage,
+    )
+
+
+async def run_upstream(
+    endpoint: str,
+    model: str,
+    func: Callable[..., T],
+    *args: Any,
+    sender: Optional[str] = None,
+    ticket: Optional[Ticket] = None,
+    **kwargs: Any,
+) -> T:
+    """
+    Run a blocking upstream call on a worker thread and record its metrics.
+
+    ``endpoint`` names the calling flow (``chat``, ``improve``, ``models``).
+    Token usage is picked up from the result's ``usage`` attribute when present,
+    charged to ``sender`` in the usage tracker and settled against ``ticket``.
+    The call is bounded by the request deadline; on expiry the worker is told
+    to stop and :class:`DeadlineExceeded` is raised.
+
+    A worker thread cannot be interrupted, so the caller may stop waiting
+    (deadline, disconnect, a lost race) before the call returns. The call is
+    accounted for when the thread actually finishes: it stays in flight,
+    keeps ``ticket``'s admission slot, and its usage is still recorded.
+    """
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check()
+    remaining = deadline.remaining() if deadline is not None else None
+    started = time.perf_counter()
+    UPSTREAM_IN_FLIGHT.inc(endpoint)
+    call = asyncio.ensure_future(to_thread(func, *args, **kwargs))
+
+    def finished(call: "asyncio.Future[T]") -> None:
+        UPSTREAM_IN_FLIGHT.dec(endpoint)
+        elapsed = time.perf_counter() - started
+        error = asyncio.CancelledError() if call.cancelled() else call.exception()
+        usage = None if error is not None else getattr(call.result(), "usage", None)
+        observe_upstream(endpoint, model, elapsed, usage=usage, error=error)
+        get_usage_tracker().record(sender or "anonymous", model, endpoint, usage, elapsed)
+
+    call.add_done_callback(finished)
+    if ticket is not None:
+        ticket.track(call)
+    try:
+        result = await asyncio.wait_for(asyncio.shield(call), remaining)
+    except asyncio.TimeoutError:
+        # A streaming worker sees the flag and stops reading at its next chunk.
+        deadline.cancel(DEADLINE)
+        raise DeadlineExceeded() from None
+    usage = getattr(result, "usage", None)
+    if usage:
+        tag_request(prompt_tokens=usage.get("prompt_tokens", 0), cached_tokens=usage.get("cached_tokens", 0))
+    return result
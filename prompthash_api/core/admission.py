@@ -0,0 +1,453 @@
+"""
+Admission control for upstream ASI calls.
+
+Requests pass two gates before they reach the upstream:
+
+1. Per-sender token buckets, one for requests per second and one for
+   (estimated) tokens per minute. An empty bucket is an immediate 429.
+   The ``sender`` field is chosen by the client, so it only names the
+   bucket when the caller presents ``SENDER_AUTH_TOKEN``; otherwise the
+   client address does.
+2. A global cap on concurrent upstream calls, shared by priority classes
+   (interactive, standard, bulk). When every slot is busy the request waits
+   in its class, in a per-sender FIFO. Freed slots go to classes by
+   weighted stride scheduling and to senders within a class round-robin.
+   Each class may hold at most a configured share of the slots, so bulk
+   work never occupies the headroom kept for chat. A class whose oldest
+   waiter exceeds the starvation limit is served next regardless of
+   weight. A full queue, or a wait longer than the queue timeout, is a 429.
+
+Before both, the load monitor may shed the request's class while the event
+loop or the thread pool is overloaded; that is a 503. Shedding applies
+even when ``ADMISSION_ENABLED`` turns the two gates off.
+
+All bookkeeping happens on the event loop thread, without locks.
+"""
+
+import asyncio
+import math
+import secrets
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import DEADLINE, DeadlineExceeded, current_deadline
+from prompthash_api.core.metrics import registry
+from prompthash_api.core.overload import LoadMonitor, get_load_monitor
+from prompthash_api.core.timing import record_phase
+
+ADMISSION_REJECTIONS = registry.counter(
+    "prompthash_admission_rejections_total", "Requests rejected by admission control.", ["reason", "priority"]
+)
+ADMISSION_QUEUED = registry.gauge(
+    "prompthash_admission_queued", "Requests waiting for an upstream slot.", ["priority"]
+)
+ADMISSION_ACTIVE = registry.gauge("prompthash_admission_active", "Upstream slots currently held.", ["priority"])
+ADMISSION_WAIT = registry.histogram(
+    "prompthash_admission_wait_seconds",
+    "Time spent waiting for an upstream slot.",
+    ["priority"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+INTERACTIVE = "interactive"
+STANDARD = "standard"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, STANDARD, BULK)
+
+# Header clients can use to pick a priority class instead of the route default.
+PRIORITY_HEADER = "X-Priority"
+# Header carrying SENDER_AUTH_TOKEN, which lets a trusted caller rate-limit by the sender field.
+SENDER_TOKEN_HEADER = "X-Sender-Token"
+
+# Rough characters-per-token ratio used to estimate prompt size before the call.
+_CHARS_PER_TOKEN = 4
+
+
+class RateLimited(Exception):
+    """Raised when a request is refused; surfaced as HTTP 429 with ``Retry-After``."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Overloaded(RateLimited):
+    """Raised when the worker is shedding this priority class; surfaced as HTTP 503 with ``Retry-After``."""
+
+
+def estimate_tokens(texts: Iterable[str], max_tokens: int = 0) -> int:
+    """Cheap upper-bound-ish token estimate for a prompt plus its completion budget."""
+    return sum(len(text) for text in texts) // _CHARS_PER_TOKEN + int(max_tokens or 0)
+
+
+def admission_key(sender: Optional[str], client_host: Optional[str], sender_trusted: bool) -> str:
+    """Rate-limit key: the sender id from a trusted caller, otherwise the client address."""
+    if sender and sender_trusted:
+        return sender
+    return f"ip:{client_host}" if client_host else "anonymous"
+
+
+def resolve_priority(requested: Optional[str], default: str) -> str:
+    """Validate a requested priority class, falling back to the route default."""
+    value = (requested or "").strip().lower()
+    return value if value in PRIORITIES else default
+
+
+def client_host(request) -> Optional[str]:
+    """Peer address of a Starlette request, if known."""
+    return request.client.host if request.client else None
+
+
+def sender_trusted(request) -> bool:
+    """Whether a Starlette request carries the configured ``SENDER_AUTH_TOKEN``."""
+    expected = get_settings().sender_auth_token
+    supplied = request.headers.get(SENDER_TOKEN_HEADER, "")
+    return bool(expected) and secrets.compare_digest(supplied.encode(), expected.encode())
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount: float, now: float) -> float:
+        """Take ``amount``; return 0 on success or the seconds until it would fit."""
+        self._refill(now)
+        # Requests larger than the whole bucket are allowed through once it is full.
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            self.tokens -= amount
+            return 0.0
+        return (needed - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def adjust(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class Ticket:
+    """Handle for an admitted request; settles token estimates against real usage."""
+
+    __slots__ = ("_controller", "key", "estimated_tokens", "_calls", "_on_idle")
+
+    def __init__(self, controller: "AdmissionController", key: str, estimated_tokens: int) -> None:
+        self._controller = controller
+        self.key = key
+        self.estimated_tokens = estimated_tokens
+        self._calls = 0
+        self._on_idle: Optional[Callable[[], None]] = None
+
+    def settle(self, usage: Optional[Dict[str, int]]) -> None:
+        if usage:
+            self._controller.settle(self.key, self.estimated_tokens, usage.get("total_tokens", 0))
+
+    def track(self, call: "asyncio.Future") -> None:
+        """Settle ``call``'s usage when it finishes and keep the slot until then, even if the caller gives up first."""
+        self._calls += 1
+        call.add_done_callback(self._call_done)
+
+    def _call_done(self, call: "asyncio.Future") -> None:
+        self._calls -= 1
+        if not call.cancelled() and call.exception() is None:
+            self.settle(getattr(call.result(), "usage", None))
+        if not self._calls and self._on_idle is not None:
+            on_idle, self._on_idle = self._on_idle, None
+            on_idle()
+
+    def _release_when_idle(self, release: Callable[[], None]) -> None:
+        if self._calls:
+            self._on_idle = release
+        else:
+            release()
+
+
+class _PriorityClass:
+    """Waiters and slot accounting for one priority class."""
+
+    __slots__ = ("name", "weight", "limit", "active", "queued", "waiting", "rotation", "arrivals", "pass_value")
+
+    def __init__(self, name: str, weight: float, limit: int) -> None:
+        self.name = name
+        self.weight = max(weight, 0.001)
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.waiting: Dict[str, Deque[asyncio.Future]] = {}
+        self.rotation: Deque[str] = deque()
+        # (enqueued_at, future) in arrival order, used to detect starvation.
+        self.arrivals: Deque[Tuple[float, asyncio.Future]] = deque()
+        self.pass_value = 0.0
+
+    def oldest_wait(self, now: float) -> float:
+        while self.arrivals and self.arrivals[0][1].done():
+            self.arrivals.popleft()
+        return now - self.arrivals[0][0] if self.arrivals else 0.0
+
+    def pop_next(self) -> Optional[asyncio.Future]:
+        """Next live waiter, rotating round-robin across senders."""
+        while self.rotation:
+            key = self.rotation.popleft()
+            queue = self.waiting[key]
+            # Waiters that gave up stay in the deque until they reach the front.
+            while queue and queue[0].done():
+                queue.popleft()
+            if not queue:
+                del self.waiting[key]
+                continue
+            future = queue.popleft()
+            if queue:
+                self.rotation.append(key)
+            else:
+                del self.waiting[key]
+            return future
+        return None
+
+
+class AdmissionController:
+    """Per-sender rate limits plus a fair-queued global cap on upstream concurrency."""
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        queue_limit: int = 256,
+        sender_queue_limit: int = 8,
+        queue_timeout: float = 30.0,
+        requests_per_second: float = 0.0,
+        burst: float = 10.0,
+        tokens_per_minute: float = 0.0,
+        enabled: bool = True,
+        max_tracked_senders: int = 10000,
+        weights: Optional[Dict[str, float]] = None,
+        max_shares: Optional[Dict[str, float]] = None,
+        starvation_seconds: float = 10.0,
+        load_monitor: Optional[LoadMonitor] = None,
+    ) -> None:
+        self.enabled = enabled
+        self.load_monitor = load_monitor
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue_limit = queue_limit
+        self.sender_queue_limit = sender_queue_limit
+        self.queue_timeout = queue_timeout
+        self.requests_per_second = requests_per_second
+        self.burst = max(1.0, burst)
+        self.tokens_per_minute = tokens_per_minute
+        self.max_tracked_senders = max_tracked_senders
+
+        # Least recently used first, so idle senders are evicted from the front.
+        self._request_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._token_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.starvation_seconds = starvation_seconds
+
+        weights = {INTERACTIVE: 8.0, STANDARD: 3.0, BULK: 1.0, **(weights or {})}
+        max_shares = {INTERACTIVE: 1.0, STANDARD: 0.9, BULK: 0.5, **(max_shares or {})}
+        self._classes: Dict[str, _PriorityClass] = {
+            name: _PriorityClass(name, weights[name], max(1, round(self.max_concurrent * min(1.0, max_shares[name]))))
+            for name in PRIORITIES
+        }
+        self._active = 0
+        self._queued = 0
+        # Stride-scheduling virtual time; classes that become backlogged start from here.
+        self._virtual_time = 0.0
+        # Smoothed upstream hold time, used to suggest a Retry-After when the queue is full.
+        self._hold_ewma = 1.0
+
+    # -- rate limits -----------------------------------------------------
+
+    def _bucket(self, buckets: "OrderedDict[str, TokenBucket]", key: str, rate: float, capacity: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is not None:
+            buckets.move_to_end(key)
+            return bucket
+        while buckets and len(buckets) >= self.max_tracked_senders:
+            # The least recently used sender has usually refilled, so forgetting it costs nothing.
+            buckets.popitem(last=False)
+        bucket = buckets[key] = TokenBucket(rate, capacity, now)
+        return bucket
+
+    def _check_rate(self, key: str, estimated_tokens: int, priority: str) -> None:
+        now = time.monotonic()
+        if self.requests_per_second > 0:
+            bucket = self._bucket(self._request_buckets, key, self.requests_per_second, self.burst, now)
+            wait = bucket.try_take(1, now)
+            if wait:
+                ADMISSION_REJECTIONS.inc("sender_rate", priority)
+                raise RateLimited("Too many requests for this sender.", wait)
+        if self.tokens_per_minute > 0 and estimated_tokens:
+            bucket = self._bucket(self._token_buckets, key, self.tokens_per_minute / 60.0, self.tokens_per_minute, now)
+            wait = bucket.try_take(estimated_tokens, now)
+            if wait:
+                ADMISSION_REJECTIONS.inc("sender_tokens", priority)
+                raise RateLimited("Token budget for this sender is exhausted.", wait)
+
+    def settle(self, key: str, estimated_tokens: int, actual_tokens: int) -> None:
+        bucket = self._token_buckets.get(key)
+        if bucket is not None:
+            bucket.adjust(actual_tokens - estimated_tokens)
+
+    # -- concurrency slots -----------------------------------------------
+
+    def _retry_hint(self) -> float:
+        return self._hold_ewma * (self._queued + 1) / self.max_concurrent
+
+    async def _acquire_slot(self, key: str, cls: _PriorityClass) -> None:
+        # Waiters only exist while the pool (or their class share) is full, so free capacity can be taken directly.
+        if self._active < self.max_concurrent and cls.active < cls.limit:
+            self._active += 1
+            cls.active += 1
+            return
+
+        queue = cls.waiting.get(key)
+        if self._queued >= self.queue_limit or (queue is not None and len(queue) >= self.sender_queue_limit):
+            ADMISSION_REJECTIONS.inc("queue_full", cls.name)
+            raise RateLimited("Server is busy; the request queue is full.", self._retry_hint())
+
+        future = asyncio.get_running_loop().create_future()
+        if not cls.queued:
+            cls.pass_value = max(cls.pass_value, self._virtual_time)
+        if queue is None:
+            queue = cls.waiting[key] = deque()
+            cls.rotation.append(key)
+        queue.append(future)
+        cls.arrivals.append((time.monotonic(), future))
+        self._set_queued(cls, 1)
+        deadline = current_deadline()
+        remaining = deadline.remaining() if deadline is not None else None
+        # Waiting past the request deadline is pointless; give up when it expires instead.
+        timeout = self.queue_timeout if remaining is None else max(0.0, min(self.queue_timeout, remaining))
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+        except BaseException as exc:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we gave up; pass it on.
+                self._release_slot(cls)
+            else:
+                future.cancel()
+                self._set_queued(cls, -1)
+            if isinstance(exc, asyncio.TimeoutError):
+                if deadline is not None and deadline.expired():
+                    ADMISSION_REJECTIONS.inc("deadline", cls.name)
+                    deadline.cancel(DEADLINE)
+                    raise DeadlineExceeded("The request deadline expired while waiting for capacity.") from None
+                ADMISSION_REJECTIONS.inc("queue_timeout", cls.name)
+                raise RateLimited("Server is busy; timed out waiting for capacity.", self._retry_hint()) from None
+            raise
+
+    def _set_queued(self, cls: _PriorityClass, delta: int) -> None:
+        cls.queued += delta
+        self._queued += delta
+        ADMISSION_QUEUED.set(cls.name, value=cls.queued)
+
+    def _pick_class(self) -> Optional[_PriorityClass]:
+        eligible = [cls for cls in self._classes.values() if cls.queued and cls.active < cls.limit]
+        if not eligible:
+            return None
+        now = time.monotonic()
+        waits = {cls.name: cls.oldest_wait(now) for cls in eligible}
+        starving = [cls for cls in eligible if waits[cls.name] >= self.starvation_seconds]
+        if starving:
+            return max(starving, key=lambda cls: waits[cls.name])
+        chosen = min(eligible, key=lambda cls: cls.pass_value)
+        self._virtual_time = chosen.pass_value
+        chosen.pass_value += 1.0 / chosen.weight
+        return chosen
+
+    def _dispatch(self) -> None:
+        """Grant free slots to queued waiters."""
+        while self._active < self.max_concurrent:
+            cls = self._pick_class()
+            if cls is None:
+                return
+            future = cls.pop_next()
+            if future is None:
+                # Only abandoned waiters were left; resync the count so the class drops out.
+                self._set_queued(cls, -cls.queued)
+                continue
+            self._set_queued(cls, -1)
+            self._active += 1
+            cls.active += 1
+            ADMISSION_ACTIVE.set(cls.name, value=cls.active)
+            future.set_result(None)
+
+    def _release_slot(self, cls: _PriorityClass) -> None:
+        self._active -= 1
+        cls.active -= 1
+        ADMISSION_ACTIVE.set(cls.name, value=cls.active)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, key: str, estimated_tokens: int = 0, priority: str = STANDARD) -> AsyncIterator[Ticket]:
+        """Hold an upstream slot for ``key`` in ``priority`` class for the duration of the block."""
+        ticket = Ticket(self, key, estimated_tokens)
+        cls = self._classes.get(priority) or self._classes[STANDARD]
+        # Load shedding protects this worker, so it applies whether or not admission control is on.
+        if self.load_monitor is not None:
+            shed = self.load_monitor.check(cls.name)
+            if shed is not None:
+                ADMISSION_REJECTIONS.inc("overloaded", cls.name)
+                raise Overloaded(f"Server is overloaded ({shed[0].replace('_', ' ')}); retry later.", shed[1])
+        if not self.enabled:
+            yield ticket
+            return
+
+        self._check_rate(key, estimated_tokens, cls.name)
+        started = time.perf_counter()
+        await self._acquire_slot(key, cls)
+        waited = time.perf_counter() - started
+        record_phase("admission", waited)
+        ADMISSION_WAIT.observe(waited, cls.name)
+        ADMISSION_ACTIVE.set(cls.name, value=cls.active)
+
+        held_from = time.perf_counter()
+
+        def release() -> None:
+            self._hold_ewma = 0.8 * self._hold_ewma + 0.2 * (time.perf_counter() - held_from)
+            self._release_slot(cls)
+
+        try:
+            yield ticket
+        finally:
+            # A worker thread still running for this request keeps the slot until it returns.
+            ticket._release_when_idle(release)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "classes": {
+                cls.name: {"active": cls.active, "queued": cls.queued, "limit": cls.limit, "weight": cls.weight}
+                for cls in self._classes.values()
+            },
+        }
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide admission controller configured from settings."""
+    settings = get_settings()
+    return AdmissionController(
+        max_concurrent=settings.upstream_max_concurrency,
+        queue_limit=settings.admission_queue_limit,
+        sender_queue_limit=settings.admission_sender_queue_limit,
+        queue_timeout=settings.admission_queue_timeout,
+        requests_per_second=settings.sender_requests_per_second,
+        burst=settings.sender_burst,
+        tokens_per_minute=settings.sender_tokens_per_minute,
+        enabled=settings.admission_enabled,
+        weights=settings.priority_weights,
+        max_shares=settings.priority_max_shares,
+        starvation_seconds=settings.priority_starvation_seconds,
+        load_monitor=get_load_monitor(),
+    )
@@ -0,0 +1,80 @@
+"""
+First-turn chat answer cache.
+
+A chat request with no history sends only the system prompt and the user
+message upstream, so the same question gets the same kind of answer no
+matter who asks. This cache keeps those answers, keyed on a hash of the
+model, the generation config, the system prompt and the normalized message.
+It is opt-in and bounded by size (LRU) and TTL.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.metrics import registry
+from prompthash_api.core.prompt_cache import normalize_prompt
+
+CHAT_ANSWER_CACHE = registry.counter(
+    "prompthash_chat_answer_cache_total",
+    "First-turn chat answer cache lookups by outcome (hit, miss).",
+    ["outcome"],
+)
+
+
+def answer_key(model: str, config: Dict[str, Any], system_prompt: str, message: str) -> str:
+    material = json.dumps(
+        [model, sorted(config.items()), system_prompt, normalize_prompt(message)],
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """LRU+TTL map from :func:`answer_key` to a raw upstream answer."""
+
+    def __init__(self, max_entries: int = 0, ttl_seconds: float = 3600.0) -> None:
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            CHAT_ANSWER_CACHE.inc("miss")
+            return None
+        self._entries.move_to_end(key)
+        CHAT_ANSWER_CACHE.inc("hit")
+        return entry[0]
+
+    def put(self, key: str, value: Any) -> None:
+        now = time.monotonic()
+        self._entries[key] = (value, now + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        # The front holds the least recently used entries: drop the expired ones, then any over the bound.
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest[1] > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+
+@lru_cache
+def get_answer_cache() -> AnswerCache:
+    """Return the process-wide first-turn answer cache configured from settings."""
+    settings = get_settings()
+    return AnswerCache(max_entries=settings.chat_answer_cache_size, ttl_seconds=settings.chat_answer_cache_ttl_seconds)
@@ -0,0 +1,84 @@
+"""
+Static responses prepared once and served from memory.
+
+Each :class:`PreparedAsset` holds the body plus gzip and (when the optional
+``brotli`` package is installed) brotli versions, so a request costs a
+header check and a write. :func:`asset_response` picks the encoding from
+``Accept-Encoding``, sets a strong ETag per encoding and answers
+``If-None-Match`` with 304.
+"""
+
+import gzip
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+@dataclass
+class PreparedAsset:
+    body: bytes
+    media_type: str
+    etag: str
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def fingerprint(self) -> str:
+        return self.etag.strip('"')[:12]
+
+
+def prepare_asset(body: bytes, media_type: str) -> PreparedAsset:
+    """Compress ``body`` ahead of time; encodings that do not shrink it are dropped."""
+    asset = PreparedAsset(body=body, media_type=media_type, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        candidates["br"] = brotli.compress(body, quality=11)
+    for encoding, data in candidates.items():
+        if len(data) < len(body):
+            asset.encoded[encoding] = data
+    return asset
+
+
+def choose_encoding(accept_encoding: str, available: Dict[str, bytes]) -> Optional[str]:
+    """The smallest available encoding the client accepts, or None for identity."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name)
+    options = [encoding for encoding in available if encoding in accepted or "*" in accepted]
+    if not options:
+        return None
+    return min(options, key=lambda encoding: len(available[encoding]))
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires; proxies may add W/ after recompressing.
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def asset_response(request: Request, asset: PreparedAsset, cache_control: str) -> Response:
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""), asset.encoded)
+    # Each encoding is a different byte sequence, so each gets its own strong ETag.
+    etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(asset.body, media_type=asset.media_type, headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(asset.encoded[encoding], media_type=asset.media_type, headers=headers)
@@ -1,5 +1,6 @@
 import os
 from functools import lru_cache
+from typing import Dict, List, Tuple
 
 from dotenv import load_dotenv
 
@@ -7,6 +8,48 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value and value.strip() else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value and value.strip() else default
+
+
+def _env_map(name: str, default: str) -> Dict[str, float]:
+    """Parse ``key:value,key:value`` pairs such as ``interactive:8,bulk:1``."""
+    result: Dict[str, float] = {}
+    for item in (os.getenv(name) or default).split(","):
+        key, _, value = item.partition(":")
+        if key.strip() and value.strip():
+            result[key.strip().lower()] = float(value)
+    return result
+
+
+def _env_chain(name: str, default_value: float) -> List[Tuple[str, float]]:
+    """Parse an ordered ``model:value,model`` list; model ids keep their case and may contain ``:``."""
+    result: List[Tuple[str, float]] = []
+    for item in (os.getenv(name) or "").split(","):
+        item = item.strip()
+        key, _, value = item.rpartition(":")
+        try:
+            entry = (key.strip(), float(value))
+        except ValueError:
+            entry = (item, default_value)
+        if entry[0]:
+            result.append(entry)
+    return result
+
+
 class Settings:
     """Runtime configuration pulled from environment variables."""
 
@@ -30,6 +73,130 @@ class Settings:
         self.chat_generation_config = {"temperature": 0.7, "top_p": 0.95, "max_tokens": 512}
         self.improver_generation_config = {"temperature": 0.7, "top_p": 0.95, "max_tokens": 400}
 
+        # max_tokens: "fixed" sends the values above; "adaptive" sends the observed quantile of
+        # completion lengths per model, endpoint and target plus headroom, within floor..ceiling.
+        self.max_tokens_mode = os.getenv("MAX_TOKENS_MODE", "fixed").strip().lower()
+        self.max_tokens_quantile = _env_float("MAX_TOKENS_QUANTILE", 0.99)
+        self.max_tokens_headroom = _env_float("MAX_TOKENS_HEADROOM", 0.2)
+        self.max_tokens_min_samples = _env_int("MAX_TOKENS_MIN_SAMPLES", 50)
+        self.max_tokens_floor = _env_int("MAX_TOKENS_FLOOR", 64)
+        self.max_tokens_ceiling = _env_int("MAX_TOKENS_CEILING", 2048)
+        # Truncation (finish_reason=length) rate above which a key is flagged.
+        self.truncation_alert_rate = _env_float("TRUNCATION_ALERT_RATE", 0.02)
+
+        # Stream upstream completions so time to first byte and generation can be told apart, and
+        # abandoned calls stop at the next chunk. Off by default: not every upstream accepts stream_options.
+        self.upstream_streaming = _env_bool("ASI_UPSTREAM_STREAMING", False)
+
+        # Per-request phase timing, emitted as a Server-Timing header and a JSON log line.
+        self.server_timing_header = _env_bool("SERVER_TIMING_HEADER", True)
+        self.request_timing_log = _env_bool("REQUEST_TIMING_LOG", True)
+
+        # Prometheus-style /metrics endpoint (per worker process).
+        self.metrics_enabled = _env_bool("METRICS_ENABLED", True)
+
+        # Local directory for on-disk state (usage database, snapshots, job store).
+        self.data_dir = os.getenv("PROMPTHASH_DATA_DIR", ".prompthash")
+
+        # Token usage accounting; set USAGE_DB_PATH to an empty string to keep it in memory only.
+        self.usage_db_path = os.getenv("USAGE_DB_PATH", os.path.join(self.data_dir, "usage.sqlite3"))
+        self.usage_retention_seconds = _env_int("USAGE_RETENTION_SECONDS", 86400)
+        self.usage_flush_seconds = _env_float("USAGE_FLUSH_SECONDS", 30.0)
+
+        # Admission control in front of upstream chat/improve calls; opt-in.
+        self.admission_enabled = _env_bool("ADMISSION_ENABLED", False)
+        self.upstream_max_concurrency = _env_int("UPSTREAM_MAX_CONCURRENCY", 32)
+        self.admission_queue_limit = _env_int("ADMISSION_QUEUE_LIMIT", 256)
+        self.admission_sender_queue_limit = _env_int("ADMISSION_SENDER_QUEUE_LIMIT", 8)
+        self.admission_queue_timeout = _env_float("ADMISSION_QUEUE_TIMEOUT_SECONDS", 30.0)
+        # Per-sender limits; 0 disables the corresponding bucket. Buckets are keyed on the client
+        # address unless the request carries SENDER_AUTH_TOKEN in X-Sender-Token.
+        self.sender_auth_token = os.getenv("SENDER_AUTH_TOKEN", "")
+        self.sender_requests_per_second = _env_float("SENDER_REQUESTS_PER_SECOND", 2.0)
+        self.sender_burst = _env_float("SENDER_BURST", 10.0)
+        self.sender_tokens_per_minute = _env_float("SENDER_TOKENS_PER_MINUTE", 0.0)
+        # Priority classes: scheduling weight, maximum share of the upstream slots, and the
+        # wait after which a class is served regardless of weight.
+        self.priority_weights = _env_map("PRIORITY_WEIGHTS", "interactive:8,standard:3,bulk:1")
+        self.priority_max_shares = _env_map("PRIORITY_MAX_SHARES", "interactive:1.0,standard:0.9,bulk:0.5")
+        self.priority_starvation_seconds = _env_float("PRIORITY_STARVATION_SECONDS", 10.0)
+        self.chat_priority = os.getenv("CHAT_PRIORITY", "interactive")
+        # Chat context: "recent" sends the last 5 history items; "retrieval" keeps a longer
+        # history per sender and sends the most recent items plus the most relevant older exchanges.
+        self.chat_context_mode = os.getenv("CHAT_CONTEXT_MODE", "recent").strip().lower()
+        self.chat_history_items = _env_int("CHAT_HISTORY_ITEMS", 200)
+        self.chat_context_recent_items = _env_int("CHAT_CONTEXT_RECENT_ITEMS", 4)
+        self.chat_context_retrieved = _env_int("CHAT_CONTEXT_RETRIEVED", 3)
+        self.chat_context_budget_tokens = _env_int("CHAT_CONTEXT_BUDGET_TOKENS", 1500)
+        # Opt-in cache of answers to first messages (no history); 0 entries disables it.
+        self.chat_answer_cache_size = _env_int("CHAT_ANSWER_CACHE_SIZE", 0)
+        self.chat_answer_cache_ttl_seconds = _env_float("CHAT_ANSWER_CACHE_TTL_SECONDS", 3600.0)
+        self.improve_priority = os.getenv("IMPROVE_PRIORITY", "standard")
+        # Request deadlines: per-route budgets, and the cap on a client's X-Request-Timeout.
+        # The route defaults sit just under the Flask proxy's 30 s timeout.
+        self.chat_timeout_seconds = _env_float("CHAT_TIMEOUT_SECONDS", 28.0)
+        self.improve_timeout_seconds = _env_float("IMPROVE_TIMEOUT_SECONDS", 28.0)
+        self.max_request_timeout_seconds = _env_float("MAX_REQUEST_TIMEOUT_SECONDS", 120.0)
+        # Background jobs (POST /api/jobs); set JOBS_DB_PATH to an empty string to keep jobs in memory only.
+        self.jobs_db_path = os.getenv("JOBS_DB_PATH", os.path.join(self.data_dir, "jobs.sqlite3"))
+        self.job_workers = _env_int("JOB_WORKERS", 4)
+        self.job_queue_limit = _env_int("JOB_QUEUE_LIMIT", 1000)
+        self.job_result_ttl_seconds = _env_float("JOB_RESULT_TTL_SECONDS", 3600.0)
+        self.job_timeout_seconds = _env_float("JOB_TIMEOUT_SECONDS", 300.0)
+        self.job_priority = os.getenv("JOB_PRIORITY", "bulk")
+        # Webhook hosts jobs may call back; when empty, any host that resolves to public addresses only.
+        self.webhook_allowed_hosts = [
+            host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+        ]
+        # Idempotency-Key support for chat and improve.
+        self.idempotency_ttl_seconds = _env_float("IDEMPOTENCY_TTL_SECONDS", 3600.0)
+        self.idempotency_max_keys = _env_int("IDEMPOTENCY_MAX_KEYS", 10000)
+        # Improver cache: exact hits on the normalized prompt, near hits above a SimHash
+        # similarity per target. IMPROVE_CACHE_SIZE=0 disables it.
+        self.improve_cache_size = _env_int("IMPROVE_CACHE_SIZE", 10000)
+        self.improve_cache_ttl_seconds = _env_float("IMPROVE_CACHE_TTL_SECONDS", 86400.0)
+        self.improve_cache_thresholds = _env_map("IMPROVE_CACHE_THRESHOLDS", "text:0.92,image:0.97")
+        # State snapshot written on shutdown (and periodically) and restored lazily at startup;
+        # set SNAPSHOT_PATH to an empty string to disable. Shutdown first drains in-flight work.
+        self.snapshot_path = os.getenv("SNAPSHOT_PATH", os.path.join(self.data_dir, "state.sqlite3"))
+        self.snapshot_interval_seconds = _env_float("SNAPSHOT_INTERVAL_SECONDS", 300.0)
+        self.drain_timeout_seconds = _env_float("DRAIN_TIMEOUT_SECONDS", 20.0)
+        # Background upstream health probes read by the health routes; interval 0 disables them.
+        self.health_probe_interval_seconds = _env_float("HEALTH_PROBE_INTERVAL_SECONDS", 15.0)
+        self.health_probe_timeout_seconds = _env_float("HEALTH_PROBE_TIMEOUT_SECONDS", 5.0)
+        self.health_probe_mode = os.getenv("HEALTH_PROBE_MODE", "models").strip().lower()
+        self.health_failure_threshold = _env_int("HEALTH_FAILURE_THRESHOLD", 3)
+        self.health_slow_seconds = _env_float("HEALTH_SLOW_SECONDS", 5.0)
+        # Event-loop lag sampling (0 disables it and load shedding) and the per-priority
+        # thresholds at which new work is refused with 503: smoothed lag in seconds, and
+        # calls waiting for a worker thread as a fraction of the pool size.
+        self.loop_lag_interval_seconds = _env_float("LOOP_LAG_INTERVAL_SECONDS", 0.1)
+        self.shed_lag_thresholds = _env_map("SHED_LAG_THRESHOLDS", "bulk:0.05,standard:0.2")
+        self.shed_pool_thresholds = _env_map("SHED_POOL_THRESHOLDS", "bulk:0.25,standard:1.0")
+        self.shed_retry_after_seconds = _env_float("SHED_RETRY_AFTER_SECONDS", 2.0)
+        # Ordered fallback chains ("model:slo_seconds,model,...") used when a request names no model;
+        # empty means the single PROMPT_AGENT_MODEL / PROMPT_IMPROVER_MODEL as before.
+        self.fallback_slo_seconds = _env_float("FALLBACK_SLO_SECONDS", 10.0)
+        self.chat_fallback_models = _env_chain("CHAT_FALLBACK_MODELS", self.fallback_slo_seconds)
+        self.improve_fallback_models = _env_chain("IMPROVE_FALLBACK_MODELS", self.fallback_slo_seconds)
+        # A model whose slow-or-failed share of its last FALLBACK_WINDOW calls exceeds the error budget
+        # (after FALLBACK_MIN_CALLS calls) moves to the end of its chain for FALLBACK_DEMOTE_SECONDS.
+        self.fallback_error_budget = _env_float("FALLBACK_ERROR_BUDGET", 0.2)
+        self.fallback_window = _env_int("FALLBACK_WINDOW", 20)
+        self.fallback_min_calls = _env_int("FALLBACK_MIN_CALLS", 5)
+        self.fallback_demote_seconds = _env_float("FALLBACK_DEMOTE_SECONDS", 120.0)
+        # Most models one chat/improve request may race or compare.
+        self.race_max_models = _env_int("RACE_MAX_MODELS", 3)
+        # Bearer token for the /api/admin diagnostics routes; unset disables them entirely.
+        self.admin_token = os.getenv("ADMIN_TOKEN") or None
+        # Conversation tiering: compress histories idle this long, then spill them to the
+        # snapshot store. CHAT_COMPRESS_AFTER_SECONDS=0 keeps everything hot.
+        self.chat_compress_after_seconds = _env_float("CHAT_COMPRESS_AFTER_SECONDS", 600.0)
+        self.chat_spill_after_seconds = _env_float("CHAT_SPILL_AFTER_SECONDS", 3600.0)
+        self.chat_tiering_interval_seconds = _env_float("CHAT_TIERING_INTERVAL_SECONDS", 60.0)
+        # Worker threads for blocking upstream calls; keep above UPSTREAM_MAX_CONCURRENCY.
+        self.worker_threads = _env_int("WORKER_THREADS", self.upstream_max_concurrency + 8)
+
         self.system_prompt = """
 Role: Expert general-purpose assistant for developers and non-developers.
 Goal: Provide accurate, useful, and actionable answers with clear structure and minimal friction.
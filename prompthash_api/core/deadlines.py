@@ -0,0 +1,216 @@
+"""
+End-to-end request deadlines and client-disconnect cancellation.
+
+``DeadlineMiddleware`` opens a :class:`Deadline` per HTTP request. The budget
+comes from the ``X-Request-Timeout`` header (seconds, capped) or, when the
+client sends none, from the route via :func:`use_route_budget`. Upstream
+calls read the remaining budget for their own timeout, and worker threads
+check :meth:`Deadline.is_cancelled` between streamed chunks, so an abandoned
+completion stops consuming tokens and frees its thread and connection.
+
+Once the request body has been read, the middleware listens for
+``http.disconnect``. When the client goes away, the endpoint task is
+cancelled and the request is recorded with status 499.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from prompthash_api.core.metrics import registry
+
+REQUESTS_ABORTED = registry.counter(
+    "prompthash_requests_aborted_total", "Requests abandoned before completion.", ["reason"]
+)
+
+TIMEOUT_HEADER = "x-request-timeout"
+
+DISCONNECT = "disconnect"
+DEADLINE = "deadline"
+# A race leg stopped because another model answered first; not an aborted request.
+ABANDONED = "abandoned"
+
+# Non-standard status (as used by nginx) for requests whose client went away.
+STATUS_CLIENT_CLOSED = 499
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of budget; surfaced as HTTP 504."""
+
+    def __init__(self, reason: str = "The request deadline was exceeded.") -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Deadline:
+    """Remaining time budget and cancellation flag for one request; safe to read from worker threads."""
+
+    __slots__ = ("started", "expires_at", "explicit", "reason", "_cancelled")
+
+    def __init__(self, budget: Optional[float] = None) -> None:
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget if budget else None
+        # A client-supplied budget wins over the route default.
+        self.explicit = bool(budget)
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def cancel(self, reason: str) -> None:
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+            REQUESTS_ABORTED.inc(reason)
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def branch(self) -> "Deadline":
+        """A deadline with the same budget that can be cancelled on its own (one leg of a race)."""
+        branch = Deadline()
+        branch.started, branch.expires_at, branch.explicit = self.started, self.expires_at, self.explicit
+        return branch
+
+    def abandon(self) -> None:
+        """Stop the work under this deadline without counting it as an aborted request."""
+        if not self._cancelled.is_set():
+            self.reason = ABANDONED
+            self._cancelled.set()
+
+    def check(self) -> None:
+        """Raise once the budget is spent or the client has gone away."""
+        if self._cancelled.is_set():
+            raise DeadlineExceeded("The request was cancelled." if self.reason == DISCONNECT else "The request deadline was exceeded.")
+        if self.expired():
+            self.cancel(DEADLINE)
+            raise DeadlineExceeded()
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("prompthash_request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(budget: Optional[float]) -> Iterator[Deadline]:
+    """Run work outside an HTTP request (background jobs) under its own deadline."""
+    deadline = Deadline(budget)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def use_deadline(deadline: Deadline) -> Iterator[Deadline]:
+    """Make ``deadline`` the current one for the enclosed block."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def use_route_budget(seconds: float) -> None:
+    """Apply a route's default budget unless the client supplied one."""
+    deadline = _current.get()
+    if deadline is not None and not deadline.explicit and seconds > 0:
+        deadline.expires_at = deadline.started + seconds
+
+
+def parse_budget(value: Optional[str], max_budget: float) -> Optional[float]:
+    """Parse a client-supplied timeout in seconds, capped at ``max_budget``; invalid values are ignored."""
+    try:
+        seconds = float(value) if value else 0.0
+    except ValueError:
+        return None
+    if seconds <= 0:
+        return None
+    return min(seconds, max_budget) if max_budget > 0 else seconds
+
+
+class DeadlineMiddleware:
+    """Pure ASGI middleware that sets a request deadline and cancels the endpoint on client disconnect."""
+
+    def __init__(self, app, max_budget: float = 120.0) -> None:
+        self.app = app
+        self.max_budget = max_budget
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = None
+        for name, value in scope.get("headers", ()):
+            if name == TIMEOUT_HEADER.encode("latin-1"):
+                header = value.decode("latin-1")
+                break
+        deadline = Deadline(parse_budget(header, self.max_budget))
+        token = _current.set(deadline)
+
+        watcher: Optional[asyncio.Task] = None
+        response_started = False
+        response_complete = False
+
+        async def watch() -> dict:
+            message = await receive()
+            # Servers also report a disconnect once the response is complete; that is not an abort.
+            if message["type"] == "http.disconnect" and not response_complete:
+                deadline.cancel(DISCONNECT)
+                app_task.cancel()
+            return message
+
+        async def wrapped_receive() -> dict:
+            nonlocal watcher
+            if watcher is not None:
+                # The body has been consumed; share the watcher's view of the connection.
+                return await asyncio.shield(watcher)
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                deadline.cancel(DISCONNECT)
+            elif not message.get("more_body", False):
+                watcher = asyncio.ensure_future(watch())
+            return message
+
+        async def send_wrapper(message) -> None:
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, wrapped_receive, send_wrapper))
+        try:
+            try:
+                await asyncio.wait({app_task})
+            except asyncio.CancelledError:
+                app_task.cancel()
+                raise
+        finally:
+            _current.reset(token)
+            if watcher is not None and not watcher.done():
+                watcher.cancel()
+
+        if app_task.cancelled() and deadline.reason == DISCONNECT:
+            # Nobody is listening; the send only lets outer middleware log the outcome.
+            if not response_started:
+                await send({"type": "http.response.start", "status": STATUS_CLIENT_CLOSED, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+            return
+        app_task.result()
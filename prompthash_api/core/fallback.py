@@ -0,0 +1,212 @@
+"""
+Ordered model fallback with per-model latency SLOs and error budgets.
+
+A :class:`FallbackChain` lists the models an endpoint may use, in order,
+each with a latency SLO. :func:`run_fallback` tries them one at a time
+within the request deadline. An attempt that fails, or is still running
+when its model's SLO expires, is abandoned, and the next model gets what
+is left of the budget. Only a streaming call actually stops; a
+non-streaming one runs on upstream, alongside the next attempt, and its
+usage is recorded and settled when its worker thread returns (see
+:func:`~prompthash_api.clients.asi_client.run_upstream`). The last of
+several models is never cut off by its SLO; it gets the whole remaining
+budget. A chain of one model has nothing
+to fall back to, so its SLO is that model's deadline.
+
+Every attempt counts against its own model's error budget as ``ok``,
+``slow`` or ``error``. An attempt cut off by the request deadline before
+its SLO ran out is recorded as ``deadline`` and does not count: the time
+went to earlier models, not to this one. When slow and failed attempts
+are more than ``error_budget`` of the model's last ``window`` calls, the
+model is demoted to the end of the chain for ``demote_seconds``. After
+that it returns to its place with a clean record.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from prompthash_api.core.admission import RateLimited
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import Deadline, DeadlineExceeded, current_deadline, use_deadline
+from prompthash_api.core.metrics import model_label, registry
+
+T = TypeVar("T")
+
+logger = logging.getLogger("prompthash_api.fallback")
+
+OK, SLOW, FAILED, CUT = "ok", "slow", "error", "deadline"
+
+FALLBACK_ATTEMPTS = registry.counter(
+    "prompthash_fallback_attempts_total",
+    "Attempts on a fallback chain by endpoint, model and outcome (ok, slow, error, deadline).",
+    ["endpoint", "model", "outcome"],
+)
+MODEL_DEMOTED = registry.gauge(
+    "prompthash_model_demoted",
+    "1 while a model is demoted to the end of its fallback chain.",
+    ["endpoint", "model"],
+)
+
+
+class _ModelRecord:
+    """SLO and recent attempt outcomes for one model in a chain."""
+
+    def __init__(self, model: str, slo: float, window: int) -> None:
+        self.model = model
+        self.slo = slo
+        self.outcomes: Deque[str] = deque(maxlen=window)
+        self.demoted_until = 0.0
+
+    def breach_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for outcome in self.outcomes if outcome != OK) / len(self.outcomes)
+
+
+class FallbackChain:
+    """The ordered models for one endpoint and their error-budget state."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        models: List[Tuple[str, float]],
+        error_budget: float = 0.2,
+        window: int = 20,
+        min_calls: int = 5,
+        demote_seconds: float = 120.0,
+    ) -> None:
+        self.endpoint = endpoint
+        self.error_budget = error_budget
+        self.min_calls = max(1, min_calls)
+        self.demote_seconds = demote_seconds
+        self._records: Dict[str, _ModelRecord] = {}
+        for model, slo in models:
+            self._records.setdefault(model, _ModelRecord(model, slo, max(self.min_calls, window)))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._records)
+
+    def order(self, now: Optional[float] = None) -> List[str]:
+        """Models to try, in configured order with demoted ones moved to the end."""
+        now = time.monotonic() if now is None else now
+        healthy, demoted = [], []
+        for record in self._records.values():
+            if record.demoted_until and now >= record.demoted_until:
+                # Probation over: back in place with a clean record.
+                record.demoted_until = 0.0
+                record.outcomes.clear()
+                MODEL_DEMOTED.set(self.endpoint, record.model, value=0.0)
+            (demoted if record.demoted_until else healthy).append(record.model)
+        return healthy + demoted
+
+    def slo(self, model: str) -> float:
+        return self._records[model].slo
+
+    def record(self, model: str, outcome: str) -> None:
+        FALLBACK_ATTEMPTS.inc(self.endpoint, model_label(model), outcome)
+        record = self._records.get(model)
+        if record is None or outcome == CUT:
+            return
+        record.outcomes.append(outcome)
+        if (
+            not record.demoted_until
+            and len(record.outcomes) >= self.min_calls
+            and record.breach_rate() > self.error_budget
+        ):
+            record.demoted_until = time.monotonic() + self.demote_seconds
+            MODEL_DEMOTED.set(self.endpoint, model, value=1.0)
+            logger.warning(
+                "Demoting %s for %s: %.0f%% of recent calls were slow or failed",
+                model,
+                self.endpoint,
+                record.breach_rate() * 100,
+            )
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        order = self.order(now)
+        return [
+            {
+                "model": model,
+                "slo_seconds": self._records[model].slo,
+                "calls": len(self._records[model].outcomes),
+                "breach_rate": round(self._records[model].breach_rate(), 3),
+                "demoted_for_seconds": round(max(0.0, self._records[model].demoted_until - now), 1)
+                if self._records[model].demoted_until
+                else 0.0,
+            }
+            for model in order
+        ]
+
+
+async def run_fallback(
+    chain: FallbackChain,
+    call: Callable[[str], Awaitable[T]],
+    accept: Callable[[T], bool] = bool,
+) -> Tuple[str, T]:
+    """
+    Try ``call(model)`` down the chain until one result passes ``accept``.
+
+    Returns ``(model, result)``. Rate-limit and request-deadline errors
+    are raised at once, because another model would not help. When every
+    model fails, the last error is raised.
+    """
+    parent = current_deadline() or Deadline()
+    order = chain.order()
+    last_error: BaseException = DeadlineExceeded()
+    for position, model in enumerate(order):
+        parent.check()
+        remaining = parent.remaining()
+        slo = chain.slo(model)
+        if position == len(order) - 1 and len(order) > 1:
+            limit = remaining
+        else:
+            limit = slo if remaining is None else min(slo, remaining)
+        # Whether a timeout here means the request, rather than the model's SLO, ran out of time.
+        request_limited = remaining is not None and limit == remaining
+        branch = parent.branch()
+        started = time.perf_counter()
+        try:
+            with use_deadline(branch):
+                result = await asyncio.wait_for(call(model), limit)
+            if not accept(result):
+                raise ValueError("empty response")
+        except asyncio.TimeoutError:
+            # A streaming worker sees the abandoned branch and stops reading at its next chunk;
+            # a non-streaming one runs on and is accounted for when it returns.
+            branch.abandon()
+            if request_limited:
+                chain.record(model, SLOW if time.perf_counter() - started >= slo else CUT)
+                raise DeadlineExceeded() from None
+            chain.record(model, SLOW)
+            last_error = DeadlineExceeded(f"{model} did not answer within its {slo:g}s SLO.")
+            continue
+        except (RateLimited, DeadlineExceeded):
+            raise
+        except Exception as exc:
+            chain.record(model, FAILED)
+            last_error = exc
+            continue
+        chain.record(model, OK if time.perf_counter() - started <= slo else SLOW)
+        return model, result
+    raise last_error
+
+
+@lru_cache
+def get_fallback_chain(endpoint: str) -> FallbackChain:
+    """Return the process-wide fallback chain for ``chat`` or ``improve``."""
+    settings = get_settings()
+    models = settings.chat_fallback_models if endpoint == "chat" else settings.improve_fallback_models
+    return FallbackChain(
+        endpoint,
+        models,
+        error_budget=settings.fallback_error_budget,
+        window=settings.fallback_window,
+        min_calls=settings.fallback_min_calls,
+        demote_seconds=settings.fallback_demote_seconds,
+    )
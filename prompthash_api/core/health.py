@@ -0,0 +1,215 @@
+"""
+Background upstream health probing.
+
+:class:`HealthProber` checks ASI Cloud every few seconds and keeps the
+outcome per endpoint (``chat``, ``improve``, ``models``) and model. Health
+routes read the cached result, so a load balancer polling them never
+triggers an upstream call.
+
+Two probe modes:
+
+- ``models`` (default): one ``models.list`` call per round. ``chat`` and
+  ``improve`` are healthy when it succeeds and still lists their model.
+- ``completion``: a 1-token completion per chat/improve model, plus the
+  listing for ``models``. It costs tokens but exercises generation.
+
+Readiness: an endpoint is ``starting`` until its first probe, ``down``
+after ``failure_threshold`` consecutive failures or when its last success
+is older than ``stale_after``, ``degraded`` when recent probes failed or
+were slow, otherwise ``ok``. Only ``ok`` and ``degraded`` are ready.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from prompthash_api.clients.asi_client import build_openai_client
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.metrics import register_models, registry
+
+logger = logging.getLogger("prompthash_api.health")
+
+STARTING, OK, DEGRADED, DOWN = "starting", "ok", "degraded", "down"
+READY_STATUSES = (OK, DEGRADED)
+
+PROBES = registry.counter(
+    "prompthash_health_probes_total",
+    "Upstream health probes by endpoint and outcome.",
+    ["endpoint", "outcome"],
+)
+PROBE_LATENCY = registry.histogram(
+    "prompthash_health_probe_seconds",
+    "Upstream health probe latency by endpoint.",
+    ["endpoint"],
+)
+UPSTREAM_READY = registry.gauge(
+    "prompthash_upstream_ready",
+    "1 when the endpoint's last upstream probes say it is ready, else 0.",
+    ["endpoint"],
+)
+
+
+class ProbeStats:
+    """Recent probe outcomes for one endpoint and model."""
+
+    def __init__(self, endpoint: str, model: str, window: int) -> None:
+        self.endpoint = endpoint
+        self.model = model
+        self.outcomes: Deque[Tuple[bool, float]] = deque(maxlen=max(1, window))
+        self.consecutive_failures = 0
+        self.last_checked_at: Optional[float] = None
+        self.last_ok_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def record(self, ok: bool, latency: float, error: Optional[str] = None) -> None:
+        now = time.time()
+        self.outcomes.append((ok, latency))
+        self.last_checked_at = now
+        if ok:
+            self.consecutive_failures = 0
+            self.last_ok_at = now
+            self.last_error = None
+        else:
+            self.consecutive_failures += 1
+            self.last_error = error
+        PROBES.inc(self.endpoint, "ok" if ok else "error")
+        PROBE_LATENCY.observe(latency, self.endpoint)
+
+    def summary(self, stale_after: float, slow_seconds: float, failure_threshold: int) -> Dict[str, Any]:
+        now = time.time()
+        latencies = sorted(latency for ok, latency in self.outcomes if ok)
+        failures = sum(1 for ok, _ in self.outcomes if not ok)
+        median = latencies[len(latencies) // 2] if latencies else None
+        if self.last_checked_at is None:
+            status = STARTING
+        elif self.consecutive_failures >= failure_threshold or self.last_ok_at is None or now - self.last_ok_at > stale_after:
+            status = DOWN
+        elif failures or (median is not None and median > slow_seconds):
+            status = DEGRADED
+        else:
+            status = OK
+        return {
+            "status": status,
+            "ready": status in READY_STATUSES,
+            "model": self.model,
+            "latency_ms": round(self.outcomes[-1][1] * 1000, 1) if self.outcomes else None,
+            "p50_latency_ms": round(median * 1000, 1) if median is not None else None,
+            "error_rate": round(failures / len(self.outcomes), 3) if self.outcomes else None,
+            "checked_at": self.last_checked_at,
+            "last_ok_at": self.last_ok_at,
+            "error": self.last_error,
+        }
+
+
+class HealthProber:
+    """Periodically probes the upstream and caches the outcome per endpoint."""
+
+    def __init__(
+        self,
+        client: Optional[OpenAI],
+        targets: Dict[str, str],
+        mode: str = "models",
+        interval: float = 15.0,
+        timeout: float = 5.0,
+        failure_threshold: int = 3,
+        slow_seconds: float = 5.0,
+        window: int = 20,
+    ) -> None:
+        # Probes must report what one attempt saw, not hide failures behind SDK retries.
+        self.client = client.with_options(max_retries=0, timeout=timeout) if client is not None else None
+        self.mode = mode
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = max(1, failure_threshold)
+        self.slow_seconds = slow_seconds
+        # Missing one or two rounds is tolerated; after that the cached result is too old to trust.
+        self.stale_after = max(3 * interval, timeout) + timeout
+        self.stats = {endpoint: ProbeStats(endpoint, model, window) for endpoint, model in targets.items()}
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def status(self, endpoint: str) -> Optional[Dict[str, Any]]:
+        """Cached health for ``endpoint``; None when probing is off."""
+        stats = self.stats.get(endpoint)
+        if not self.enabled or stats is None:
+            return None
+        return stats.summary(self.stale_after, self.slow_seconds, self.failure_threshold)
+
+    def _list_models(self) -> List[str]:
+        return [getattr(item, "id", None) or getattr(item, "name", "") for item in self.client.models.list()]
+
+    def _complete(self, model: str) -> None:
+        self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": "ping"}],
+            max_tokens=1,
+        )
+
+    async def _timed(self, func, *args) -> Tuple[Any, float, Optional[str]]:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(asyncio.to_thread(func, *args), self.timeout + 1.0)
+            return result, time.perf_counter() - started, None
+        except Exception as exc:
+            return None, time.perf_counter() - started, f"{type(exc).__name__}: {exc}"[:200]
+
+    async def probe_once(self) -> None:
+        if self.client is None:
+            for stats in self.stats.values():
+                stats.record(False, 0.0, "ASICLOUD_API_KEY is not set")
+            self._publish()
+            return
+
+        listed, latency, error = await self._timed(self._list_models)
+        if error is None:
+            register_models(listed)
+        if "models" in self.stats:
+            self.stats["models"].record(error is None, latency, error)
+
+        generation = [stats for endpoint, stats in self.stats.items() if endpoint != "models"]
+        if self.mode == "completion":
+            results = await asyncio.gather(*(self._timed(self._complete, stats.model) for stats in generation))
+            for stats, (_, probe_latency, probe_error) in zip(generation, results):
+                stats.record(probe_error is None, probe_latency, probe_error)
+        else:
+            for stats in generation:
+                if error is None and stats.model not in listed:
+                    stats.record(False, latency, f"Model {stats.model} is not listed upstream")
+                else:
+                    stats.record(error is None, latency, error)
+        self._publish()
+
+    def _publish(self) -> None:
+        for endpoint in self.stats:
+            UPSTREAM_READY.set(endpoint, value=1.0 if self.status(endpoint)["ready"] else 0.0)
+
+    async def run(self) -> None:
+        """Probe every ``interval`` seconds until cancelled."""
+        while True:
+            try:
+                await self.probe_once()
+            except Exception:
+                logger.exception("Upstream health probe failed")
+            await asyncio.sleep(self.interval)
+
+
+@lru_cache
+def get_health_prober() -> HealthProber:
+    """Return the process-wide prober configured from settings."""
+    settings = get_settings()
+    return HealthProber(
+        client=build_openai_client(),
+        targets={"chat": settings.chat_model, "improve": settings.improver_model, "models": ""},
+        mode=settings.health_probe_mode,
+        interval=settings.health_probe_interval_seconds,
+        timeout=settings.health_probe_timeout_seconds,
+        failure_threshold=settings.health_failure_threshold,
+        slow_seconds=settings.health_slow_seconds,
+    )
@@ -0,0 +1,148 @@
+"""
+``Idempotency-Key`` support for chat and improve.
+
+A retry carrying the same key as an earlier request gets the stored response
+instead of a new generation. If the original request is still running, the
+retry waits for it and shares its result. Keys are scoped per endpoint and
+caller, live for a TTL, and the store is LRU-bounded. Responses that carry
+an ``error`` are not kept, so a retry after a failure really retries.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Optional, Tuple, TypeVar
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import DeadlineExceeded
+from prompthash_api.core.metrics import registry
+
+T = TypeVar("T")
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+IDEMPOTENT_REPLAYS = registry.counter(
+    "prompthash_idempotent_replays_total",
+    "Requests answered from an earlier request with the same Idempotency-Key.",
+    ["endpoint", "outcome"],
+)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different request body."""
+
+
+def fingerprint(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future, expires_at: float) -> None:
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """Bounded TTL map from idempotency key to an in-flight or finished response."""
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_keys: int = 10000) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max(1, max_keys)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def run(
+        self,
+        endpoint: str,
+        key: str,
+        body_fingerprint: str,
+        func: Callable[[], Awaitable[T]],
+        cacheable: Callable[[T], bool] = lambda result: True,
+    ) -> Tuple[T, bool]:
+        """Return ``(result, replayed)``, running ``func`` only for the first request with ``key``."""
+        scoped = f"{endpoint}:{key}"
+        now = time.monotonic()
+        entry = self._entries.get(scoped)
+        if entry is not None and entry.expires_at <= now:
+            del self._entries[scoped]
+            entry = None
+
+        if entry is not None:
+            if entry.fingerprint != body_fingerprint:
+                raise IdempotencyConflict("Idempotency-Key was already used with a different request body.")
+            self._entries.move_to_end(scoped)
+            IDEMPOTENT_REPLAYS.inc(endpoint, "replayed" if entry.future.done() else "attached")
+            # Shielded so a retry that disconnects does not cancel the original request's result.
+            return await asyncio.shield(entry.future), True
+
+        future = asyncio.get_running_loop().create_future()
+        entry = self._entries[scoped] = _Entry(body_fingerprint, future, now + self.ttl_seconds)
+        # The front holds the least recently used keys: drop the expired ones, then any over the bound.
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest.expires_at > now and len(self._entries) <= self.max_keys:
+                break
+            self._entries.popitem(last=False)
+
+        try:
+            result = await func()
+        except BaseException as exc:
+            self._forget(scoped, entry)
+            if isinstance(exc, asyncio.CancelledError):
+                future.set_exception(DeadlineExceeded("The original request with this Idempotency-Key was cancelled."))
+            else:
+                future.set_exception(exc)
+            # Attached retries observe the exception; mark it retrieved for the common case of none.
+            future.exception()
+            raise
+        future.set_result(result)
+        if not cacheable(result):
+            self._forget(scoped, entry)
+        return result, False
+
+    def _forget(self, scoped: str, entry: _Entry) -> None:
+        if self._entries.get(scoped) is entry:
+            del self._entries[scoped]
+
+
+@lru_cache
+def get_idempotency_store() -> IdempotencyStore:
+    """Return the process-wide idempotency store configured from settings."""
+    settings = get_settings()
+    return IdempotencyStore(ttl_seconds=settings.idempotency_ttl_seconds, max_keys=settings.idempotency_max_keys)
+
+
+async def run_idempotent(
+    endpoint: str,
+    key: Optional[str],
+    caller: str,
+    body: Any,
+    response: Any,
+    func: Callable[[], Awaitable[T]],
+) -> T:
+    """
+    Route helper: run ``func`` under ``key`` (if given) and flag replays on ``response``.
+
+    ``body`` is the request model; its JSON form detects key reuse with a
+    different payload. Results carrying an ``error`` are not stored.
+    """
+    if not key:
+        return await func()
+    result, replayed = await get_idempotency_store().run(
+        endpoint,
+        f"{caller}:{key}",
+        fingerprint(body.model_dump_json()),
+        func,
+        cacheable=lambda result: not getattr(result, "error", None),
+    )
+    if replayed:
+        response.headers[REPLAYED_HEADER] = "true"
+    return result
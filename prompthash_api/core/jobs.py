@@ -0,0 +1,518 @@
+"""
+Background jobs for chat and improve requests that outlive proxy timeouts.
+
+``POST /api/jobs`` stores a job and returns its id at once. A fixed pool of
+worker tasks runs queued jobs through the handler registered for their kind,
+under a per-job deadline. Finished jobs keep their result for a TTL; clients
+poll, long-poll, or are called back on a webhook.
+
+With a SQLite path configured, every state change is written through on a
+worker thread. At startup, finished jobs are reloaded until they expire, and
+jobs that were queued or running when the process stopped run again.
+
+Several worker processes can share one store. A worker claims a job with a
+conditional ``UPDATE`` before running it, so each job runs once however
+many processes queued it, and status reads go to the store for jobs that
+have not finished here. Jobs left queued or running by a process that died
+are picked up again once they are older than the job timeout.
+
+Webhook URLs must resolve to public addresses, or name a host listed in
+``WEBHOOK_ALLOWED_HOSTS``, so the service cannot be pointed at internal
+endpoints.
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from prompthash_api.core.admission import RateLimited
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import DeadlineExceeded, deadline_scope
+from prompthash_api.core.metrics import registry
+
+logger = logging.getLogger("prompthash_api.jobs")
+
+JOBS_FINISHED = registry.counter("prompthash_jobs_total", "Finished background jobs by kind and status.", ["kind", "status"])
+JOBS_QUEUED = registry.gauge("prompthash_jobs_queued", "Background jobs waiting for a worker.")
+JOBS_RUNNING = registry.gauge("prompthash_jobs_running", "Background jobs currently running.")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# A handler runs one job payload and returns (result, error message or None).
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Tuple[Dict[str, Any], Optional[str]]]]
+
+_WEBHOOK_ATTEMPTS = 3
+# How often a long poll re-reads the store for a job another process may be running.
+_POLL_SECONDS = 1.0
+# Extra time past the job timeout before a queued or running job counts as abandoned.
+_STALE_GRACE_SECONDS = 60.0
+
+
+async def check_webhook_url(url: str, allowed_hosts: Sequence[str] = ()) -> None:
+    """
+    Raise ValueError unless ``url`` is a webhook the service may call.
+
+    With ``allowed_hosts`` the host must be one of them. Otherwise every
+    address the host resolves to must be public: private, loopback,
+    link-local, multicast and reserved addresses are refused.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("webhook_url must be an http(s) URL.")
+    host = parts.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise ValueError(f"webhook_url host {host!r} is not allowed.")
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError) as exc:
+        raise ValueError(f"webhook_url host {host!r} does not resolve.") from exc
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError("webhook_url must resolve to a public address.")
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    webhook_url: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Public view of the job (the request payload is not echoed back)."""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def to_row(self) -> Tuple[Any, ...]:
+        return (
+            self.id,
+            self.kind,
+            self.status,
+            json.dumps(self.payload),
+            self.created_at,
+            self.started_at,
+            self.finished_at,
+            self.expires_at,
+            json.dumps(self.result) if self.result is not None else None,
+            self.error,
+            self.webhook_url,
+        )
+
+    @classmethod
+    def from_row(cls, row: Tuple[Any, ...]) -> "Job":
+        job_id, kind, status, payload, created_at, started_at, finished_at, expires_at, result, error, webhook_url = row
+        return cls(
+            id=job_id,
+            kind=kind,
+            payload=json.loads(payload),
+            status=status,
+            created_at=created_at,
+            started_at=started_at,
+            finished_at=finished_at,
+            expires_at=expires_at,
+            result=json.loads(result) if result else None,
+            error=error,
+            webhook_url=webhook_url,
+        )
+
+
+class JobStore:
+    """SQLite write-through store for jobs. Blocking; call it from a worker thread."""
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    expires_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    webhook_url TEXT
+                )
+                """
+            )
+        return self._connection
+
+    def save(self, row: Tuple[Any, ...]) -> None:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def load(self) -> List[Job]:
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row is not None else None
+
+    def claim(self, job_id: str, started_at: float, stale_before: float) -> bool:
+        """Mark a queued (or abandoned) job as running; False if another worker got it first."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    """
+                    UPDATE jobs SET status = ?, started_at = ?
+                    WHERE id = ? AND (status = ? OR (status = ? AND started_at < ?))
+                    """,
+                    (RUNNING, started_at, job_id, QUEUED, RUNNING, stale_before),
+                )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str, started_at: float) -> None:
+        """Put a job this worker claimed at ``started_at`` back in the queue."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL WHERE id = ? AND status = ? AND started_at = ?",
+                    (QUEUED, job_id, RUNNING, started_at),
+                )
+
+    def load_abandoned(self, stale_before: float) -> List[Job]:
+        """Unfinished jobs older than ``stale_before``, whose worker has probably gone away."""
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    """
+                    SELECT * FROM jobs
+                    WHERE (status = ? AND created_at < ?) OR (status = ? AND started_at < ?)
+                    ORDER BY created_at
+                    """,
+                    (QUEUED, stale_before, RUNNING, stale_before),
+                )
+                .fetchall()
+            )
+        return [Job.from_row(row) for row in rows]
+
+    def delete_expired(self, now: float) -> None:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class JobManager:
+    """Bounded worker pool and result store for background jobs."""
+
+    def __init__(
+        self,
+        workers: int = 4,
+        queue_limit: int = 1000,
+        result_ttl: float = 3600.0,
+        job_timeout: float = 300.0,
+        store: Optional[JobStore] = None,
+        webhook_timeout: float = 10.0,
+        webhook_allowed_hosts: Sequence[str] = (),
+    ) -> None:
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.result_ttl = result_ttl
+        self.job_timeout = job_timeout
+        self.store = store
+        self.webhook_timeout = webhook_timeout
+        self.webhook_allowed_hosts = tuple(host.lower() for host in webhook_allowed_hosts)
+
+        self._handlers: Dict[str, JobHandler] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued = 0
+        self._running = 0
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self._webhooks: Set[asyncio.Task] = set()
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    @property
+    def kinds(self) -> List[str]:
+        return sorted(self._handlers)
+
+    async def _persist(self, job: Job) -> None:
+        if self.store is not None:
+            await asyncio.to_thread(self.store.save, job.to_row())
+
+    def _enqueue(self, job: Job) -> None:
+        self._queued += 1
+        JOBS_QUEUED.set(value=self._queued)
+        self._queue.put_nowait(job.id)
+
+    async def submit(self, kind: str, payload: Dict[str, Any], webhook_url: Optional[str] = None) -> Job:
+        """Store and queue a job; raises ValueError for unknown kinds and RateLimited when the queue is full."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind {kind!r}; use one of {', '.join(self.kinds)}.")
+        if webhook_url:
+            await check_webhook_url(webhook_url, self.webhook_allowed_hosts)
+        if self._queue is None:
+            raise RuntimeError("Job workers are not running.")
+        if self._queued >= self.queue_limit:
+            raise RateLimited("The job queue is full.", self.job_timeout / self.workers)
+
+        job = Job(id=uuid.uuid4().hex, kind=kind, payload=payload, webhook_url=webhook_url)
+        self._jobs[job.id] = job
+        await self._persist(job)
+        self._enqueue(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if self.store is not None and (job is None or not job.finished):
+            # Another worker process may have queued, claimed or finished it; the store is current.
+            job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None and job.expires_at is not None and job.expires_at <= time.time():
+            return None
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Return the job once it finishes or ``timeout`` elapses (long polling)."""
+        job = await self.get(job_id)
+        if job is None or job.finished or timeout <= 0:
+            return job
+        # Jobs run by another process finish without setting the local event, so the store is polled too.
+        interval = timeout if self.store is None else _POLL_SECONDS
+        deadline = time.monotonic() + timeout
+        event = self._events.setdefault(job_id, asyncio.Event())
+        try:
+            while not event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), min(interval, remaining))
+                except asyncio.TimeoutError:
+                    job = await self.get(job_id)
+                    if job is None or job.finished:
+                        return job
+        finally:
+            if self.store is not None and job_id not in self._jobs:
+                self._events.pop(job_id, None)
+        return await self.get(job_id)
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._http = httpx.AsyncClient(timeout=self.webhook_timeout)
+        if self.store is not None:
+            now = time.time()
+            await asyncio.to_thread(self.store.delete_expired, now)
+            for job in await asyncio.to_thread(self.store.load):
+                self._jobs[job.id] = job
+                if not job.finished:
+                    # Interrupted by a restart; run it again unless another worker process claims it first.
+                    self._enqueue(job)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self, drain_timeout: float = 0.0) -> None:
+        """Stop the workers, first giving running jobs up to ``drain_timeout`` seconds to finish."""
+        self._stopping = True
+        deadline = time.monotonic() + drain_timeout
+        while self._running and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        # Anything still queued or running stays in the store and is re-queued on the next start.
+        tasks = self._tasks + list(self._webhooks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self.store is not None:
+            for job in list(self._jobs.values()):
+                if job.status == RUNNING:
+                    # Release the claim so the next worker to start can run it at once.
+                    await asyncio.to_thread(self.store.release, job.id, job.started_at)
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self.store is not None:
+            await asyncio.to_thread(self.store.close)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._queued -= 1
+            JOBS_QUEUED.set(value=self._queued)
+            job = self._jobs.get(job_id)
+            if job is None or job.finished or self._stopping or not await self._claim(job):
+                continue
+            self._running += 1
+            JOBS_RUNNING.inc()
+            try:
+                await self._run(job)
+            finally:
+                self._running -= 1
+                JOBS_RUNNING.dec()
+
+    async def _claim(self, job: Job) -> bool:
+        # Marked first, so stop() releases the claim even if it lands after this task is cancelled.
+        job.status, job.started_at = RUNNING, time.time()
+        if self.store is not None:
+            stale_before = job.started_at - self.job_timeout - _STALE_GRACE_SECONDS
+            if not await asyncio.to_thread(self.store.claim, job.id, job.started_at, stale_before):
+                # Another worker process has it; status reads go to the store from now on.
+                self._jobs.pop(job.id, None)
+                return False
+        return True
+
+    async def _run(self, job: Job) -> None:
+        result: Optional[Dict[str, Any]] = None
+        error: Optional[str] = None
+        with deadline_scope(self.job_timeout) as deadline:
+            while True:
+                try:
+                    result, error = await self._handlers[job.kind](job.payload)
+                    break
+                except RateLimited as exc:
+                    # Admission is saturated; back off and retry while the job still has budget.
+                    remaining = deadline.remaining() or 0.0
+                    if remaining <= exc.retry_after:
+                        error = exc.reason
+                        break
+                    await asyncio.sleep(exc.retry_after)
+                except DeadlineExceeded as exc:
+                    error = exc.reason
+                    break
+                except Exception:
+                    logger.exception("Job %s (%s) failed", job.id, job.kind)
+                    error = "The job failed unexpectedly."
+                    break
+
+        job.result, job.error = result, error
+        job.status = FAILED if error else SUCCEEDED
+        job.finished_at = time.time()
+        job.expires_at = job.finished_at + self.result_ttl
+        JOBS_FINISHED.inc(job.kind, job.status)
+        await self._persist(job)
+
+        event = self._events.pop(job.id, None)
+        if event is not None:
+            event.set()
+        if job.webhook_url:
+            # Deliver in the background so a slow receiver does not hold a worker.
+            task = asyncio.create_task(self._notify(job))
+            self._webhooks.add(task)
+            task.add_done_callback(self._webhooks.discard)
+
+    async def _notify(self, job: Job) -> None:
+        try:
+            # Checked again at delivery: the name may resolve somewhere else by now.
+            await check_webhook_url(job.webhook_url, self.webhook_allowed_hosts)
+        except ValueError as exc:
+            logger.warning("Not calling webhook for job %s: %s", job.id, exc)
+            return
+        for attempt in range(_WEBHOOK_ATTEMPTS):
+            try:
+                response = await self._http.post(job.webhook_url, json=job.to_dict())
+                if response.status_code < 500:
+                    return
+            except httpx.HTTPError as exc:
+                logger.warning("Webhook for job %s failed: %s", job.id, exc)
+            await asyncio.sleep(2**attempt)
+        logger.warning("Giving up on webhook for job %s after %d attempts", job.id, _WEBHOOK_ATTEMPTS)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop expired finished jobs from memory; returns how many were removed."""
+        now = time.time() if now is None else now
+        expired = [job_id for job_id, job in self._jobs.items() if job.expires_at is not None and job.expires_at <= now]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    async def _sweeper(self, interval: float = 60.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self.store is None:
+                self.sweep()
+                continue
+            now = time.time()
+            if self.sweep(now):
+                await asyncio.to_thread(self.store.delete_expired, now)
+            # Jobs a dead worker process left behind; the claim keeps live workers from doubling up.
+            stale_before = now - self.job_timeout - _STALE_GRACE_SECONDS
+            for job in await asyncio.to_thread(self.store.load_abandoned, stale_before):
+                if job.id not in self._jobs and self._queued < self.queue_limit:
+                    self._jobs[job.id] = job
+                    self._enqueue(job)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"queued": self._queued, "stored": len(self._jobs), "workers": self.workers}
+
+
+@lru_cache
+def get_job_manager() -> JobManager:
+    """Return the process-wide job manager configured from settings."""
+    settings = get_settings()
+    return JobManager(
+        workers=settings.job_workers,
+        queue_limit=settings.job_queue_limit,
+        result_ttl=settings.job_result_ttl_seconds,
+        job_timeout=settings.job_timeout_seconds,
+        store=JobStore(settings.jobs_db_path) if settings.jobs_db_path else None,
+        webhook_allowed_hosts=settings.webhook_allowed_hosts,
+    )
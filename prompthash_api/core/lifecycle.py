@@ -0,0 +1,177 @@
+"""
+Graceful drain for shutdown.
+
+``DrainMiddleware`` tracks in-flight HTTP requests. Once draining starts,
+new requests are refused with 503 and ``Connection: close``, so load
+balancers move traffic elsewhere, while requests already running finish.
+
+uvicorn stops listening as soon as it handles SIGTERM and runs the
+lifespan shutdown only after in-flight requests are done, which is too
+late to refuse anything. :func:`install_drain_handler` therefore starts
+the drain from the signal itself: it waits for in-flight requests, up to
+a deadline, cancels any still running, and only then passes the signal on
+to the server.
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from typing import Callable, Optional, Set
+
+from prompthash_api.core.metrics import registry
+
+DRAIN_REJECTIONS = registry.counter("prompthash_drain_rejections_total", "Requests refused while the worker was draining.")
+
+logger = logging.getLogger("prompthash_api.lifecycle")
+
+
+class Lifecycle:
+    """Shared draining flag and the in-flight request tasks."""
+
+    def __init__(self) -> None:
+        self.draining = False
+        self.drain_started: Optional[float] = None
+        self._requests: Set[asyncio.Task] = set()
+        # Requests cancelled because the drain deadline passed; they answer 503 if they can.
+        self.cut_off: Set[asyncio.Task] = set()
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._requests)
+
+    def reset(self) -> None:
+        self.draining = False
+        self.drain_started = None
+
+    def start_drain(self) -> None:
+        if not self.draining:
+            self.draining = True
+            self.drain_started = time.monotonic()
+
+    def drain_remaining(self, timeout: float) -> float:
+        """What is left of a ``timeout`` counted from the start of the drain."""
+        if self.drain_started is None:
+            return timeout
+        return max(0.0, timeout - (time.monotonic() - self.drain_started))
+
+    def request_started(self, task: asyncio.Task) -> None:
+        self._requests.add(task)
+
+    def request_finished(self, task: asyncio.Task) -> None:
+        self._requests.discard(task)
+        self.cut_off.discard(task)
+        if not self._requests and self._idle is not None:
+            self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Stop accepting requests and wait for in-flight ones.
+
+        ``timeout`` counts from the start of the drain. Requests still running
+        when it passes are cancelled, and False is returned.
+        """
+        self.start_drain()
+        if not self._requests:
+            return True
+        self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_remaining(timeout))
+        except asyncio.TimeoutError:
+            for task in list(self._requests):
+                self.cut_off.add(task)
+                task.cancel()
+            return False
+        return True
+
+
+lifecycle = Lifecycle()
+
+
+def install_drain_handler(timeout: float, state: Lifecycle = lifecycle) -> Optional[Callable[[], None]]:
+    """
+    Drain on SIGTERM before handing the signal to the server's own handler.
+
+    A second SIGTERM is passed on at once. Returns a function that restores
+    the previous handler, or None when no handler was installed (not on the
+    main thread, or no server handler to pass the signal to).
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous):
+        return None
+    loop = asyncio.get_running_loop()
+    pending: Set[asyncio.Task] = set()
+
+    async def drain_then_exit() -> None:
+        if not await state.drain(timeout):
+            logger.warning("Drain timed out; cancelled the requests still in flight")
+        previous(signal.SIGTERM, None)
+
+    def handle() -> None:
+        if state.draining:
+            previous(signal.SIGTERM, None)
+            return
+        logger.info("SIGTERM received; refusing new requests and draining")
+        task = loop.create_task(drain_then_exit())
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, handle)
+    except (NotImplementedError, RuntimeError, ValueError):
+        return None
+
+    def restore() -> None:
+        loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, previous)
+
+    return restore
+
+
+class DrainMiddleware:
+    """Pure ASGI middleware that tracks in-flight requests and refuses new ones while draining."""
+
+    def __init__(self, app, state: Lifecycle = lifecycle) -> None:
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.state.draining:
+            DRAIN_REJECTIONS.inc()
+            await self._refuse(send)
+            return
+        task = asyncio.current_task()
+        response_started = False
+
+        async def send_wrapper(message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        self.state.request_started(task)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            if task not in self.state.cut_off or response_started:
+                raise
+            # Cut off by the drain deadline: the client can still be told to retry elsewhere.
+            task.uncancel()
+            await self._refuse(send)
+        finally:
+            self.state.request_finished(task)
+
+    @staticmethod
+    async def _refuse(send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"retry-after", b"1"), (b"connection", b"close"), (b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b'{"error":"Server is shutting down; retry shortly."}'})
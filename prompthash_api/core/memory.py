@@ -0,0 +1,153 @@
+"""
+On-demand heap tracing with ``tracemalloc``.
+
+:class:`MemoryTracer` starts and stops tracing at runtime, keeps a few
+named snapshots and reports the top allocation sites of one snapshot or
+the growth between two. Tracing slows every allocation and costs memory
+per traced block, so it is off until an admin starts it, and stopping it
+drops the kept snapshots.
+
+Taking and comparing snapshots walks every traced block; those calls run
+in a worker thread so the event loop keeps serving requests meanwhile.
+"""
+
+import time
+import tracemalloc
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from prompthash_api.core.timing import to_thread
+
+# Allocations made by the tracer itself or the import machinery are noise in every report.
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+GROUP_BY = ("lineno", "filename", "traceback")
+
+
+class TracingNotStarted(Exception):
+    """The request needs ``tracemalloc`` to be running."""
+
+
+class UnknownSnapshot(KeyError):
+    """No kept snapshot has the requested id."""
+
+
+def _stat_row(stat: Any, group_by: str) -> Dict[str, Any]:
+    frames = stat.traceback if group_by == "traceback" else stat.traceback[:1]
+    row = {
+        "site": [f"{frame.filename}:{frame.lineno}" if group_by != "filename" else frame.filename for frame in frames],
+        "size_bytes": stat.size,
+        "count": stat.count,
+    }
+    if hasattr(stat, "size_diff"):
+        row["size_diff_bytes"] = stat.size_diff
+        row["count_diff"] = stat.count_diff
+    return row
+
+
+class MemoryTracer:
+    """Controls ``tracemalloc`` and keeps the last ``max_snapshots`` snapshots by id."""
+
+    def __init__(self, max_snapshots: int = 4) -> None:
+        self.max_snapshots = max(2, max_snapshots)
+        self._snapshots: "OrderedDict[int, tracemalloc.Snapshot]" = OrderedDict()
+        self._taken_at: Dict[int, float] = {}
+        self._next_id = 1
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1) -> bool:
+        """Start tracing with ``frames`` frames per allocation; False if it was already running."""
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(max(1, frames))
+        return True
+
+    def stop(self) -> bool:
+        """Stop tracing and free the traces and kept snapshots; False if it was not running."""
+        self._snapshots.clear()
+        self._taken_at.clear()
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": self.tracing,
+            "frames": tracemalloc.get_traceback_limit() if self.tracing else None,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "tracer_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": [{"id": snapshot_id, "taken_at": self._taken_at[snapshot_id]} for snapshot_id in self._snapshots],
+        }
+
+    async def take_snapshot(self) -> int:
+        """Snapshot the traced heap and keep it; the oldest kept snapshot is dropped past the limit."""
+        if not self.tracing:
+            raise TracingNotStarted("Start tracing before taking a snapshot.")
+        snapshot = await to_thread(lambda: tracemalloc.take_snapshot().filter_traces(_FILTERS))
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self._snapshots[snapshot_id] = snapshot
+        self._taken_at[snapshot_id] = time.time()
+        while len(self._snapshots) > self.max_snapshots:
+            dropped, _ = self._snapshots.popitem(last=False)
+            self._taken_at.pop(dropped, None)
+        return snapshot_id
+
+    def _get(self, snapshot_id: int) -> tracemalloc.Snapshot:
+        try:
+            return self._snapshots[snapshot_id]
+        except KeyError:
+            raise UnknownSnapshot(snapshot_id) from None
+
+    async def top(self, snapshot_id: Optional[int] = None, group_by: str = "lineno", limit: int = 20) -> Dict[str, Any]:
+        """Largest allocation sites in a kept snapshot, or in a new one when ``snapshot_id`` is None."""
+        if snapshot_id is None:
+            snapshot_id = await self.take_snapshot()
+        snapshot = self._get(snapshot_id)
+
+        def report() -> Dict[str, Any]:
+            stats = snapshot.statistics(group_by)
+            return {
+                "snapshot": snapshot_id,
+                "total_bytes": sum(stat.size for stat in stats),
+                "top": [_stat_row(stat, group_by) for stat in stats[:limit]],
+            }
+
+        return await to_thread(report)
+
+    async def diff(
+        self,
+        base_id: int,
+        snapshot_id: Optional[int] = None,
+        group_by: str = "lineno",
+        limit: int = 20,
+    ) -> Dict[str, Any]:
+        """Sites that grew most from ``base_id`` to ``snapshot_id`` (a new snapshot when None)."""
+        base = self._get(base_id)
+        if snapshot_id is None:
+            snapshot_id = await self.take_snapshot()
+        current = self._get(snapshot_id)
+
+        def report() -> Dict[str, Any]:
+            stats = current.compare_to(base, group_by)
+            return {
+                "base": base_id,
+                "snapshot": snapshot_id,
+                "size_diff_bytes": sum(stat.size_diff for stat in stats),
+                "top": [_stat_row(stat, group_by) for stat in stats[:limit]],
+            }
+
+        return await to_thread(report)
+
+
+tracer = MemoryTracer()
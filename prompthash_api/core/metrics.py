@@ -0,0 +1,285 @@
+"""
+Minimal Prometheus-style metrics registry.
+
+Each worker process keeps its own registry. Every metric is recorded from
+the event loop thread, so updates are plain dict operations: they never
+take a lock and never touch the asyncio locks that guard request state.
+
+Clients choose the model they ask for, so ``model`` label values go
+through :func:`model_label`: configured and upstream-listed models keep
+their name and anything else is recorded as ``other``.
+"""
+
+import bisect
+import os
+import time
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.timing import current_timings
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+OTHER_MODEL = "other"
+# Upper bound on upstream-listed models kept as label values.
+_MAX_LISTED_MODELS = 512
+_listed_models: Set[str] = set()
+
+
+@lru_cache
+def _configured_models() -> FrozenSet[str]:
+    settings = get_settings()
+    chains = settings.chat_fallback_models + settings.improve_fallback_models
+    return frozenset([settings.chat_model, settings.improver_model, *(model for model, _ in chains)])
+
+
+def register_models(models: Iterable[str]) -> None:
+    """Add models listed upstream to the names :func:`model_label` keeps."""
+    for model in models:
+        if len(_listed_models) >= _MAX_LISTED_MODELS:
+            break
+        if model:
+            _listed_models.add(model)
+
+
+def model_label(model: str) -> str:
+    """``model`` when it is configured or listed upstream, otherwise ``other``."""
+    if not model or model in _listed_models or model in _configured_models():
+        return model
+    return OTHER_MODEL
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Sequence[str]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(label) for label in labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> Iterable[str]:  # pragma: no cover - implemented by subclasses
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts..., +Inf count], sum.
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, *labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> Iterable[str]:
+        for key in sorted(self._counts):
+            counts = self._counts[key]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    """Holds metrics for one worker and renders the text exposition format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+PROCESS_START = registry.gauge("prompthash_process_start_time_seconds", "Unix time the worker started.", ["pid"])
+PROCESS_START.set(str(os.getpid()), value=time.time())
+
+HTTP_REQUESTS = registry.counter(
+    "prompthash_http_requests_total", "HTTP requests by route, method and status.", ["route", "method", "status"]
+)
+HTTP_LATENCY = registry.histogram(
+    "prompthash_http_request_duration_seconds", "HTTP request latency by route and model.", ["route", "model"]
+)
+HTTP_IN_FLIGHT = registry.gauge("prompthash_http_requests_in_flight", "HTTP requests currently being served.")
+
+UPSTREAM_REQUESTS = registry.counter(
+    "prompthash_upstream_requests_total", "Upstream ASI calls by endpoint and model.", ["endpoint", "model"]
+)
+UPSTREAM_ERRORS = registry.counter(
+    "prompthash_upstream_errors_total", "Failed upstream ASI calls by error class.", ["endpoint", "model", "error"]
+)
+UPSTREAM_LATENCY = registry.histogram(
+    "prompthash_upstream_duration_seconds", "Upstream ASI call latency by endpoint and model.", ["endpoint", "model"]
+)
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "prompthash_upstream_in_flight", "Upstream ASI calls currently outstanding.", ["endpoint"]
+)
+TOKENS = registry.counter(
+    "prompthash_tokens_total", "Tokens reported by upstream usage.", ["endpoint", "model", "kind"]
+)
+
+
+def observe_upstream(
+    endpoint: str,
+    model: str,
+    seconds: float,
+    usage: Optional[Dict[str, int]] = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    """Record one finished upstream call (successful or not)."""
+    model = model_label(model)
+    UPSTREAM_REQUESTS.inc(endpoint, model)
+    UPSTREAM_LATENCY.observe(seconds, endpoint, model)
+    if error is not None:
+        UPSTREAM_ERRORS.inc(endpoint, model, type(error).__name__)
+    if usage:
+        TOKENS.inc(endpoint, model, "prompt", amount=usage.get("prompt_tokens", 0))
+        TOKENS.inc(endpoint, model, "completion", amount=usage.get("completion_tokens", 0))
+        TOKENS.inc(endpoint, model, "cached_prompt", amount=usage.get("cached_tokens", 0))
+
+
+def route_label(scope) -> str:
+    """Route template for a request (``/api/jobs/{job_id}``), keeping label cardinality bounded."""
+    if scope.get("route") is None:
+        return "unmatched"
+    path = scope.get("path", "")
+    for name, value in (scope.get("path_params") or {}).items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request counts, latency and in-flight requests."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = route_label(scope)
+            timings = current_timings()
+            model = model_label(str(timings.tags.get("model", ""))) if timings is not None else ""
+            HTTP_REQUESTS.inc(route, scope.get("method", ""), str(status_code))
+            HTTP_LATENCY.observe(time.perf_counter() - started, route, model)
@@ -0,0 +1,173 @@
+"""
+Output-length tracking and adaptive ``max_tokens``.
+
+Every completion's ``usage.completion_tokens`` and ``finish_reason`` are
+recorded per (model, endpoint, target). In ``adaptive`` mode the
+``max_tokens`` sent upstream becomes a high quantile of the recent lengths
+plus headroom, clamped to ``[floor, ceiling]``. A model that always stops
+at 150 tokens then reserves about 180 instead of 512, and the scheduler
+and the admission estimate see the smaller number.
+
+A truncated completion (``finish_reason == "length"``) only tells us that
+the answer needed more than the limit, so it counts as twice the limit it
+hit. Once more than ``1 - quantile`` of recent completions are truncated,
+the quantile lands on those samples and the budget grows until truncation
+drops. Truncation rates above ``alert_rate`` are flagged in
+:meth:`OutputBudget.snapshot` whatever the mode.
+"""
+
+import math
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.metrics import model_label, registry
+
+BudgetKey = Tuple[str, str, str]
+
+COMPLETION_TOKENS = registry.histogram(
+    "prompthash_completion_tokens",
+    "Completion length in tokens by endpoint and target.",
+    ["endpoint", "target"],
+    buckets=(16, 32, 64, 128, 256, 384, 512, 768, 1024, 2048, 4096),
+)
+TRUNCATED = registry.counter(
+    "prompthash_completion_truncated_total",
+    "Completions cut off at max_tokens (finish_reason=length).",
+    ["endpoint", "model", "target"],
+)
+
+
+class _LengthStats:
+    """Recent completion lengths for one key, with the budget derived from them."""
+
+    def __init__(self, window: int) -> None:
+        # (length, truncated) pairs; truncated lengths are the limit that was hit.
+        self.samples: Deque[Tuple[int, bool]] = deque(maxlen=window)
+        self.truncated = 0
+        self.total = 0
+        self.budget: Optional[int] = None
+        self.since_update = 0
+
+    def add(self, length: int, truncated: bool) -> None:
+        if len(self.samples) == self.samples.maxlen and self.samples[0][1]:
+            self.truncated -= 1
+        self.samples.append((length, truncated))
+        self.truncated += truncated
+        self.total += 1
+        self.since_update += 1
+
+    def quantile(self, q: float) -> int:
+        lengths = sorted(length * 2 if truncated else length for length, truncated in self.samples)
+        return lengths[min(len(lengths) - 1, math.ceil(q * len(lengths)) - 1)]
+
+    @property
+    def truncation_rate(self) -> float:
+        return self.truncated / len(self.samples) if self.samples else 0.0
+
+
+class OutputBudget:
+    """Records completion lengths and picks ``max_tokens`` per (model, endpoint, target)."""
+
+    def __init__(
+        self,
+        mode: str = "fixed",
+        quantile: float = 0.99,
+        headroom: float = 0.2,
+        min_samples: int = 50,
+        floor: int = 64,
+        ceiling: int = 2048,
+        alert_rate: float = 0.02,
+        window: int = 500,
+        recompute_every: int = 20,
+        max_keys: int = 256,
+    ) -> None:
+        self.adaptive = mode == "adaptive"
+        self.quantile = min(1.0, max(0.5, quantile))
+        self.headroom = max(0.0, headroom)
+        self.min_samples = max(1, min_samples)
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.alert_rate = alert_rate
+        self.window = max(self.min_samples, window)
+        self.recompute_every = max(1, recompute_every)
+        self.max_keys = max(1, max_keys)
+        self._stats: "OrderedDict[BudgetKey, _LengthStats]" = OrderedDict()
+
+    def max_tokens(self, model: str, endpoint: str, target: str, default: int) -> int:
+        """The ``max_tokens`` to send: ``default`` until enough samples exist or in fixed mode."""
+        if not self.adaptive:
+            return default
+        stats = self._stats.get((model, endpoint, target))
+        if stats is None or stats.budget is None:
+            return default
+        return stats.budget
+
+    def observe(
+        self,
+        model: str,
+        endpoint: str,
+        target: str,
+        usage: Optional[Dict[str, int]],
+        finish_reason: Optional[str],
+        limit: int,
+    ) -> None:
+        """Record one completion; results without usage are skipped."""
+        truncated = finish_reason == "length"
+        if truncated:
+            TRUNCATED.inc(endpoint, model_label(model), target)
+        if not usage or not usage.get("completion_tokens"):
+            return
+        length = int(usage["completion_tokens"])
+        COMPLETION_TOKENS.observe(length, endpoint, target)
+
+        key = (model, endpoint, target)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _LengthStats(self.window)
+            # Chat models are caller-chosen, so the key set needs a bound.
+            while len(self._stats) > self.max_keys:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(key)
+        stats.add(max(length, limit) if truncated else length, truncated)
+        if len(stats.samples) >= self.min_samples and (stats.budget is None or stats.since_update >= self.recompute_every):
+            stats.since_update = 0
+            budget = math.ceil(stats.quantile(self.quantile) * (1.0 + self.headroom))
+            stats.budget = min(self.ceiling, max(self.floor, budget))
+
+    def snapshot(self) -> Dict[str, Any]:
+        keys = []
+        for (model, endpoint, target), stats in self._stats.items():
+            lengths = sorted(length for length, _ in stats.samples)
+            keys.append(
+                {
+                    "model": model,
+                    "endpoint": endpoint,
+                    "target": target,
+                    "samples": len(lengths),
+                    "total": stats.total,
+                    "p50_tokens": lengths[len(lengths) // 2] if lengths else None,
+                    "p99_tokens": lengths[min(len(lengths) - 1, math.ceil(0.99 * len(lengths)) - 1)] if lengths else None,
+                    "adaptive_max_tokens": stats.budget,
+                    "truncation_rate": round(stats.truncation_rate, 4),
+                    "truncation_flagged": stats.truncation_rate > self.alert_rate,
+                }
+            )
+        return {"mode": "adaptive" if self.adaptive else "fixed", "quantile": self.quantile, "headroom": self.headroom, "keys": keys}
+
+
+@lru_cache
+def get_output_budget() -> OutputBudget:
+    """Return the process-wide output-length tracker configured from settings."""
+    settings = get_settings()
+    return OutputBudget(
+        mode=settings.max_tokens_mode,
+        quantile=settings.max_tokens_quantile,
+        headroom=settings.max_tokens_headroom,
+        min_samples=settings.max_tokens_min_samples,
+        floor=settings.max_tokens_floor,
+        ceiling=settings.max_tokens_ceiling,
+        alert_rate=settings.truncation_alert_rate,
+    )
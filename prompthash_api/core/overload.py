@@ -0,0 +1,133 @@
+"""
+Event-loop lag and thread-pool saturation monitoring with load shedding.
+
+Everything in a worker shares one event loop, so a burst of requests or a
+slow synchronous section delays every request at once. :class:`LoadMonitor`
+measures that directly: a task asks to wake every ``interval`` seconds and
+records how late it actually woke (the loop lag), and the :func:`to_thread`
+counters show how many blocking calls are waiting for a worker thread.
+
+When a priority class's lag or pool-queue threshold is crossed, the
+admission controller refuses new work of that class with 503 and
+``Retry-After`` (see :class:`~prompthash_api.core.admission.Overloaded`),
+so overload degrades bulk and standard traffic first instead of slowing
+everything down. Interactive traffic is never shed unless configured.
+"""
+
+import asyncio
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.metrics import registry
+from prompthash_api.core.timing import thread_pool
+
+LOOP_LAG = registry.gauge("prompthash_event_loop_lag_seconds", "Smoothed event-loop lag (how late timers fire).")
+LOOP_LAG_SAMPLES = registry.histogram(
+    "prompthash_event_loop_lag_sample_seconds",
+    "Individual event-loop lag samples.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+POOL_BUSY = registry.gauge("prompthash_thread_pool_busy", "Worker threads running a blocking call.")
+POOL_WAITING = registry.gauge("prompthash_thread_pool_waiting", "Blocking calls waiting for a worker thread.")
+LOAD_SHED = registry.counter(
+    "prompthash_load_shed_total",
+    "Requests refused because the worker was overloaded.",
+    ["priority", "cause"],
+)
+
+
+class LoadMonitor:
+    """
+    Samples loop lag and thread-pool usage and decides which classes to shed.
+
+    ``lag_thresholds`` maps a priority to the smoothed lag (seconds) at
+    which it is shed; ``pool_thresholds`` maps a priority to the number of
+    waiting blocking calls, as a fraction of ``pool_size``. Priorities left
+    out of both are never shed.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        pool_size: int = 40,
+        lag_thresholds: Optional[Dict[str, float]] = None,
+        pool_thresholds: Optional[Dict[str, float]] = None,
+        retry_after: float = 2.0,
+        window: int = 100,
+    ) -> None:
+        self.interval = interval
+        self.pool_size = max(1, pool_size)
+        self.lag_thresholds = dict(lag_thresholds or {})
+        self.pool_thresholds = dict(pool_thresholds or {})
+        self.retry_after = retry_after
+        self.lag_ewma = 0.0
+        self._recent: Deque[float] = deque(maxlen=max(1, window))
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def record_lag(self, lag: float) -> None:
+        lag = max(0.0, lag)
+        # Fast to rise, slower to fall, so shedding starts promptly and does not flap.
+        alpha = 0.5 if lag > self.lag_ewma else 0.1
+        self.lag_ewma += alpha * (lag - self.lag_ewma)
+        self._recent.append(lag)
+        LOOP_LAG.set(value=self.lag_ewma)
+        LOOP_LAG_SAMPLES.observe(lag)
+        POOL_BUSY.set(value=thread_pool.busy)
+        POOL_WAITING.set(value=thread_pool.waiting)
+
+    def shed_cause(self, priority: str) -> Optional[str]:
+        """``"loop_lag"`` or ``"thread_pool"`` when new ``priority`` work should be refused."""
+        if not self.enabled:
+            return None
+        lag_threshold = self.lag_thresholds.get(priority)
+        if lag_threshold is not None and self.lag_ewma >= lag_threshold:
+            return "loop_lag"
+        pool_threshold = self.pool_thresholds.get(priority)
+        if pool_threshold is not None and thread_pool.waiting >= max(1.0, pool_threshold * self.pool_size):
+            return "thread_pool"
+        return None
+
+    def check(self, priority: str) -> Optional[Tuple[str, float]]:
+        """``(cause, retry_after)`` if ``priority`` work is being shed, else None; counts the refusal."""
+        cause = self.shed_cause(priority)
+        if cause is None:
+            return None
+        LOAD_SHED.inc(priority, cause)
+        return cause, self.retry_after
+
+    def snapshot(self) -> Dict[str, Any]:
+        shedding: List[str] = sorted(
+            priority for priority in set(self.lag_thresholds) | set(self.pool_thresholds) if self.shed_cause(priority)
+        )
+        return {
+            "loop_lag_ms": round(self.lag_ewma * 1000, 2),
+            "loop_lag_max_ms": round(max(self._recent, default=0.0) * 1000, 2),
+            "thread_pool": {"size": self.pool_size, "busy": thread_pool.busy, "waiting": thread_pool.waiting},
+            "shedding": shedding,
+        }
+
+    async def run(self) -> None:
+        """Sample the loop lag every ``interval`` seconds until cancelled."""
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record_lag(time.perf_counter() - expected)
+
+
+@lru_cache
+def get_load_monitor() -> LoadMonitor:
+    """Return the process-wide load monitor configured from settings."""
+    settings = get_settings()
+    return LoadMonitor(
+        interval=settings.loop_lag_interval_seconds,
+        pool_size=max(settings.worker_threads, settings.upstream_max_concurrency),
+        lag_thresholds=settings.shed_lag_thresholds,
+        pool_thresholds=settings.shed_pool_thresholds,
+        retry_after=settings.shed_retry_after_seconds,
+    )
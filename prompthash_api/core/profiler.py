@@ -0,0 +1,122 @@
+"""
+On-demand sampling CPU profiler.
+
+:class:`SamplingProfiler` starts a dedicated thread that snapshots every
+thread's Python stack with ``sys._current_frames()`` at a fixed interval
+and counts identical stacks. The result is in the collapsed format
+(``thread;outer;...;inner count`` per line) read by ``flamegraph.pl``,
+speedscope and similar tools. It covers the event loop thread and the
+worker threads running ``to_thread`` calls.
+
+Nothing runs until a profile is requested, so there is no cost while it is
+off. Only one profile runs at a time.
+"""
+
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Leaf frames of a thread that is waiting rather than working.
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+# ThreadPoolExecutor names workers "<prefix>_<n>"; one flame per pool reads better than one per thread.
+_WORKER_SUFFIX = re.compile(r"_\d+$")
+
+
+class ProfilerBusy(Exception):
+    """A profile is already running."""
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename.replace(os.sep, "/")
+    short = "/".join(path.rsplit("/", 2)[-2:])
+    return f"{code.co_name} ({short}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Collects collapsed stacks from all threads for a fixed duration."""
+
+    def __init__(self) -> None:
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _sample(
+        self,
+        seconds: float,
+        interval: float,
+        include_idle: bool,
+        loop_thread: Optional[int],
+    ) -> Tuple[Counter, int]:
+        stacks: Counter = Counter()
+        own = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        samples = 0
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if not include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                labels: List[str] = []
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                thread_name = "event-loop" if ident == loop_thread else _WORKER_SUFFIX.sub("", names.get(ident, str(ident)))
+                labels.append(thread_name)
+                labels.reverse()
+                stacks[";".join(labels)] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples
+
+    async def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> Dict[str, object]:
+        """
+        Sample for ``seconds`` and return ``{"samples", "interval", "collapsed"}``.
+
+        The sampler runs on its own thread, not the shared worker pool, so it
+        neither waits for nor occupies a worker.
+        """
+        if self._running:
+            raise ProfilerBusy("A profile is already running.")
+        self._running = True
+        loop = asyncio.get_running_loop()
+        done: asyncio.Future = loop.create_future()
+        loop_thread = threading.get_ident()
+
+        def run() -> None:
+            # Cleared by the sampler itself, so a caller that goes away cannot start a second one early.
+            try:
+                result = self._sample(seconds, interval, include_idle, loop_thread)
+            except BaseException as exc:  # pragma: no cover - reported to the caller
+                loop.call_soon_threadsafe(done.set_exception, exc)
+            else:
+                loop.call_soon_threadsafe(done.set_result, result)
+            finally:
+                self._running = False
+
+        try:
+            threading.Thread(target=run, name="prompthash-profiler", daemon=True).start()
+        except BaseException:
+            self._running = False
+            raise
+        stacks, samples = await asyncio.shield(done)
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        return {"samples": samples, "interval": interval, "collapsed": collapsed}
+
+
+profiler = SamplingProfiler()
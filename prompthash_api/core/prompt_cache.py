@@ -0,0 +1,237 @@
+"""
+Improver response cache with near-duplicate matching.
+
+An ``exact`` hit needs the same prompt up to Unicode NFC and runs of
+whitespace; case and punctuation count, since ``x > 5`` and ``x < 5`` are
+different prompts. Anything looser is a ``near`` hit: a 64-bit SimHash
+over case-folded word and punctuation unigrams and bigrams finds prompts
+that differ by a word or two, and the per-target threshold decides how
+close is close enough. Neighbours are found through an LSH
+index that splits the signature into bands. Two signatures within Hamming
+distance ``d`` share at least one of ``d + 1`` bands, so no neighbour within
+the threshold is missed. The index has at most 16 bands, so thresholds
+are clamped to a distance of 15 (similarity of about 0.77).
+
+The signature is computed without a 64-step loop per feature: each
+feature hash is spread through a byte lookup table into 64 lanes of 16
+bits in one Python integer, so all 64 bit counters are updated by a single
+integer addition per feature.
+"""
+
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.metrics import registry
+
+EXACT = "exact"
+NEAR = "near"
+
+IMPROVE_CACHE_LOOKUPS = registry.counter(
+    "prompthash_improve_cache_total",
+    "Improver cache lookups by target and outcome (exact, near, miss).",
+    ["target", "outcome"],
+)
+
+logger = logging.getLogger("prompthash_api.prompt_cache")
+
+SIGNATURE_BITS = 64
+# Upper bound on LSH bands; a signature within distance MAX_BANDS - 1 always shares one.
+MAX_BANDS = 16
+_LANE = 16
+_LANE_MASK = (1 << _LANE) - 1
+_HASH_MASK = (1 << SIGNATURE_BITS) - 1
+# _SPREAD[b] places bit i of byte b at the bottom of lane i.
+_SPREAD = [sum(1 << (i * _LANE) for i in range(8) if value >> i & 1) for value in range(256)]
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Exact-match form of a prompt: NFC with whitespace runs collapsed to one space."""
+    return _SPACE.sub(" ", unicodedata.normalize("NFC", prompt)).strip()
+
+
+def _feature_lanes(feature: str) -> int:
+    """The feature's 64-bit hash with each bit moved to the bottom of its own 16-bit lane."""
+    # str hashes are cached on the object and stable for the life of the process, which is all
+    # an in-memory index needs; a cryptographic hash would double the signature cost.
+    value = hash(feature) & _HASH_MASK
+    spread = _SPREAD
+    return (
+        spread[value & 0xFF]
+        | spread[value >> 8 & 0xFF] << 128
+        | spread[value >> 16 & 0xFF] << 256
+        | spread[value >> 24 & 0xFF] << 384
+        | spread[value >> 32 & 0xFF] << 512
+        | spread[value >> 40 & 0xFF] << 640
+        | spread[value >> 48 & 0xFF] << 768
+        | spread[value >> 56 & 0xFF] << 896
+    )
+
+
+def simhash(prompt: str) -> int:
+    """64-bit SimHash of a prompt over case-folded (NFKC) word and punctuation unigrams and bigrams."""
+    words = _TOKEN.findall(unicodedata.normalize("NFKC", prompt).lower())
+    features: Dict[str, int] = {}
+    for word in words:
+        features[word] = features.get(word, 0) + 1
+    for first, second in zip(words, words[1:]):
+        bigram = first + " " + second
+        features[bigram] = features.get(bigram, 0) + 1
+
+    counters = 0
+    total = 0
+    for feature, weight in features.items():
+        # Lanes are 16 bits wide; keep a pathological prompt from overflowing them.
+        if total + weight > _LANE_MASK:
+            break
+        total += weight
+        lanes = _feature_lanes(feature)
+        counters += lanes if weight == 1 else lanes * weight
+
+    signature = 0
+    for bit in range(SIGNATURE_BITS):
+        if 2 * (counters >> (bit * _LANE) & _LANE_MASK) > total:
+            signature |= 1 << bit
+    return signature
+
+
+class _Entry:
+    __slots__ = ("key", "signature", "value", "expires_at")
+
+    def __init__(self, key: Tuple[str, str], signature: int, value: str, expires_at: float) -> None:
+        self.key = key
+        self.signature = signature
+        self.value = value
+        self.expires_at = expires_at
+
+
+class NearDuplicateCache:
+    """
+    LRU+TTL cache from prompt to improved prompt with SimHash LSH lookup.
+
+    ``thresholds`` maps a target to the minimum similarity (``1 - hamming /
+    64``) accepted as a near hit; targets without one only get exact hits.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 86400.0, thresholds: Optional[Dict[str, float]] = None) -> None:
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.max_distance: Dict[str, int] = {}
+        for target, similarity in (thresholds or {}).items():
+            if not 0.0 < similarity <= 1.0:
+                continue
+            distance = int((1.0 - similarity) * SIGNATURE_BITS)
+            if distance > MAX_BANDS - 1:
+                # More bands than the index has would let near matches slip through unseen.
+                logger.warning(
+                    "Improve cache threshold %.3g for %s is below the supported minimum; using %.3g",
+                    similarity,
+                    target,
+                    1.0 - (MAX_BANDS - 1) / SIGNATURE_BITS,
+                )
+                distance = MAX_BANDS - 1
+            self.max_distance[target] = distance
+        # Enough bands that every neighbour within the largest distance shares one.
+        self.bands = max(self.max_distance.values(), default=0) + 1
+        self._widths = [SIGNATURE_BITS // self.bands + (1 if band < SIGNATURE_BITS % self.bands else 0) for band in range(self.bands)]
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], Set[Tuple[str, str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _band_keys(self, scope: str, signature: int) -> List[Tuple[str, int, int]]:
+        keys = []
+        shift = 0
+        for band, width in enumerate(self._widths):
+            keys.append((scope, band, signature >> shift & ((1 << width) - 1)))
+            shift += width
+        return keys
+
+    def _remove(self, entry: _Entry) -> None:
+        del self._entries[entry.key]
+        for band_key in self._band_keys(entry.key[0], entry.signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(entry.key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def lookup(self, scope: str, target: str, prompt: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Return ``(value, "exact" | "near")`` or ``(None, None)`` on a miss.
+
+        ``scope`` separates entries that must never match each other, such as
+        results from different models.
+        """
+        if not self.enabled:
+            return None, None
+        now = time.monotonic()
+        normalized = normalize_prompt(prompt)
+        key = (scope + "\x00" + target, normalized)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > now:
+            self._entries.move_to_end(key)
+            IMPROVE_CACHE_LOOKUPS.inc(target, EXACT)
+            return entry.value, EXACT
+
+        max_distance = self.max_distance.get(target)
+        if max_distance is not None:
+            signature = simhash(prompt)
+            best: Optional[_Entry] = None
+            best_distance = max_distance + 1
+            for band_key in self._band_keys(key[0], signature):
+                for candidate_key in self._buckets.get(band_key, ()):
+                    candidate = self._entries[candidate_key]
+                    distance = bin(candidate.signature ^ signature).count("1")
+                    if distance < best_distance and candidate.expires_at > now:
+                        best, best_distance = candidate, distance
+            if best is not None:
+                self._entries.move_to_end(best.key)
+                IMPROVE_CACHE_LOOKUPS.inc(target, NEAR)
+                return best.value, NEAR
+
+        IMPROVE_CACHE_LOOKUPS.inc(target, "miss")
+        return None, None
+
+    def store(self, scope: str, target: str, prompt: str, value: str) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        normalized = normalize_prompt(prompt)
+        key = (scope + "\x00" + target, normalized)
+        existing = self._entries.get(key)
+        if existing is not None:
+            self._remove(existing)
+        entry = _Entry(key, simhash(prompt), value, now + self.ttl_seconds)
+        self._entries[key] = entry
+        for band_key in self._band_keys(key[0], entry.signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+        # The front holds the least recently used entries: drop the expired ones, then any over the bound.
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest.expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._remove(oldest)
+
+
+@lru_cache
+def get_improve_cache() -> NearDuplicateCache:
+    """Return the process-wide improver cache configured from settings."""
+    settings = get_settings()
+    return NearDuplicateCache(
+        max_entries=settings.improve_cache_size,
+        ttl_seconds=settings.improve_cache_ttl_seconds,
+        thresholds=settings.improve_cache_thresholds,
+    )
@@ -0,0 +1,196 @@
+"""
+Multi-model races.
+
+:func:`run_race` sends one request to several models at once. Each leg
+runs under its own branch of the request deadline (see
+:meth:`~prompthash_api.core.deadlines.Deadline.branch`). In ``race`` mode
+the first accepted answer wins, and the other legs are cancelled: their
+tasks stop and their streaming upstream calls stop reading, which closes
+the connection. A non-streaming call cannot be stopped; it runs on in its
+worker thread, and :func:`~prompthash_api.clients.asi_client.run_upstream`
+records and settles its usage when it returns. In ``compare`` mode every
+leg runs to completion.
+
+:class:`RaceStats` keeps per-model win counts and the latency of completed
+legs, so defaults can be picked from how models actually perform.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from prompthash_api.core.admission import RateLimited
+from prompthash_api.core.deadlines import Deadline, DeadlineExceeded, current_deadline, use_deadline
+from prompthash_api.core.metrics import model_label, registry
+
+T = TypeVar("T")
+
+RACE = "race"
+COMPARE = "compare"
+MODES = (RACE, COMPARE)
+
+WON, LOST, FAILED, ANSWERED = "won", "lost", "error", "answered"
+
+RACE_LEGS = registry.counter(
+    "prompthash_race_legs_total",
+    "Race legs by endpoint, model and outcome (won, lost, error, answered).",
+    ["endpoint", "model", "outcome"],
+)
+RACE_LEG_LATENCY = registry.histogram(
+    "prompthash_race_leg_seconds",
+    "Latency of race legs that finished, by endpoint and model.",
+    ["endpoint", "model"],
+)
+
+
+@dataclass
+class RaceLeg:
+    """One model's part in a race."""
+
+    model: str
+    status: str = LOST
+    result: Any = None
+    error: Optional[BaseException] = None
+    seconds: Optional[float] = None
+
+
+class RaceStats:
+    """Per-(endpoint, model) race counts and recent completed-leg latencies; unknown models count as ``other``."""
+
+    def __init__(self, window: int = 200) -> None:
+        self.window = max(1, window)
+        self._counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def record(self, endpoint: str, legs: List[RaceLeg]) -> None:
+        for leg in legs:
+            model = model_label(leg.model)
+            key = (endpoint, model)
+            counts = self._counts.setdefault(key, {"races": 0, WON: 0, LOST: 0, FAILED: 0, ANSWERED: 0})
+            counts["races"] += 1
+            counts[leg.status] += 1
+            RACE_LEGS.inc(endpoint, model, leg.status)
+            if leg.seconds is not None and leg.status != FAILED:
+                self._latencies.setdefault(key, deque(maxlen=self.window)).append(leg.seconds)
+                RACE_LEG_LATENCY.observe(leg.seconds, endpoint, model)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        rows = []
+        for (endpoint, model), counts in sorted(self._counts.items()):
+            latencies = sorted(self._latencies.get((endpoint, model), ()))
+            # Compare-mode legs are "answered"; the fastest of them still counts as the winner.
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "model": model,
+                    "races": counts["races"],
+                    "wins": counts[WON],
+                    "win_rate": round(counts[WON] / counts["races"], 3),
+                    "errors": counts[FAILED],
+                    "error_rate": round(counts[FAILED] / counts["races"], 3),
+                    "p50_latency_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                    "p95_latency_ms": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000, 1)
+                    if latencies
+                    else None,
+                }
+            )
+        return rows
+
+
+async def _run_leg(leg: RaceLeg, deadline: Deadline, call: Callable[[str], Awaitable[T]], accept: Callable[[T], bool]) -> RaceLeg:
+    started = time.perf_counter()
+    try:
+        with use_deadline(deadline):
+            leg.result = await call(leg.model)
+        if not accept(leg.result):
+            raise ValueError("empty response")
+        leg.status = ANSWERED
+    except Exception as exc:
+        leg.status, leg.error = FAILED, exc
+    leg.seconds = time.perf_counter() - started
+    return leg
+
+
+async def run_race(
+    endpoint: str,
+    models: List[str],
+    call: Callable[[str], Awaitable[T]],
+    mode: str = RACE,
+    accept: Callable[[T], bool] = bool,
+    stats: Optional[RaceStats] = None,
+) -> Tuple[RaceLeg, List[RaceLeg]]:
+    """
+    Run ``call(model)`` for every model concurrently.
+
+    Returns ``(winner, legs)``, where the winner is the first leg whose
+    result passes ``accept``. In ``race`` mode the other legs are
+    cancelled as soon as there is a winner; in ``compare`` mode they all
+    finish. Legs are returned in ``models`` order. When every leg fails,
+    one of their errors is raised.
+    """
+    parent = current_deadline() or Deadline()
+    legs = [RaceLeg(model) for model in models]
+    pending: Dict[asyncio.Task, Deadline] = {}
+    for leg in legs:
+        branch = parent.branch()
+        pending[asyncio.create_task(_run_leg(leg, branch, call, accept))] = branch
+    winner: Optional[RaceLeg] = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished = [task.result() for task in done]
+            for task in done:
+                del pending[task]
+            # Several legs can finish in the same pass; the fastest one wins.
+            for leg in sorted(finished, key=lambda leg: leg.seconds):
+                if winner is None and leg.status == ANSWERED:
+                    winner = leg
+            if winner is not None and mode == RACE:
+                break
+    finally:
+        for task, branch in pending.items():
+            branch.abandon()
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    if winner is not None:
+        winner.status = WON
+    (stats or get_race_stats()).record(endpoint, legs)
+    if winner is None:
+        errors = [leg.error for leg in legs if leg.error is not None]
+        # Deadline and rate-limit errors keep their own status codes, as on the single-model path.
+        raise next((error for error in errors if isinstance(error, (DeadlineExceeded, RateLimited))), errors[0])
+    return winner, legs
+
+
+def candidate_models(models: Optional[List[str]], limit: int) -> List[str]:
+    """Requested models, stripped and de-duplicated in order, capped at ``limit``."""
+    candidates: List[str] = []
+    for model in models or ():
+        model = (model or "").strip()
+        if model and model not in candidates:
+            candidates.append(model)
+    return candidates[: max(1, limit)]
+
+
+def describe_legs(legs: List[RaceLeg], render: Callable[[Any], Any]) -> List[Dict[str, Any]]:
+    """Per-leg summary for responses; ``render`` turns a result into the output shown to the caller."""
+    return [
+        {
+            "model": leg.model,
+            "status": leg.status,
+            "latency_ms": round(leg.seconds * 1000, 1) if leg.seconds is not None else None,
+            "output": render(leg.result) if leg.status in (WON, ANSWERED) else None,
+            "error": type(leg.error).__name__ if leg.error is not None else None,
+        }
+        for leg in legs
+    ]
+
+
+@lru_cache
+def get_race_stats() -> RaceStats:
+    """Return the process-wide race statistics."""
+    return RaceStats()
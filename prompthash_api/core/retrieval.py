@@ -0,0 +1,169 @@
+"""
+Relevance-based chat context selection.
+
+Each sender's past exchanges (a user message and the reply to it) are kept
+in a small BM25 inverted index that is updated as exchanges are recorded
+and trimmed. :func:`select_context` combines the most recent messages with
+the older exchanges that best match the new message, within a token budget.
+"""
+
+import math
+import re
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+History = List[Dict[str, str]]
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Very common English words carry no signal for matching turns and inflate the postings.
+_STOPWORDS = frozenset(
+    """
+    a about above after again all also am an and any are as at be because been before being below between both
+    but by can could did do does doing down during each few for from further had has have having he her here
+    hers him his how i if in into is it its itself just me more most my no nor not now of off on once only or
+    other our ours out over own same she should so some such than that the their theirs them then there these
+    they this those through to too under until up very was we were what when where which while who whom why
+    will with would you your yours
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS and len(word) > 1]
+
+
+def estimate_item_tokens(item: Dict[str, str]) -> int:
+    # Same characters-per-token estimate the admission controller uses, plus per-message overhead.
+    return len(item.get("text", "")) // 4 + 4
+
+
+class TurnIndex:
+    """
+    Incremental BM25 index over one sender's exchanges.
+
+    Documents are numbered in the order they are added; :meth:`trim` drops
+    the oldest ones so the index follows the stored history.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._documents: Dict[int, Dict[str, int]] = {}
+        self._lengths: Dict[int, int] = {}
+        self._order: Deque[int] = deque()
+        self._total_length = 0
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    @classmethod
+    def from_history(cls, history: History) -> "TurnIndex":
+        index = cls()
+        for start in range(len(history) % 2, len(history), 2):
+            index.add(history[start]["text"] + " " + history[start + 1]["text"])
+        return index
+
+    def add(self, text: str) -> int:
+        doc_id = self._next_id
+        self._next_id += 1
+        frequencies: Dict[str, int] = {}
+        for term in tokenize(text):
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, count in frequencies.items():
+            self._postings.setdefault(term, {})[doc_id] = count
+        length = sum(frequencies.values())
+        self._documents[doc_id] = frequencies
+        self._lengths[doc_id] = length
+        self._total_length += length
+        self._order.append(doc_id)
+        return doc_id
+
+    def trim(self, keep: int) -> None:
+        """Drop the oldest documents until at most ``keep`` remain."""
+        while len(self._order) > max(0, keep):
+            doc_id = self._order.popleft()
+            for term in self._documents.pop(doc_id):
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._lengths.pop(doc_id)
+
+    def search(self, query: str, skip_newest: int = 0) -> List[Tuple[int, float]]:
+        """
+        ``(position, score)`` of matching documents, best first.
+
+        ``position`` counts from the oldest document still indexed. The
+        ``skip_newest`` most recent documents are left out; they are sent as
+        recent context anyway.
+        """
+        count = len(self._order)
+        if not count:
+            return []
+        first_id = self._order[0]
+        cutoff = self._next_id - max(0, skip_newest)
+        average = self._total_length / count or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1.0 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                if doc_id >= cutoff:
+                    continue
+                norm = self.k1 * (1.0 - self.b + self.b * self._lengths[doc_id] / average)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1.0) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+        return [(doc_id - first_id, score) for doc_id, score in ranked]
+
+
+def select_context(
+    history: History,
+    index: TurnIndex,
+    query: str,
+    recent_items: int,
+    max_exchanges: int,
+    budget_tokens: int,
+) -> History:
+    """
+    Recent messages plus the older exchanges most relevant to ``query``.
+
+    The newest messages are taken first, up to ``recent_items`` and the
+    budget; retrieved exchanges then fill what is left of the budget. The
+    result is in chronological order.
+    """
+    recent: History = []
+    used = 0
+    for item in reversed(history[-recent_items:] if recent_items > 0 else []):
+        cost = estimate_item_tokens(item)
+        if recent and used + cost > budget_tokens:
+            break
+        recent.append(item)
+        used += cost
+    recent.reverse()
+
+    # Exchanges start at an even offset from the end of the stored history.
+    offset = len(history) % 2
+    skip = (len(recent) + 1) // 2
+    picked: List[int] = []
+    for position, _ in index.search(query, skip_newest=skip):
+        if len(picked) >= max_exchanges:
+            break
+        start = offset + 2 * position
+        pair = history[start : start + 2]
+        if len(pair) < 2:
+            continue
+        cost = sum(estimate_item_tokens(item) for item in pair)
+        if used + cost > budget_tokens:
+            continue
+        picked.append(start)
+        used += cost
+
+    retrieved: History = []
+    for start in sorted(picked):
+        retrieved.extend(history[start : start + 2])
+    return retrieved + recent
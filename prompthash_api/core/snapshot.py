@@ -0,0 +1,138 @@
+"""
+On-disk snapshot of in-memory service state.
+
+The snapshot is a single SQLite file: one row per sender with the history
+as zlib-compressed compact JSON, plus a small table of named counters.
+Restoring is lazy. Startup only reads the counters. A sender's history is
+loaded with a primary-key lookup the first time that sender shows up, so a
+warm restart costs the same with ten senders or a million.
+
+Writes are incremental: only conversations that changed since the last
+snapshot are upserted, and rows for senders that never returned are left
+in place. Counters are written as deltas added to the stored value, so
+worker processes sharing the file add up their counts instead of
+overwriting each other's. The same table is the cold tier of :class:`ChatState`, which
+spills long-idle histories here between snapshots. :class:`SnapshotStore` blocks; :class:`Snapshotter` runs it on a
+worker thread.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("prompthash_api.snapshot")
+
+History = List[Dict[str, str]]
+
+
+def encode_history(history: History) -> bytes:
+    return zlib.compress(json.dumps(history, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def decode_history(blob: bytes) -> History:
+    return json.loads(zlib.decompress(blob))
+
+
+class SnapshotStore:
+    """SQLite-backed snapshot of conversations and counters."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS conversations (sender TEXT PRIMARY KEY, history BLOB NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._connection = connection
+        return self._connection
+
+    def read_counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._connect().execute("SELECT name, value FROM counters").fetchall())
+
+    def load_history(self, sender: str) -> Optional[History]:
+        with self._lock:
+            row = self._connect().execute("SELECT history FROM conversations WHERE sender = ?", (sender,)).fetchone()
+        return decode_history(row[0]) if row else None
+
+    def write(self, counter_deltas: Dict[str, int], conversations: Iterable[Tuple[str, History]]) -> int:
+        """Add the counter deltas and upsert the given conversations in one transaction; returns rows written."""
+        rows = [(sender, encode_history(history)) for sender, history in conversations]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                    counter_deltas.items(),
+                )
+                connection.executemany("INSERT OR REPLACE INTO conversations VALUES (?, ?)", rows)
+        return len(rows)
+
+    def write_encoded(self, conversations: Iterable[Tuple[str, bytes]]) -> None:
+        """Upsert conversations already compressed with :func:`encode_history`."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO conversations VALUES (?, ?)", conversations)
+
+    def usage(self) -> Tuple[int, int]:
+        """Number of stored conversations and their total compressed size in bytes."""
+        with self._lock:
+            rows, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(history)), 0) FROM conversations").fetchone()
+        return rows, size
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class Snapshotter:
+    """Ties a :class:`SnapshotStore` to the chat state and the counter-only states."""
+
+    def __init__(self, store: SnapshotStore, chat_state, counter_states: Iterable) -> None:
+        self.store = store
+        self.chat_state = chat_state
+        self.counter_states = list(counter_states)
+        # Counter values as of the last write (or the restore); each save adds only the difference.
+        self._written: Dict[str, int] = {}
+
+    async def restore(self) -> Dict[str, int]:
+        counters = await asyncio.to_thread(self.store.read_counters)
+        self._written = dict(counters)
+        self.chat_state.attach_snapshot(self.store, counters)
+        for state in self.counter_states:
+            state.restore(counters)
+        return counters
+
+    async def save(self) -> int:
+        """Write counters and changed conversations; returns the number of conversations written."""
+        counters, changed = await self.chat_state.export_changes()
+        for state in self.counter_states:
+            counters.update(await state.export_counters())
+        deltas = {name: value - self._written.get(name, 0) for name, value in counters.items()}
+        try:
+            written = await asyncio.to_thread(self.store.write, {name: delta for name, delta in deltas.items() if delta}, changed)
+        except Exception:
+            logger.exception("Snapshot to %s failed; will retry", self.store.path)
+            await self.chat_state.mark_dirty([sender for sender, _ in changed])
+            return 0
+        self._written.update(counters)
+        return written
+
+    async def run_periodic(self, interval: float) -> None:
+        """Save every ``interval`` seconds; cancel the task to stop it."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.save()
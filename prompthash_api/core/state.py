@@ -1,34 +1,253 @@
 import asyncio
-from typing import Dict, List, Tuple
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from prompthash_api.core.metrics import registry
+from prompthash_api.core.retrieval import TurnIndex
+from prompthash_api.core.snapshot import SnapshotStore, decode_history, encode_history
+from prompthash_api.core.timing import timed_lock, to_thread
+
+logger = logging.getLogger("prompthash_api.state")
+
+History = List[Dict[str, str]]
+
+HOT, WARM, COLD = "hot", "warm", "cold"
+
+# Senders remembered as having no row on disk. Forgetting one only costs a primary-key lookup on its next request.
+_NOT_ON_DISK_LIMIT = 10000
+
+CONVERSATIONS = registry.gauge(
+    "prompthash_chat_conversations",
+    "Conversations held per storage tier (hot: in memory, warm: compressed in memory, cold: rows on disk).",
+    ["tier"],
+)
+CONVERSATION_BYTES = registry.gauge(
+    "prompthash_chat_conversation_bytes",
+    "Approximate bytes used by conversations per storage tier.",
+    ["tier"],
+)
+TIER_MOVES = registry.counter(
+    "prompthash_chat_tier_moves_total",
+    "Conversations moved between storage tiers.",
+    ["source", "destination"],
+)
+
+
+def _history_size(history: History) -> int:
+    size = sys.getsizeof(history)
+    for message in history:
+        size += sys.getsizeof(message) + sys.getsizeof(message.get("text", ""))
+    return size
 
 
 class ChatState:
-    """In-memory state for chat interactions."""
+    """
+    In-memory state for chat interactions.
 
-    def __init__(self) -> None:
-        self._lock = asyncio.Lock()
-        self._conversations: Dict[str, List[Dict[str, str]]] = {}
+    Histories live in three tiers. Hot ones are plain lists, kept in
+    least-recently-used order. :meth:`demote` compresses those idle past a
+    threshold (warm), and moves warm ones idle past a second threshold to
+    the snapshot store on disk (cold). A warm or cold history is brought back
+    to hot on the sender's next request.
+
+    Callers see the last 10 history items. ``max_items`` keeps a longer
+    history for retrieval-based context, together with a search index per
+    hot sender (see :meth:`get_archive`).
+
+    Only the event loop thread touches the maps, and no method awaits
+    between reading and updating them, so each update is atomic without a
+    lock. Disk reads and writes run in worker threads outside those
+    sections, and their results are checked again before they are applied.
+    """
+
+    def __init__(self, max_items: int = 10) -> None:
+        self._max_items = max(10, max_items)
+        self._indexes: Dict[str, TurnIndex] = {}
+        self._conversations: "OrderedDict[str, History]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        # Warm tier: sender -> (compressed history, last used), oldest first.
+        self._compressed: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._compressed_bytes = 0
         self._total_messages = 0
+        # Disk tier (the snapshot store), senders known to have no row there,
+        # and the senders changed since the last snapshot.
+        self._snapshot: Optional[SnapshotStore] = None
+        self._not_on_disk: "OrderedDict[str, None]" = OrderedDict()
+        self._dirty: Set[str] = set()
+
+    def attach_snapshot(self, store: SnapshotStore, counters: Dict[str, int]) -> None:
+        """Restore counters now and histories on first use of each sender."""
+        self._snapshot = store
+        self._total_messages = max(self._total_messages, counters.get("chat.total_messages", 0))
 
-    async def get_history(self, sender: str) -> List[Dict[str, str]]:
-        async with self._lock:
-            # Return a shallow copy to avoid accidental mutation.
-            return list(self._conversations.get(sender, []))
-
-    async def record_exchange(self, sender: str, user_text: str, assistant_text: str) -> Tuple[List[Dict[str, str]], int]:
-        async with self._lock:
-            history = self._conversations.get(sender, [])
-            history.append({"role": "user", "text": user_text})
-            history.append({"role": "assistant", "text": assistant_text})
-            # Limit to the last 10 items to mirror the previous agent behavior.
-            history = history[-10:]
-            self._conversations[sender] = history
-            self._total_messages += 1
-            return list(history), self._total_messages
+    def _touch(self, sender: str) -> None:
+        self._conversations.move_to_end(sender)
+        self._last_used[sender] = time.monotonic()
+
+    async def _rehydrate(self, sender: str) -> None:
+        """Bring a warm or cold history back to the hot tier."""
+        entry = self._compressed.pop(sender, None)
+        if entry is not None:
+            self._compressed_bytes -= len(entry[0])
+            self._conversations[sender] = decode_history(entry[0])
+            self._last_used[sender] = time.monotonic()
+            TIER_MOVES.inc(WARM, HOT)
+            return
+        if self._snapshot is None:
+            return
+        if sender in self._not_on_disk:
+            self._not_on_disk.move_to_end(sender)
+            return
+        history = await to_thread(self._snapshot.load_history, sender)
+        if sender in self._conversations or sender in self._compressed:
+            return
+        if history is None:
+            # Senders that only ever read their (empty) history would otherwise pile up here.
+            self._not_on_disk[sender] = None
+            if len(self._not_on_disk) > _NOT_ON_DISK_LIMIT:
+                self._not_on_disk.popitem(last=False)
+            return
+        self._conversations[sender] = history[-self._max_items :]
+        self._last_used[sender] = time.monotonic()
+        TIER_MOVES.inc(COLD, HOT)
+
+    async def get_history(self, sender: str) -> History:
+        if sender not in self._conversations:
+            await self._rehydrate(sender)
+        history = self._conversations.get(sender)
+        if history is None:
+            return []
+        self._touch(sender)
+        # Return a shallow copy to avoid accidental mutation.
+        return history[-10:]
+
+    async def get_archive(self, sender: str) -> Tuple[History, TurnIndex]:
+        """The full stored history and its search index, built on first use."""
+        if sender not in self._conversations:
+            await self._rehydrate(sender)
+        history = self._conversations.get(sender)
+        if history is None:
+            return [], TurnIndex()
+        self._touch(sender)
+        index = self._indexes.get(sender)
+        if index is None:
+            index = self._indexes[sender] = TurnIndex.from_history(history)
+        return list(history), index
+
+    async def record_exchange(self, sender: str, user_text: str, assistant_text: str) -> Tuple[History, int]:
+        if sender not in self._conversations:
+            await self._rehydrate(sender)
+        history = self._conversations.get(sender)
+        if history is None:
+            history = self._conversations[sender] = []
+        history.append({"role": "user", "text": user_text})
+        history.append({"role": "assistant", "text": assistant_text})
+        # Keep the last 10 items (mirroring the previous agent behavior) unless a longer archive is on.
+        # Trimmed in place: readers only ever get copies.
+        if len(history) > self._max_items:
+            del history[: len(history) - self._max_items]
+        index = self._indexes.get(sender)
+        if index is not None:
+            index.add(user_text + " " + assistant_text)
+            index.trim(len(history) // 2)
+        self._touch(sender)
+        self._not_on_disk.pop(sender, None)
+        self._dirty.add(sender)
+        self._total_messages += 1
+        return history[-10:], self._total_messages
 
     async def total_messages(self) -> int:
-        async with self._lock:
-            return self._total_messages
+        return self._total_messages
+
+    async def demote(self, compress_after: float, spill_after: float) -> None:
+        """
+        Compress hot histories idle for ``compress_after`` seconds and spill
+        warm ones idle for ``spill_after`` seconds to disk.
+
+        ``compress_after <= 0`` disables tiering. Spilling needs the snapshot
+        store; without it warm histories stay in memory.
+        """
+        if compress_after <= 0:
+            return
+        now = time.monotonic()
+        # Both maps are in last-use order, so each walk stops at the first recent entry.
+        while self._conversations:
+            sender = next(iter(self._conversations))
+            last_used = self._last_used[sender]
+            if now - last_used < compress_after:
+                break
+            blob = encode_history(self._conversations.pop(sender))
+            del self._last_used[sender]
+            # Rebuilt from the history if the sender returns.
+            self._indexes.pop(sender, None)
+            self._compressed[sender] = (blob, last_used)
+            self._compressed_bytes += len(blob)
+            TIER_MOVES.inc(HOT, WARM)
+        spill: List[Tuple[str, bytes]] = []
+        if self._snapshot is not None and spill_after > 0:
+            for sender, (blob, last_used) in self._compressed.items():
+                if now - last_used < spill_after:
+                    break
+                spill.append((sender, blob))
+        if not spill:
+            return
+        try:
+            await to_thread(self._snapshot.write_encoded, spill)
+        except Exception:
+            logger.exception("Spilling %d conversations to %s failed; keeping them in memory", len(spill), self._snapshot.path)
+            return
+        for sender, blob in spill:
+            entry = self._compressed.get(sender)
+            # Skip senders that came back (and maybe went warm again) while the write ran.
+            if entry is None or entry[0] is not blob:
+                continue
+            del self._compressed[sender]
+            self._compressed_bytes -= len(blob)
+            self._dirty.discard(sender)
+            TIER_MOVES.inc(WARM, COLD)
+
+    async def tier_stats(self) -> Dict[str, Dict[str, int]]:
+        """Conversation count and approximate bytes per tier; also updates the gauges."""
+        stats = {
+            HOT: {"conversations": len(self._conversations), "bytes": sum(_history_size(h) for h in self._conversations.values())},
+            WARM: {"conversations": len(self._compressed), "bytes": self._compressed_bytes},
+        }
+        if self._snapshot is not None:
+            rows, size = await to_thread(self._snapshot.usage)
+            # Disk rows of senders now hot or warm are stale copies, not part of the cold tier.
+            stats[COLD] = {"conversations": max(0, rows - stats[HOT]["conversations"] - stats[WARM]["conversations"]), "bytes": size}
+        for tier, values in stats.items():
+            CONVERSATIONS.set(tier, value=values["conversations"])
+            CONVERSATION_BYTES.set(tier, value=values["bytes"])
+        return stats
+
+    async def run_tiering(self, compress_after: float, spill_after: float, interval: float) -> None:
+        """Demote idle histories and refresh the tier gauges every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.demote(compress_after, spill_after)
+                await self.tier_stats()
+            except Exception:
+                logger.exception("Conversation tiering pass failed")
+
+    async def export_changes(self) -> Tuple[Dict[str, int], List[Tuple[str, History]]]:
+        """Counters plus copies of the histories changed since the last export."""
+        dirty, self._dirty = self._dirty, set()
+        changed = []
+        for sender in dirty:
+            if sender in self._conversations:
+                changed.append((sender, list(self._conversations[sender])))
+            elif sender in self._compressed:
+                changed.append((sender, decode_history(self._compressed[sender][0])))
+        return {"chat.total_messages": self._total_messages}, changed
+
+    async def mark_dirty(self, senders: List[str]) -> None:
+        """Re-flag senders whose export could not be written."""
+        self._dirty.update(senders)
 
 
 class ImproverState:
@@ -39,14 +258,21 @@ class ImproverState:
         self._total_requests = 0
 
     async def increment(self) -> int:
-        async with self._lock:
+        async with timed_lock(self._lock):
             self._total_requests += 1
             return self._total_requests
 
     async def total_requests(self) -> int:
-        async with self._lock:
+        async with timed_lock(self._lock):
             return self._total_requests
 
+    def restore(self, counters: Dict[str, int]) -> None:
+        self._total_requests = max(self._total_requests, counters.get("improver.total_requests", 0))
+
+    async def export_counters(self) -> Dict[str, int]:
+        async with timed_lock(self._lock):
+            return {"improver.total_requests": self._total_requests}
+
 
 class ModelState:
     """Tracks usage counts for model listing."""
@@ -56,11 +282,18 @@ class ModelState:
         self._total_requests = 0
 
     async def increment(self) -> int:
-        async with self._lock:
+        async with timed_lock(self._lock):
             self._total_requests += 1
             return self._total_requests
 
     async def total_requests(self) -> int:
-        async with self._lock:
+        async with timed_lock(self._lock):
             return self._total_requests
 
+    def restore(self, counters: Dict[str, int]) -> None:
+        self._total_requests = max(self._total_requests, counters.get("models.total_requests", 0))
+
+    async def export_counters(self) -> Dict[str, int]:
+        async with timed_lock(self._lock):
+            return {"models.total_requests": self._total_requests}
+
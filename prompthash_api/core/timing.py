@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from fastapi.routing import APIRoute
+
+T = TypeVar("T")
+
+logger = logging.getLogger("prompthash_api.timing")
+
+
+class RequestTimings:
+    """Accumulates named phase durations (seconds) for one request."""
+
+    __slots__ = ("started", "phases", "tags")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.tags: Dict[str, Any] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Render phases as a ``Server-Timing`` header value (durations in ms)."""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("prompthash_request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def record_phase(name: str, seconds: float) -> None:
+    """Add ``seconds`` to ``name`` on the active request; a no-op outside a request."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def tag_request(**tags: Any) -> None:
+    """Attach context (sender, model, ...) to the active request's log line."""
+    timings = _current.get()
+    if timings is not None:
+        timings.tags.update(tags)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+class timed_lock:
+    """Acquire ``lock`` and record how long the acquisition waited.
+
+    A plain class rather than ``@asynccontextmanager``: it wraps every state
+    access, and the generator-based version costs more than the lock itself.
+    """
+
+    __slots__ = ("_lock",)
+
+    def __init__(self, lock: asyncio.Lock) -> None:
+        self._lock = lock
+
+    async def __aenter__(self) -> None:
+        started = time.perf_counter()
+        await self._lock.acquire()
+        record_phase("lock", time.perf_counter() - started)
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self._lock.release()
+
+
+class ThreadPoolUsage:
+    """Calls made through :func:`to_thread` that are waiting for, or holding, a worker thread."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.busy = 0
+
+
+thread_pool = ThreadPoolUsage()
+
+
+async def to_thread(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """``asyncio.to_thread`` that records how long the call queued for a worker."""
+    submitted = time.perf_counter()
+    # [started, abandoned]: a call cancelled while queued never runs, so whoever is first un-counts it.
+    state = [False, False]
+    with thread_pool.lock:
+        thread_pool.waiting += 1
+
+    def _run() -> T:
+        with thread_pool.lock:
+            if not state[1]:
+                thread_pool.waiting -= 1
+            state[0] = True
+            thread_pool.busy += 1
+        record_phase("queue", time.perf_counter() - submitted)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with thread_pool.lock:
+                thread_pool.busy -= 1
+
+    try:
+        return await asyncio.to_thread(_run)
+    except asyncio.CancelledError:
+        with thread_pool.lock:
+            if not state[0] and not state[1]:
+                thread_pool.waiting -= 1
+            state[1] = True
+        raise
+
+
+class TimedRoute(APIRoute):
+    """Route class that attributes time outside the endpoint to request/response codec work."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timings = _current.get()
+            if timings is None:
+                return await handler(request)
+            started = time.perf_counter()
+            response = await handler(request)
+            # Only endpoints that time their own body ("app") get a codec split.
+            if "app" in timings.phases:
+                elapsed = time.perf_counter() - started
+                timings.add("codec", max(0.0, elapsed - timings.phases["app"]))
+            return response
+
+        return timed_handler
+
+
+class ServerTimingMiddleware:
+    """
+    Pure ASGI middleware that opens a timing scope per HTTP request.
+
+    Phases recorded anywhere on the request path are emitted as a
+    ``Server-Timing`` header and, when enabled, as one JSON log line.
+    """
+
+    def __init__(self, app, emit_header: bool = True, emit_log: bool = True) -> None:
+        self.app = app
+        self.emit_header = emit_header
+        self.emit_log = emit_log
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.emit_header:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if self.emit_log and logger.isEnabledFor(logging.INFO):
+                route = scope.get("route")
+                logger.info(
+                    json.dumps(
+                        {
+                            "event": "request",
+                            "method": scope.get("method"),
+                            "path": scope.get("path"),
+                            "route": getattr(route, "path", None),
+                            "status": status_code,
+                            "total_ms": round(timings.elapsed() * 1000, 3),
+                            "phases_ms": {name: round(seconds * 1000, 3) for name, seconds in timings.phases.items()},
+                            **timings.tags,
+                        },
+                        separators=(",", ":"),
+                        default=str,
+                    )
+                )
+
+
+def configure_request_logging() -> None:
+    """Send request timing lines to stderr without depending on the server's log setup."""
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
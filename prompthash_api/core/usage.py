@@ -0,0 +1,302 @@
+"""
+In-memory token usage accounting with periodic SQLite flushes.
+
+Usage is aggregated per minute by (sender, model, endpoint). Queries sum the
+minute buckets inside a rolling window. Like the metrics registry, the
+tracker is only touched from the event loop thread, so recording is plain
+dict arithmetic; the SQLite write happens on a worker thread with a
+detached batch. At startup the stored minutes inside the retention window
+are loaded back, so a restart keeps the totals. The largest-prompt lists
+are kept in memory only.
+"""
+
+import asyncio
+import heapq
+import logging
+import re
+import sqlite3
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.metrics import model_label
+
+logger = logging.getLogger("prompthash_api.usage")
+
+UsageKey = Tuple[str, str, str]  # (sender, model, endpoint)
+
+GROUP_FIELDS = {"sender": 0, "model": 1, "endpoint": 2}
+SORT_METRICS = ("total_tokens", "prompt_tokens", "completion_tokens", "requests", "avg_latency_ms", "avg_prompt_tokens")
+
+# Largest individual prompts kept per minute bucket for the oversized-prompt report.
+_PROMPTS_PER_BUCKET = 20
+
+_WINDOW_PATTERN = re.compile(r"^\s*(\d+)\s*([smhd]?)\s*$")
+_WINDOW_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_window(value: str) -> int:
+    """Parse ``90``, ``15m``, ``1h`` or ``7d`` into seconds."""
+    match = _WINDOW_PATTERN.match(value or "")
+    if not match:
+        raise ValueError(f"Invalid window {value!r}; use e.g. 15m, 1h or 24h.")
+    return int(match.group(1)) * _WINDOW_UNITS[match.group(2)]
+
+
+class _Bucket:
+    """Counters for one (minute, sender, model, endpoint) cell."""
+
+    __slots__ = ("requests", "prompt_tokens", "completion_tokens", "latency_sum")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_sum = 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, latency: float) -> None:
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.latency_sum += latency
+
+
+class UsageTracker:
+    """Rolling-window usage aggregates by sender, model and endpoint."""
+
+    def __init__(self, retention_seconds: int = 86400, db_path: Optional[str] = None) -> None:
+        self.retention_seconds = retention_seconds
+        self.db_path = db_path
+        self._minutes: Dict[int, Dict[UsageKey, _Bucket]] = {}
+        self._largest: Dict[int, List[Tuple[int, float, str, str, str]]] = {}
+        # Deltas accumulated since the last flush, keyed by (minute, sender, model, endpoint).
+        self._pending: Dict[Tuple[int, str, str, str], _Bucket] = {}
+        self._loaded = False
+
+    def record(
+        self,
+        sender: str,
+        model: str,
+        endpoint: str,
+        usage: Optional[Dict[str, int]],
+        latency: float,
+        now: Optional[float] = None,
+    ) -> None:
+        now = time.time() if now is None else now
+        minute = int(now // 60)
+        prompt_tokens = int((usage or {}).get("prompt_tokens", 0))
+        completion_tokens = int((usage or {}).get("completion_tokens", 0))
+        model = model_label(model)
+        key = (sender, model, endpoint)
+
+        cells = self._minutes.get(minute)
+        if cells is None:
+            cells = self._minutes[minute] = {}
+            self._prune(minute)
+        bucket = cells.get(key)
+        if bucket is None:
+            bucket = cells[key] = _Bucket()
+        bucket.add(prompt_tokens, completion_tokens, latency)
+
+        if self.db_path:
+            pending = self._pending.get((minute, *key))
+            if pending is None:
+                pending = self._pending[(minute, *key)] = _Bucket()
+            pending.add(prompt_tokens, completion_tokens, latency)
+
+        largest = self._largest.setdefault(minute, [])
+        entry = (prompt_tokens, now, sender, model, endpoint)
+        if len(largest) < _PROMPTS_PER_BUCKET:
+            heapq.heappush(largest, entry)
+        elif prompt_tokens > largest[0][0]:
+            heapq.heapreplace(largest, entry)
+
+    def _prune(self, current_minute: int) -> None:
+        oldest = current_minute - self.retention_seconds // 60
+        for minute in [minute for minute in self._minutes if minute < oldest]:
+            del self._minutes[minute]
+            self._largest.pop(minute, None)
+
+    def sizes(self) -> Dict[str, int]:
+        """Entry counts of the in-memory aggregates."""
+        return {
+            "minutes": len(self._minutes),
+            "buckets": sum(len(buckets) for buckets in self._minutes.values()),
+            "pending": len(self._pending),
+        }
+
+    def _window_minutes(self, window_seconds: int, now: Optional[float]) -> List[int]:
+        now = time.time() if now is None else now
+        current = int(now // 60)
+        first = current - max(1, window_seconds // 60) + 1
+        return [minute for minute in self._minutes if first <= minute <= current]
+
+    def top(
+        self,
+        by: str = "sender",
+        metric: str = "total_tokens",
+        window_seconds: int = 3600,
+        limit: int = 10,
+        now: Optional[float] = None,
+    ) -> Tuple[List[Dict[str, object]], Dict[str, object]]:
+        """Return the top ``limit`` groups by ``metric`` plus window totals."""
+        if by not in GROUP_FIELDS:
+            raise ValueError(f"Unknown grouping {by!r}; use one of {', '.join(GROUP_FIELDS)}.")
+        if metric not in SORT_METRICS:
+            raise ValueError(f"Unknown metric {metric!r}; use one of {', '.join(SORT_METRICS)}.")
+
+        index = GROUP_FIELDS[by]
+        groups: Dict[str, _Bucket] = {}
+        totals = _Bucket()
+        for minute in self._window_minutes(window_seconds, now):
+            for key, bucket in self._minutes[minute].items():
+                group = groups.get(key[index])
+                if group is None:
+                    group = groups[key[index]] = _Bucket()
+                for target in (group, totals):
+                    target.requests += bucket.requests
+                    target.prompt_tokens += bucket.prompt_tokens
+                    target.completion_tokens += bucket.completion_tokens
+                    target.latency_sum += bucket.latency_sum
+
+        rows = [self._row(name, bucket) for name, bucket in groups.items()]
+        rows.sort(key=lambda row: row[metric], reverse=True)
+        return rows[: max(1, limit)], self._row("total", totals)
+
+    def largest_prompts(self, window_seconds: int = 3600, limit: int = 10, now: Optional[float] = None) -> List[Dict[str, object]]:
+        """Return the individual calls with the largest prompts inside the window."""
+        entries = []
+        for minute in self._window_minutes(window_seconds, now):
+            entries.extend(self._largest.get(minute, ()))
+        return [
+            {"prompt_tokens": tokens, "timestamp": round(at, 3), "sender": sender, "model": model, "endpoint": endpoint}
+            for tokens, at, sender, model, endpoint in heapq.nlargest(max(1, limit), entries)
+        ]
+
+    @staticmethod
+    def _row(name: str, bucket: _Bucket) -> Dict[str, object]:
+        requests = bucket.requests or 1
+        return {
+            "key": name,
+            "requests": bucket.requests,
+            "prompt_tokens": bucket.prompt_tokens,
+            "completion_tokens": bucket.completion_tokens,
+            "total_tokens": bucket.prompt_tokens + bucket.completion_tokens,
+            "avg_prompt_tokens": round(bucket.prompt_tokens / requests, 1),
+            "avg_latency_ms": round(bucket.latency_sum / requests * 1000, 3),
+        }
+
+    def load(self, now: Optional[float] = None) -> int:
+        """Add the stored minutes inside the retention window to the aggregates; returns the rows read.
+
+        Blocking; run it off the event loop before recording starts.
+        """
+        # Once per tracker: the in-memory minutes already include everything this process flushed.
+        loaded, self._loaded = self._loaded, True
+        if loaded or not self.db_path or not Path(self.db_path).exists():
+            return 0
+        now = time.time() if now is None else now
+        oldest = int(now // 60) - self.retention_seconds // 60
+        connection = sqlite3.connect(self.db_path)
+        try:
+            rows = connection.execute("SELECT * FROM usage WHERE minute >= ?", (oldest,)).fetchall()
+        except sqlite3.OperationalError:
+            # Nothing has been flushed yet, so the table does not exist.
+            return 0
+        finally:
+            connection.close()
+        for minute, sender, model, endpoint, requests, prompt_tokens, completion_tokens, latency_sum in rows:
+            cells = self._minutes.setdefault(minute, {})
+            key = (sender, model_label(model), endpoint)
+            bucket = cells.get(key)
+            if bucket is None:
+                bucket = cells[key] = _Bucket()
+            bucket.requests += requests
+            bucket.prompt_tokens += prompt_tokens
+            bucket.completion_tokens += completion_tokens
+            bucket.latency_sum += latency_sum
+        return len(rows)
+
+    def take_pending(self) -> List[Tuple[int, str, str, str, int, int, int, float]]:
+        """Detach the deltas recorded since the last call, ready for :func:`write_batch`."""
+        pending, self._pending = self._pending, {}
+        return [
+            (minute, sender, model, endpoint, bucket.requests, bucket.prompt_tokens, bucket.completion_tokens, bucket.latency_sum)
+            for (minute, sender, model, endpoint), bucket in pending.items()
+        ]
+
+    def write_batch(self, rows: List[Tuple[int, str, str, str, int, int, int, float]]) -> None:
+        """Add a detached batch to the SQLite store. Blocking; run it off the event loop."""
+        if not rows or not self.db_path:
+            return
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.db_path)
+        try:
+            with connection:
+                connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS usage (
+                        minute INTEGER NOT NULL,
+                        sender TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        endpoint TEXT NOT NULL,
+                        requests INTEGER NOT NULL,
+                        prompt_tokens INTEGER NOT NULL,
+                        completion_tokens INTEGER NOT NULL,
+                        latency_sum REAL NOT NULL,
+                        PRIMARY KEY (minute, sender, model, endpoint)
+                    )
+                    """
+                )
+                connection.executemany(
+                    """
+                    INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (minute, sender, model, endpoint) DO UPDATE SET
+                        requests = requests + excluded.requests,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        latency_sum = latency_sum + excluded.latency_sum
+                    """,
+                    rows,
+                )
+        finally:
+            connection.close()
+
+    def restore_pending(self, rows: List[Tuple[int, str, str, str, int, int, int, float]]) -> None:
+        """Put back a batch whose flush failed so the next flush retries it."""
+        for minute, sender, model, endpoint, requests, prompt_tokens, completion_tokens, latency_sum in rows:
+            bucket = self._pending.get((minute, sender, model, endpoint))
+            if bucket is None:
+                bucket = self._pending[(minute, sender, model, endpoint)] = _Bucket()
+            bucket.requests += requests
+            bucket.prompt_tokens += prompt_tokens
+            bucket.completion_tokens += completion_tokens
+            bucket.latency_sum += latency_sum
+
+    async def flush(self) -> int:
+        """Write pending deltas to SQLite; returns the number of rows written."""
+        rows = self.take_pending()
+        if not rows or not self.db_path:
+            return 0
+        try:
+            await asyncio.to_thread(self.write_batch, rows)
+        except Exception:
+            logger.exception("Usage flush to %s failed; will retry", self.db_path)
+            self.restore_pending(rows)
+            return 0
+        return len(rows)
+
+    async def run_flusher(self, interval: float) -> None:
+        """Flush forever every ``interval`` seconds; cancel the task to stop it."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+@lru_cache
+def get_usage_tracker() -> UsageTracker:
+    """Return the process-wide usage tracker configured from settings."""
+    settings = get_settings()
+    return UsageTracker(retention_seconds=settings.usage_retention_seconds, db_path=settings.usage_db_path or None)
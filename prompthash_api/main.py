@@ -1,11 +1,127 @@
-from fastapi import APIRouter, FastAPI
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import APIRouter, FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+from prompthash_api.core.admission import Overloaded, RateLimited
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import DeadlineExceeded, DeadlineMiddleware
+from prompthash_api.core.health import get_health_prober
+from prompthash_api.core.idempotency import IdempotencyConflict
+from prompthash_api.core.jobs import get_job_manager
+from prompthash_api.core.lifecycle import DrainMiddleware, install_drain_handler, lifecycle
+from prompthash_api.core.metrics import MetricsMiddleware
+from prompthash_api.core.overload import get_load_monitor
+from prompthash_api.core.snapshot import Snapshotter, SnapshotStore
+from prompthash_api.core.timing import ServerTimingMiddleware, configure_request_logging
+from prompthash_api.core.usage import get_usage_tracker
+from prompthash_api.routers import admin, chat, improver, jobs, metrics, models, pages, usage
+
+logger = logging.getLogger("prompthash_api.lifespan")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Run background maintenance tasks for the lifetime of the app.
+
+    Startup restores the state snapshot (counters now, conversations lazily)
+    and the stored usage window, and starts moving idle conversations to the compressed and disk tiers,
+    plus the upstream health prober and the event-loop lag monitor.
+    SIGTERM starts the drain while the server is still listening (see
+    :func:`~prompthash_api.core.lifecycle.install_drain_handler`): new
+    requests are refused, in-flight requests and running jobs get up to
+    ``DRAIN_TIMEOUT_SECONDS`` in total, then the snapshot and usage are saved.
+    """
+    settings = get_settings()
+    # Upstream calls block a worker thread each; size the pool so admitted calls never queue for one.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max(settings.worker_threads, settings.upstream_max_concurrency))
+    )
+    lifecycle.reset()
+    restore_signal_handler = install_drain_handler(settings.drain_timeout_seconds)
+    tracker = get_usage_tracker()
+    job_manager = get_job_manager()
+    snapshotter = None
+    if settings.snapshot_path:
+        snapshotter = Snapshotter(
+            SnapshotStore(settings.snapshot_path),
+            chat.chat_service.state,
+            [improver.improver_service.state, models.model_service.state],
+        )
+        await snapshotter.restore()
+    await asyncio.to_thread(tracker.load)
+    await job_manager.start()
+    tasks = []
+    load_monitor = get_load_monitor()
+    if load_monitor.enabled:
+        tasks.append(asyncio.create_task(load_monitor.run()))
+    prober = get_health_prober()
+    if prober.enabled:
+        tasks.append(asyncio.create_task(prober.run()))
+    if tracker.db_path:
+        tasks.append(asyncio.create_task(tracker.run_flusher(settings.usage_flush_seconds)))
+    if snapshotter is not None and settings.snapshot_interval_seconds > 0:
+        tasks.append(asyncio.create_task(snapshotter.run_periodic(settings.snapshot_interval_seconds)))
+    if settings.chat_compress_after_seconds > 0 and settings.chat_tiering_interval_seconds > 0:
+        tasks.append(
+            asyncio.create_task(
+                chat.chat_service.state.run_tiering(
+                    settings.chat_compress_after_seconds,
+                    settings.chat_spill_after_seconds,
+                    settings.chat_tiering_interval_seconds,
+                )
+            )
+        )
+    try:
+        yield
+    finally:
+        if restore_signal_handler is not None:
+            restore_signal_handler()
+        if not await lifecycle.drain(settings.drain_timeout_seconds):
+            logger.warning("Drain timed out; cancelled the requests still in flight")
+        await job_manager.stop(drain_timeout=lifecycle.drain_remaining(settings.drain_timeout_seconds))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if snapshotter is not None:
+            await snapshotter.save()
+            await asyncio.to_thread(snapshotter.store.close)
+        await tracker.flush()
+
+
+async def rate_limited_handler(request: Request, exc: RateLimited) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"error": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
-from prompthash_api.routers import chat, improver, models, pages
+async def overloaded_handler(request: Request, exc: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"error": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded) -> JSONResponse:
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"error": exc.reason})
+
+
+async def idempotency_conflict_handler(request: Request, exc: IdempotencyConflict) -> JSONResponse:
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"error": str(exc)})
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Prompthash ASI FastAPI", version="1.0.0")
+    settings = get_settings()
+    app = FastAPI(title="Prompthash ASI FastAPI", version="1.0.0", lifespan=lifespan)
 
     # Mirror the permissive CORS behavior expected by local HTML usage.
     app.add_middleware(
@@ -14,14 +130,43 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["Server-Timing", "Idempotent-Replayed"],
     )
 
+    # Inside the metrics middleware so requests abandoned by the client are counted as 499.
+    app.add_middleware(DeadlineMiddleware, max_budget=settings.max_request_timeout_seconds)
+
+    if settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
+
+    # Refuses requests once shutdown starts, and counts the in-flight ones the drain waits for.
+    app.add_middleware(DrainMiddleware, state=lifecycle)
+
+    # Outermost so its timing scope (and the request tags metrics read) covers every route.
+    if settings.request_timing_log:
+        configure_request_logging()
+    app.add_middleware(
+        ServerTimingMiddleware,
+        emit_header=settings.server_timing_header,
+        emit_log=settings.request_timing_log,
+    )
+
+    app.add_exception_handler(RateLimited, rate_limited_handler)
+    app.add_exception_handler(Overloaded, overloaded_handler)
+    app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
+    app.add_exception_handler(IdempotencyConflict, idempotency_conflict_handler)
+
     api_router = APIRouter(prefix="/api")
     api_router.include_router(chat.router)
     api_router.include_router(improver.router)
+    api_router.include_router(jobs.router)
     api_router.include_router(models.router)
+    api_router.include_router(usage.router)
+    api_router.include_router(admin.router)
 
     app.include_router(api_router)
+    if settings.metrics_enabled:
+        app.include_router(metrics.router)
     app.include_router(pages.router)
     return app
 
@@ -0,0 +1,129 @@
+import secrets
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from prompthash_api.core.answer_cache import get_answer_cache
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.idempotency import get_idempotency_store
+from prompthash_api.core.jobs import get_job_manager
+from prompthash_api.core.memory import GROUP_BY, TracingNotStarted, UnknownSnapshot, tracer
+from prompthash_api.core.output_budget import get_output_budget
+from prompthash_api.core.profiler import ProfilerBusy, profiler
+from prompthash_api.core.prompt_cache import get_improve_cache
+from prompthash_api.core.usage import get_usage_tracker
+from prompthash_api.routers.chat import chat_service
+
+
+async def require_admin(authorization: Optional[str] = Header(None)) -> None:
+    """Allow only ``Authorization: Bearer $ADMIN_TOKEN``; without a configured token the routes do not exist."""
+    token = get_settings().admin_token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    scheme, _, supplied = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(supplied.strip().encode(), token.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Admin token required.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile_endpoint(
+    seconds: float = Query(10.0, gt=0, le=120, description="How long to sample."),
+    interval_ms: float = Query(10.0, ge=1, le=1000, description="Time between samples."),
+    idle: bool = Query(False, description="Include threads that are only waiting."),
+) -> PlainTextResponse:
+    """Sample all thread stacks and return collapsed stacks for flamegraph tools."""
+    try:
+        result = await profiler.profile(seconds, interval_ms / 1000.0, include_idle=idle)
+    except ProfilerBusy as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+    return PlainTextResponse(result["collapsed"] + "\n", headers={"X-Profile-Samples": str(result["samples"])})
+
+
+def _group_by(group_by: str) -> str:
+    if group_by not in GROUP_BY:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"group_by must be one of {', '.join(GROUP_BY)}.",
+        )
+    return group_by
+
+
+async def _traced(call) -> Dict[str, Any]:
+    try:
+        return await call
+    except TracingNotStarted as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+    except UnknownSnapshot as exc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown snapshot {exc.args[0]}.") from exc
+
+
+@router.get("/memory")
+async def memory_endpoint() -> Dict[str, Any]:
+    """Tracing status plus the sizes of the service's in-memory structures."""
+    return {
+        "tracemalloc": tracer.status(),
+        "structures": {
+            "conversations": await chat_service.state.tier_stats(),
+            "improve_cache": {"entries": len(get_improve_cache())},
+            "answer_cache": {"entries": len(get_answer_cache())},
+            "idempotency": {"entries": len(get_idempotency_store())},
+            "jobs": get_job_manager().snapshot(),
+            "usage": get_usage_tracker().sizes(),
+        },
+    }
+
+
+@router.post("/memory/start")
+async def memory_start_endpoint(
+    frames: int = Query(1, ge=1, le=50, description="Stack frames kept per allocation."),
+) -> Dict[str, Any]:
+    """Start tracing allocations; only allocations made afterwards are seen."""
+    started = tracer.start(frames)
+    return {"started": started, **tracer.status()}
+
+
+@router.post("/memory/stop")
+async def memory_stop_endpoint() -> Dict[str, Any]:
+    """Stop tracing and drop the traces and kept snapshots."""
+    return {"stopped": tracer.stop(), **tracer.status()}
+
+
+@router.post("/memory/snapshots")
+async def memory_snapshot_endpoint() -> Dict[str, Any]:
+    """Take and keep a snapshot to compare against later."""
+    return {"snapshot": await _traced(tracer.take_snapshot())}
+
+
+@router.get("/memory/top")
+async def memory_top_endpoint(
+    snapshot: Optional[int] = Query(None, description="Kept snapshot id; a new snapshot when omitted."),
+    group_by: str = Query("lineno", description="lineno, filename or traceback."),
+    limit: int = Query(20, ge=1, le=500),
+) -> Dict[str, Any]:
+    """Largest allocation sites."""
+    return await _traced(tracer.top(snapshot, _group_by(group_by), limit))
+
+
+@router.get("/memory/diff")
+async def memory_diff_endpoint(
+    base: int = Query(..., description="Kept snapshot id to compare against."),
+    snapshot: Optional[int] = Query(None, description="Kept snapshot id; a new snapshot when omitted."),
+    group_by: str = Query("lineno", description="lineno, filename or traceback."),
+    limit: int = Query(20, ge=1, le=500),
+) -> Dict[str, Any]:
+    """Allocation sites that grew most between two snapshots."""
+    return await _traced(tracer.diff(base, snapshot, _group_by(group_by), limit))
+
+
+@router.get("/output-lengths")
+async def output_lengths_endpoint() -> Dict[str, Any]:
+    """Completion-length distribution, adaptive max_tokens and truncation rate per model, endpoint and target."""
+    return get_output_budget().snapshot()
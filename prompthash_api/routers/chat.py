@@ -1,26 +1,50 @@
-from fastapi import APIRouter, status
+from typing import Optional
+
+from fastapi import APIRouter, Header, Request, Response, status
 from fastapi.responses import JSONResponse
 
 from prompthash_api.clients.asi_client import build_openai_client
+from prompthash_api.core.admission import PRIORITY_HEADER, admission_key, client_host, sender_trusted
+from prompthash_api.core.idempotency import IDEMPOTENCY_HEADER, run_idempotent
+from prompthash_api.core.timing import TimedRoute, timed
 from prompthash_api.schemas.chat import ChatRequest, ChatResponse, HealthResponse
 from prompthash_api.services.chat_service import ChatService
 
-router = APIRouter(tags=["chat"])
+router = APIRouter(tags=["chat"], route_class=TimedRoute)
 
 # Instantiate service once so in-memory state mirrors prior agent storage.
 chat_service = ChatService(client=build_openai_client(require_api_key=True))
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest) -> ChatResponse:
+async def chat_endpoint(
+    request: ChatRequest,
+    http_request: Request,
+    response: Response,
+    priority: Optional[str] = Header(None, alias=PRIORITY_HEADER),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+) -> ChatResponse:
     """Handle chat messages via REST."""
-    return await chat_service.chat(request)
+    with timed("app"):
+        client_id = client_host(http_request)
+        trusted = sender_trusted(http_request)
+        return await run_idempotent(
+            "chat",
+            idempotency_key,
+            admission_key(request.sender, client_id, trusted),
+            request,
+            response,
+            lambda: chat_service.chat(request, client_id=client_id, sender_trusted=trusted, priority=priority),
+        )
 
 
 @router.get("/health/raw", response_model=HealthResponse)
-async def health_raw() -> HealthResponse:
-    """Raw health payload for API clients."""
-    return await chat_service.health()
+async def health_raw(response: Response) -> HealthResponse:
+    """Raw health payload for API clients; 503 while the upstream is not ready."""
+    health = await chat_service.health()
+    if not health.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return health
 
 
 @router.get("/health")
@@ -31,6 +55,11 @@ async def health_proxy():
     """
     try:
         health = await chat_service.health()
+        if not health.ready:
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"ok": False, "error": f"Upstream is {health.status}", "agent": health.dict()},
+            )
         return {"ok": True, "agent": health.dict()}
     except Exception as exc:  # pragma: no cover - defensive parity with prior proxy
         return JSONResponse(
@@ -1,25 +1,49 @@
-from fastapi import APIRouter, status
+from typing import Optional
+
+from fastapi import APIRouter, Header, Request, Response, status
 from fastapi.responses import JSONResponse
 
 from prompthash_api.clients.asi_client import build_openai_client
+from prompthash_api.core.admission import PRIORITY_HEADER, admission_key, client_host, sender_trusted
+from prompthash_api.core.idempotency import IDEMPOTENCY_HEADER, run_idempotent
+from prompthash_api.core.timing import TimedRoute, timed
 from prompthash_api.schemas.improver import HealthResponse, ImproveRequest, ImproveResponse
 from prompthash_api.services.prompt_improver_service import PromptImproverService
 
-router = APIRouter(tags=["improver"])
+router = APIRouter(tags=["improver"], route_class=TimedRoute)
 
 improver_service = PromptImproverService(client=build_openai_client(require_api_key=True))
 
 
 @router.post("/improve", response_model=ImproveResponse)
-async def improve_endpoint(request: ImproveRequest) -> ImproveResponse:
+async def improve_endpoint(
+    request: ImproveRequest,
+    http_request: Request,
+    response: Response,
+    priority: Optional[str] = Header(None, alias=PRIORITY_HEADER),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+) -> ImproveResponse:
     """Improve prompts via REST."""
-    return await improver_service.improve_prompt(request)
+    with timed("app"):
+        client_id = client_host(http_request)
+        trusted = sender_trusted(http_request)
+        return await run_idempotent(
+            "improve",
+            idempotency_key,
+            admission_key(request.sender, client_id, trusted),
+            request,
+            response,
+            lambda: improver_service.improve_prompt(request, client_id=client_id, sender_trusted=trusted, priority=priority),
+        )
 
 
 @router.get("/improver/health/raw", response_model=HealthResponse)
-async def health_raw() -> HealthResponse:
-    """Raw health payload for API clients."""
-    return await improver_service.health()
+async def health_raw(response: Response) -> HealthResponse:
+    """Raw health payload for API clients; 503 while the upstream is not ready."""
+    health = await improver_service.health()
+    if not health.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return health
 
 
 @router.get("/improver/health")
@@ -30,6 +54,11 @@ async def health_proxy():
     """
     try:
         health = await improver_service.health()
+        if not health.ready:
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"ok": False, "error": f"Upstream is {health.status}", "agent": health.dict()},
+            )
         return {"ok": True, "agent": health.dict()}
     except Exception as exc:  # pragma: no cover
         return JSONResponse(
@@ -0,0 +1,85 @@
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
+
+from prompthash_api.core.admission import PRIORITY_HEADER, client_host, resolve_priority, sender_trusted
+from prompthash_api.core.config import get_settings
+from prompthash_api.core.jobs import get_job_manager
+from prompthash_api.routers.chat import chat_service
+from prompthash_api.routers.improver import improver_service
+from prompthash_api.schemas.chat import ChatRequest
+from prompthash_api.schemas.improver import ImproveRequest
+from prompthash_api.schemas.jobs import JobRequest, JobResponse
+
+router = APIRouter(tags=["jobs"])
+
+job_manager = get_job_manager()
+
+REQUEST_MODELS = {"chat": ChatRequest, "improve": ImproveRequest}
+
+
+async def _run_chat(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    response = await chat_service.chat(
+        ChatRequest(**payload["request"]),
+        client_id=payload.get("client_id"),
+        priority=payload.get("priority"),
+        sender_trusted=payload.get("sender_trusted", False),
+    )
+    return response.model_dump(), response.error
+
+
+async def _run_improve(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    response = await improver_service.improve_prompt(
+        ImproveRequest(**payload["request"]),
+        client_id=payload.get("client_id"),
+        priority=payload.get("priority"),
+        sender_trusted=payload.get("sender_trusted", False),
+    )
+    return response.model_dump(), response.error
+
+
+job_manager.register("chat", _run_chat)
+job_manager.register("improve", _run_improve)
+
+
+@router.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(
+    request: JobRequest,
+    http_request: Request,
+    response: Response,
+    priority: Optional[str] = Header(None, alias=PRIORITY_HEADER),
+) -> JobResponse:
+    """Queue a chat or improve request and return its job id immediately."""
+    model = REQUEST_MODELS.get(request.kind)
+    if model is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown job kind {request.kind!r}; use chat or improve.")
+    try:
+        body = model(**request.payload).model_dump()
+    except ValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+    payload = {
+        "request": body,
+        "client_id": client_host(http_request),
+        "sender_trusted": sender_trusted(http_request),
+        "priority": resolve_priority(priority, get_settings().job_priority),
+    }
+    try:
+        job = await job_manager.submit(request.kind, payload, webhook_url=request.webhook_url)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    response.headers["Location"] = f"{http_request.url.path}/{job.id}"
+    return JobResponse(**job.to_dict())
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Seconds to wait for the job to finish (long polling)."),
+) -> JobResponse:
+    """Job status, and the chat/improve response once it has finished."""
+    job = await job_manager.wait(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found or expired.")
+    return JobResponse(**job.to_dict())
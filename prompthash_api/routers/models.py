@@ -1,10 +1,11 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response, status
 
 from prompthash_api.clients.asi_client import build_openai_client
+from prompthash_api.core.timing import TimedRoute, timed
 from prompthash_api.schemas.models import HealthResponse, ModelsResponse
 from prompthash_api.services.model_list_service import ModelListService
 
-router = APIRouter(tags=["models"])
+router = APIRouter(tags=["models"], route_class=TimedRoute)
 
 model_service = ModelListService(client=build_openai_client())
 
@@ -12,11 +13,15 @@ model_service = ModelListService(client=build_openai_client())
 @router.get("/models", response_model=ModelsResponse)
 async def models_endpoint() -> ModelsResponse:
     """List available ASI models."""
-    return await model_service.list_models()
+    with timed("app"):
+        return await model_service.list_models()
 
 
 @router.get("/models/health", response_model=HealthResponse)
-async def health_endpoint() -> HealthResponse:
-    """Health check aligned with the model agent."""
-    return await model_service.health()
+async def health_endpoint(response: Response) -> HealthResponse:
+    """Health check aligned with the model agent; 503 while the upstream is not ready."""
+    health = await model_service.health()
+    if not health.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return health
 
@@ -1,27 +1,67 @@
 from pathlib import Path
+from typing import Dict, Tuple
 
-from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi.templating import Jinja2Templates
 
+from prompthash_api.core.assets import IMMUTABLE, REVALIDATE, PreparedAsset, asset_response, prepare_asset
 from prompthash_api.core.config import get_settings
 
 router = APIRouter(tags=["ui"])
 
+ROOT = Path(__file__).resolve().parent.parent.parent
+STATIC_DIR = ROOT / "static"
+MEDIA_TYPES = {".css": "text/css", ".js": "text/javascript"}
+
 # Reuse the existing template so the HTML interface remains unchanged.
-templates = Jinja2Templates(directory=str(Path(__file__).resolve().parent.parent.parent / "templates"))
+templates = Jinja2Templates(directory=str(ROOT / "templates"))
+
 
+def build_pages() -> Tuple[PreparedAsset, Dict[str, Tuple[PreparedAsset, str]]]:
+    """
+    Render the index page and load the static assets once.
 
-@router.get("/", response_class=HTMLResponse)
-async def index(request: Request) -> HTMLResponse:
+    The template's only inputs are settings and asset URLs, none of which
+    change while the process runs. Assets are served under a content
+    fingerprint (``asi_chat.<hash>.js``) with immutable caching, and under
+    their plain name with revalidation for pages rendered elsewhere (the
+    Flask frontend).
+    """
     settings = get_settings()
-    return templates.TemplateResponse(
-        "asi_chat.html",
-        {
-            "request": request,
-            "agent_api": settings.frontend_agent_api,
-            "improver_api": settings.frontend_improver_api,
-            "models_api": settings.frontend_models_api,
-        },
+    static: Dict[str, Tuple[PreparedAsset, str]] = {}
+    urls: Dict[str, str] = {}
+    for path in sorted(STATIC_DIR.iterdir()) if STATIC_DIR.is_dir() else []:
+        media_type = MEDIA_TYPES.get(path.suffix)
+        if media_type is None:
+            continue
+        asset = prepare_asset(path.read_bytes(), media_type)
+        fingerprinted = f"{path.stem}.{asset.fingerprint}{path.suffix}"
+        static[fingerprinted] = (asset, IMMUTABLE)
+        static[path.name] = (asset, REVALIDATE)
+        urls[path.name] = f"/static/{fingerprinted}"
+
+    html = templates.get_template("asi_chat.html").render(
+        agent_api=settings.frontend_agent_api,
+        improver_api=settings.frontend_improver_api,
+        models_api=settings.frontend_models_api,
+        stylesheet_url=urls.get("asi_chat.css"),
+        script_url=urls.get("asi_chat.js"),
     )
+    return prepare_asset(html.encode("utf-8"), "text/html"), static
+
+
+index_page, static_assets = build_pages()
+
+
+@router.get("/", response_class=Response)
+async def index(request: Request) -> Response:
+    # Revalidated on each visit (a 304 when unchanged) so a deploy's new asset URLs are picked up.
+    return asset_response(request, index_page, REVALIDATE)
+
 
+@router.get("/static/{name}", response_class=Response)
+async def static_file(name: str, request: Request) -> Response:
+    entry = static_assets.get(name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset_response(request, *entry)
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from prompthash_api.core.race import get_race_stats
+from prompthash_api.core.usage import get_usage_tracker, parse_window
+from prompthash_api.routers.admin import require_admin
+from prompthash_api.schemas.usage import LargestPromptsResponse, RaceStatsResponse, UsageResponse
+
+# Usage names senders and their traffic, so it is admin-only like /admin.
+router = APIRouter(tags=["usage"], dependencies=[Depends(require_admin)])
+
+
+def _window_seconds(window: str) -> int:
+    try:
+        seconds = parse_window(window)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    return min(seconds, get_usage_tracker().retention_seconds)
+
+
+@router.get("/usage", response_model=UsageResponse)
+async def usage_endpoint(
+    by: str = Query("sender", description="Group by sender, model or endpoint."),
+    metric: str = Query("total_tokens", description="Sort key for the top-N list."),
+    window: str = Query("1h", description="Rolling window such as 15m, 1h or 24h."),
+    limit: int = Query(10, ge=1, le=500),
+) -> UsageResponse:
+    """Top senders, models or endpoints by token usage over a rolling window."""
+    window_seconds = _window_seconds(window)
+    try:
+        items, totals = get_usage_tracker().top(by=by, metric=metric, window_seconds=window_seconds, limit=limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    return UsageResponse(by=by, metric=metric, window_seconds=window_seconds, items=items, totals=totals)
+
+
+@router.get("/usage/prompts", response_model=LargestPromptsResponse)
+async def largest_prompts_endpoint(
+    window: str = Query("1h", description="Rolling window such as 15m, 1h or 24h."),
+    limit: int = Query(10, ge=1, le=100),
+) -> LargestPromptsResponse:
+    """The individual upstream calls with the largest prompts in the window."""
+    window_seconds = _window_seconds(window)
+    return LargestPromptsResponse(window_seconds=window_seconds, items=get_usage_tracker().largest_prompts(window_seconds, limit))
+
+
+@router.get("/usage/races", response_model=RaceStatsResponse)
+async def race_stats_endpoint() -> RaceStatsResponse:
+    """Per-model win rate, error rate and latency from multi-model race and compare requests."""
+    return RaceStatsResponse(items=get_race_stats().snapshot())
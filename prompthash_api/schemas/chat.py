@@ -1,4 +1,4 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -7,6 +7,9 @@ class ChatRequest(BaseModel):
     sender: Optional[str] = None
     message: Optional[str] = ""
     model: Optional[str] = None
+    # Several candidate models: "race" (default) answers with the fastest, "compare" runs them all.
+    models: Optional[List[str]] = None
+    mode: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
@@ -16,9 +19,20 @@ class ChatResponse(BaseModel):
     history: List[Dict[str, str]]
     model: str
     error: Optional[str] = None
+    # True when the reply was cut off at max_tokens.
+    truncated: bool = False
+    # Per-model outcome and latency when several models were requested.
+    candidates: Optional[List[Dict[str, Any]]] = None
 
 
 class HealthResponse(BaseModel):
     status: str
     agent_name: str
     total_messages: int
+    # Readiness from the cached upstream probe; always true when probing is off.
+    ready: bool = True
+    upstream: Optional[Dict[str, Any]] = None
+    # Event-loop lag, thread-pool usage and the priority classes being shed.
+    load: Optional[Dict[str, Any]] = None
+    # Fallback chain in current order, with each model's SLO, breach rate and demotion.
+    fallback: Optional[List[Dict[str, Any]]] = None
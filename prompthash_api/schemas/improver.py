@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -6,6 +6,11 @@ from pydantic import BaseModel
 class ImproveRequest(BaseModel):
     prompt: Optional[str] = ""
     target: Optional[str] = None
+    # Several candidate models: "race" (default) answers with the fastest, "compare" runs them all.
+    models: Optional[List[str]] = None
+    mode: Optional[str] = None
+    # Optional caller id used for usage accounting.
+    sender: Optional[str] = None
 
 
 class ImproveResponse(BaseModel):
@@ -13,9 +18,22 @@ class ImproveResponse(BaseModel):
     target: str
     model: str
     error: Optional[str] = None
+    # "exact" or "near" when the improvement was served from the cache.
+    cache: Optional[str] = None
+    # True when the improved prompt was cut off at max_tokens.
+    truncated: bool = False
+    # Per-model outcome and latency when several models were requested.
+    candidates: Optional[List[Dict[str, Any]]] = None
 
 
 class HealthResponse(BaseModel):
     status: str
     agent_name: str
     total_requests: int
+    # Readiness from the cached upstream probe; always true when probing is off.
+    ready: bool = True
+    upstream: Optional[Dict[str, Any]] = None
+    # Event-loop lag, thread-pool usage and the priority classes being shed.
+    load: Optional[Dict[str, Any]] = None
+    # Fallback chain in current order, with each model's SLO, breach rate and demotion.
+    fallback: Optional[List[Dict[str, Any]]] = None
@@ -0,0 +1,23 @@
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+
+class JobRequest(BaseModel):
+    # "chat" or "improve"; payload is the matching /api/chat or /api/improve request body.
+    kind: str = "improve"
+    payload: Dict[str, Any] = {}
+    # Called with the finished job (same shape as JobResponse).
+    webhook_url: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
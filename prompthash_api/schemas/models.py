@@ -14,4 +14,9 @@ class HealthResponse(BaseModel):
     status: str
     agent_name: str
     total_requests: int
+    # Readiness from the cached upstream probe; always true when probing is off.
+    ready: bool = True
+    upstream: Optional[Dict[str, Any]] = None
+    # Event-loop lag, thread-pool usage and the priority classes being shed.
+    load: Optional[Dict[str, Any]] = None
 
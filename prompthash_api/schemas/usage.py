@@ -0,0 +1,50 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class UsageRow(BaseModel):
+    key: str
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    avg_prompt_tokens: float
+    avg_latency_ms: float
+
+
+class UsageResponse(BaseModel):
+    by: str
+    metric: str
+    window_seconds: int
+    items: List[UsageRow]
+    totals: UsageRow
+
+
+class PromptUsage(BaseModel):
+    prompt_tokens: int
+    timestamp: float
+    sender: str
+    model: str
+    endpoint: str
+
+
+class LargestPromptsResponse(BaseModel):
+    window_seconds: int
+    items: List[PromptUsage]
+
+
+class RaceModelStats(BaseModel):
+    endpoint: str
+    model: str
+    races: int
+    wins: int
+    win_rate: float
+    errors: int
+    error_rate: float
+    p50_latency_ms: Optional[float] = None
+    p95_latency_ms: Optional[float] = None
+
+
+class RaceStatsResponse(BaseModel):
+    items: List[RaceModelStats]
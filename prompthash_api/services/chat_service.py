@@ -1,10 +1,28 @@
-import asyncio
+from dataclasses import replace
 from typing import Dict, List, Optional
 
 from openai import OpenAI
 
+from prompthash_api.clients.asi_client import ChatCompletionResult, create_chat_completion, run_upstream
+from prompthash_api.core.admission import (
+    AdmissionController,
+    RateLimited,
+    admission_key,
+    estimate_tokens,
+    get_admission_controller,
+    resolve_priority,
+)
+from prompthash_api.core.answer_cache import AnswerCache, answer_key, get_answer_cache
 from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import DeadlineExceeded, use_route_budget
+from prompthash_api.core.fallback import FallbackChain, get_fallback_chain, run_fallback
+from prompthash_api.core.health import HealthProber, get_health_prober
+from prompthash_api.core.output_budget import OutputBudget, get_output_budget
+from prompthash_api.core.overload import get_load_monitor
+from prompthash_api.core.race import MODES, RACE, RaceLeg, candidate_models, describe_legs, run_race
+from prompthash_api.core.retrieval import select_context
 from prompthash_api.core.state import ChatState
+from prompthash_api.core.timing import tag_request, timed
 from prompthash_api.schemas.chat import ChatRequest, ChatResponse, HealthResponse
 
 
@@ -16,17 +34,41 @@ class ChatService:
     management, model resolution, and formatted assistant outputs.
     """
 
-    def __init__(self, client: OpenAI, state: Optional[ChatState] = None) -> None:
+    def __init__(
+        self,
+        client: OpenAI,
+        state: Optional[ChatState] = None,
+        admission: Optional[AdmissionController] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        prober: Optional[HealthProber] = None,
+        output_budget: Optional[OutputBudget] = None,
+        fallback: Optional[FallbackChain] = None,
+    ) -> None:
         if client is None:
             raise RuntimeError("Missing ASICLOUD API key. Please set ASICLOUD_API_KEY in your environment.")
         self.client = client
-        self.state = state or ChatState()
         self.settings = get_settings()
+        self.retrieval = self.settings.chat_context_mode == "retrieval"
+        self.state = state or ChatState(max_items=self.settings.chat_history_items if self.retrieval else 10)
+        self.admission = admission or get_admission_controller()
+        self.answer_cache = answer_cache or get_answer_cache()
+        self.prober = prober or get_health_prober()
+        self.output_budget = output_budget or get_output_budget()
+        self.fallback = fallback or get_fallback_chain("chat")
+        # Built once and shared by every request (never mutated), so each call starts with the same bytes.
+        self._system_message = {"role": "system", "content": self.settings.system_prompt}
 
-    def _build_messages(self, history: List[Dict[str, str]], user_text: str) -> List[Dict[str, str]]:
-        messages: List[Dict[str, str]] = [{"role": "system", "content": self.settings.system_prompt}]
+    def _build_messages(
+        self,
+        history: List[Dict[str, str]],
+        user_text: str,
+        context: Optional[List[Dict[str, str]]] = None,
+    ) -> List[Dict[str, str]]:
+        # Static system prompt first, then history oldest to newest, then the new turn, so an
+        # upstream prefix cache can reuse everything up to the first new message.
+        messages: List[Dict[str, str]] = [self._system_message]
 
-        for item in history[-5:]:
+        for item in history[-5:] if context is None else context:
             messages.append({"role": item["role"], "content": item["text"]})
 
         messages.append({"role": "user", "content": user_text})
@@ -52,25 +94,88 @@ class ChatService:
             return requested_model
         return self.settings.chat_model
 
-    async def _generate_response(self, history: List[Dict[str, str]], user_text: str, model: str) -> str:
-        messages = self._build_messages(history, user_text)
-
-        def _call() -> str:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                **self.settings.chat_generation_config,
+    async def _generate_response(
+        self,
+        history: List[Dict[str, str]],
+        user_text: str,
+        model: str,
+        sender: Optional[str] = None,
+        admission_key: Optional[str] = None,
+        priority: Optional[str] = None,
+        context: Optional[List[Dict[str, str]]] = None,
+    ) -> ChatCompletionResult:
+        messages = self._build_messages(history, user_text, context)
+        config = self.settings.chat_generation_config
+        cache_key = None
+        if self.answer_cache.enabled and len(messages) == 2:
+            # Only the system prompt and the user turn: the answer does not depend on the sender.
+            # Keyed on the configured cap, not the adaptive one: an answer that stopped on its own
+            # fits under any cap it was produced within, and the adaptive cap changes too often to key on.
+            cache_key = answer_key(model, config, self.settings.system_prompt, user_text)
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None and cached.finish_reason == "stop":
+                tag_request(cache="hit")
+                return cached
+        max_tokens = self.output_budget.max_tokens(model, "chat", "chat", config["max_tokens"])
+        estimated = estimate_tokens((message["content"] for message in messages), max_tokens)
+        priority = resolve_priority(priority, self.settings.chat_priority)
+        async with self.admission.admit(admission_key or sender or "anonymous", estimated, priority) as ticket:
+            result = await run_upstream(
+                "chat",
+                model,
+                create_chat_completion,
+                self.client,
+                model,
+                messages,
+                sender=sender,
+                ticket=ticket,
+                **{**config, "max_tokens": max_tokens},
             )
-            return response.choices[0].message.content.strip()
-
-        return await asyncio.to_thread(_call)
+        self.output_budget.observe(model, "chat", "chat", result.usage, result.finish_reason, max_tokens)
+        if cache_key is not None and result.content and result.finish_reason == "stop":
+            # Stored without usage so replays are not charged as upstream tokens.
+            self.answer_cache.put(cache_key, replace(result, usage=None))
+        return result
 
-    async def chat(self, request: ChatRequest) -> ChatResponse:
+    async def chat(
+        self,
+        request: ChatRequest,
+        client_id: Optional[str] = None,
+        priority: Optional[str] = None,
+        sender_trusted: bool = True,
+    ) -> ChatResponse:
         sender_id = request.sender or "rest_client"
         user_text = (request.message or "").strip()
-        model_to_use = self._resolve_model(request.model)
+        candidates = candidate_models(request.models, self.settings.race_max_models)
+        mode = (request.mode or RACE).strip().lower()
+        # Requests that name no model go down the fallback chain, when one is configured.
+        use_fallback = not candidates and not (request.model or "").strip() and self.fallback.enabled
+        if candidates:
+            model_to_use = candidates[0]
+        elif use_fallback:
+            model_to_use = self.fallback.order()[0]
+        else:
+            model_to_use = self._resolve_model(request.model)
+        priority = resolve_priority(priority, self.settings.chat_priority)
+        use_route_budget(self.settings.chat_timeout_seconds)
+        tag_request(sender=sender_id, model=model_to_use, priority=priority)
 
-        history = await self.state.get_history(sender_id)
+        context = None
+        if self.retrieval:
+            archive, index = await self.state.get_archive(sender_id)
+            history = archive[-10:]
+            if user_text:
+                with timed("retrieval"):
+                    context = select_context(
+                        archive,
+                        index,
+                        user_text,
+                        recent_items=self.settings.chat_context_recent_items,
+                        max_exchanges=self.settings.chat_context_retrieved,
+                        budget_tokens=self.settings.chat_context_budget_tokens,
+                    )
+        else:
+            history = await self.state.get_history(sender_id)
         total = await self.state.total_messages()
 
         if not user_text:
@@ -82,10 +187,40 @@ class ChatService:
                 model=model_to_use,
                 error="Please provide a message.",
             )
+        if mode not in MODES:
+            return ChatResponse(
+                reply="",
+                sender=sender_id,
+                total_messages=total,
+                history=history,
+                model=model_to_use,
+                error=f"mode must be one of {', '.join(MODES)}.",
+            )
+
+        async def generate(model: str) -> ChatCompletionResult:
+            return await self._generate_response(
+                history,
+                user_text,
+                model,
+                sender=sender_id,
+                admission_key=admission_key(request.sender, client_id, sender_trusted),
+                priority=priority,
+                context=context,
+            )
 
+        legs: Optional[List[RaceLeg]] = None
         try:
-            response_text = await self._generate_response(history, user_text, model_to_use)
-            formatted = self._format_assistant_output(response_text)
+            if len(candidates) > 1:
+                winner, legs = await run_race("chat", candidates, generate, mode=mode, accept=lambda result: bool(result.content))
+                result, model_to_use = winner.result, winner.model
+                tag_request(model=model_to_use)
+            elif use_fallback:
+                model_to_use, result = await run_fallback(self.fallback, generate, accept=lambda result: bool(result.content))
+                tag_request(model=model_to_use)
+            else:
+                result = await generate(model_to_use)
+            with timed("format"):
+                formatted = self._format_assistant_output(result.content)
             history, total = await self.state.record_exchange(sender_id, user_text, formatted)
 
             return ChatResponse(
@@ -94,7 +229,11 @@ class ChatService:
                 total_messages=total,
                 history=history,
                 model=model_to_use,
+                truncated=result.finish_reason == "length",
+                candidates=describe_legs(legs, lambda result: self._format_assistant_output(result.content)) if legs else None,
             )
+        except (RateLimited, DeadlineExceeded):
+            raise
         except Exception:
             # Align with the prior behavior that returned a generic error message.
             return ChatResponse(
@@ -108,5 +247,14 @@ class ChatService:
 
     async def health(self) -> HealthResponse:
         total = await self.state.total_messages()
-        return HealthResponse(status="ok", agent_name=self.settings.chat_agent_name, total_messages=total)
+        upstream = self.prober.status("chat")
+        return HealthResponse(
+            status=upstream["status"] if upstream else "ok",
+            agent_name=self.settings.chat_agent_name,
+            total_messages=total,
+            ready=upstream["ready"] if upstream else True,
+            upstream=upstream,
+            load=get_load_monitor().snapshot(),
+            fallback=self.fallback.snapshot() if self.fallback.enabled else None,
+        )
 
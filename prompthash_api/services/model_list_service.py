@@ -1,19 +1,29 @@
-import asyncio
 from typing import Any, Dict, List, Optional
 
 from openai import OpenAI
 
+from prompthash_api.clients.asi_client import run_upstream
 from prompthash_api.core.config import get_settings
+from prompthash_api.core.health import HealthProber, get_health_prober
+from prompthash_api.core.metrics import register_models
+from prompthash_api.core.overload import get_load_monitor
 from prompthash_api.core.state import ModelState
+from prompthash_api.core.timing import timed
 from prompthash_api.schemas.models import HealthResponse, ModelsResponse
 
 
 class ModelListService:
     """Lists ASI models and categorizes them."""
 
-    def __init__(self, client: Optional[OpenAI], state: Optional[ModelState] = None) -> None:
+    def __init__(
+        self,
+        client: Optional[OpenAI],
+        state: Optional[ModelState] = None,
+        prober: Optional[HealthProber] = None,
+    ) -> None:
         self.client = client
         self.state = state or ModelState()
+        self.prober = prober or get_health_prober()
         self.settings = get_settings()
 
     @staticmethod
@@ -43,7 +53,8 @@ class ModelListService:
         return categories
 
     def _list_from_client(self) -> List[Any]:
-        return list(self.client.models.list())
+        with timed("upstream"):
+            return list(self.client.models.list())
 
     async def list_models(self) -> ModelsResponse:
         if not self.client:
@@ -54,7 +65,7 @@ class ModelListService:
                 error="ASICLOUD_API_KEY is not set; cannot list ASI models.",
             )
         try:
-            models = await asyncio.to_thread(self._list_from_client)
+            models = await run_upstream("models", "", self._list_from_client)
             model_names: List[str] = []
             model_details: Dict[str, Dict[str, Any]] = {}
             for item in models:
@@ -71,6 +82,7 @@ class ModelListService:
             if not model_names:
                 raise RuntimeError("No models returned from ASI Cloud")
 
+            register_models(model_names)
             categories = self._categorize_models(model_names, model_details)
             await self.state.increment()
             return ModelsResponse(models=model_names, model_details=model_details, categories=categories)
@@ -79,4 +91,12 @@ class ModelListService:
 
     async def health(self) -> HealthResponse:
         total = await self.state.total_requests()
-        return HealthResponse(status="ok", agent_name=self.settings.model_agent_name, total_requests=total)
+        upstream = self.prober.status("models")
+        return HealthResponse(
+            status=upstream["status"] if upstream else "ok",
+            agent_name=self.settings.model_agent_name,
+            total_requests=total,
+            ready=upstream["ready"] if upstream else True,
+            upstream=upstream,
+            load=get_load_monitor().snapshot(),
+        )
@@ -1,87 +1,222 @@
-import asyncio
-from typing import Optional, Tuple
+from typing import Dict, List, Optional
 
 from openai import OpenAI
 
+from prompthash_api.clients.asi_client import ChatCompletionResult, create_chat_completion, run_upstream
+from prompthash_api.core.admission import (
+    AdmissionController,
+    RateLimited,
+    admission_key,
+    estimate_tokens,
+    get_admission_controller,
+    resolve_priority,
+)
 from prompthash_api.core.config import get_settings
+from prompthash_api.core.deadlines import DeadlineExceeded, use_route_budget
+from prompthash_api.core.fallback import FallbackChain, get_fallback_chain, run_fallback
+from prompthash_api.core.health import HealthProber, get_health_prober
+from prompthash_api.core.output_budget import OutputBudget, get_output_budget
+from prompthash_api.core.overload import get_load_monitor
+from prompthash_api.core.prompt_cache import NearDuplicateCache, get_improve_cache
+from prompthash_api.core.race import COMPARE, MODES, RACE, RaceLeg, candidate_models, describe_legs, run_race
 from prompthash_api.core.state import ImproverState
+from prompthash_api.core.timing import tag_request, timed
 from prompthash_api.schemas.improver import HealthResponse, ImproveRequest, ImproveResponse
 
 
 class PromptImproverService:
     """Improves prompts while preserving the original uAgent REST semantics."""
 
-    def __init__(self, client: OpenAI, state: Optional[ImproverState] = None) -> None:
+    def __init__(
+        self,
+        client: OpenAI,
+        state: Optional[ImproverState] = None,
+        admission: Optional[AdmissionController] = None,
+        cache: Optional[NearDuplicateCache] = None,
+        prober: Optional[HealthProber] = None,
+        output_budget: Optional[OutputBudget] = None,
+        fallback: Optional[FallbackChain] = None,
+    ) -> None:
         if client is None:
             raise RuntimeError("Missing ASICLOUD API key. Please set ASICLOUD_API_KEY in your environment.")
         self.client = client
         self.state = state or ImproverState()
+        self.admission = admission or get_admission_controller()
+        self.cache = cache or get_improve_cache()
+        self.prober = prober or get_health_prober()
+        self.output_budget = output_budget or get_output_budget()
+        self.fallback = fallback or get_fallback_chain("improve")
         self.settings = get_settings()
+        # The system prompt and each target's instructions are fixed text placed ahead of the user's
+        # prompt, so an upstream prefix cache can reuse them; built once and never mutated.
+        self._system_message = {"role": "system", "content": self.settings.improver_system_prompt}
+        self._prompt_prefixes = {target: self._prompt_prefix(target) for target in ("text", "image")}
 
     @staticmethod
     def _normalize_target(target: Optional[str]) -> str:
         value = (target or "text").strip().lower()
         return "image" if value == "image" else "text"
 
-    def _build_improvement_prompt(self, prompt: str, target: str) -> str:
+    @staticmethod
+    def _prompt_prefix(target: str) -> str:
         target_section = (
             "Target: IMAGE prompt. Optimize for image models (describe visuals with concrete nouns/adjectives; fold style, lighting, camera, aspect ratio inline; avoid new headings).\n"
             if target == "image"
             else "Target: TEXT prompt. Optimize for clarity, structure, and implementable instructions without adding new headings.\n"
         )
+        return f"{target_section}Improve the following prompt according to the instructions.\n\nUSER PROMPT:\n"
 
-        return (
-            f"{target_section}"
-            "Improve the following prompt according to the instructions.\n\n"
-            "USER PROMPT:\n"
-            f"{prompt}\n\n"
-            "Return ONLY the improved prompt, nothing else."
-        )
+    def _build_improvement_prompt(self, prompt: str, target: str) -> str:
+        return f"{self._prompt_prefixes[target]}{prompt}\n\nReturn ONLY the improved prompt, nothing else."
 
-    def _improve(self, prompt: str, target: str) -> Tuple[str, str]:
-        normalized_target = self._normalize_target(target)
-        messages = [
-            {"role": "system", "content": self.settings.improver_system_prompt},
-            {"role": "user", "content": self._build_improvement_prompt(prompt, normalized_target)},
-        ]
-
-        response = self.client.chat.completions.create(
-            model=self.settings.improver_model,
-            messages=messages,
-            **self.settings.improver_generation_config,
+    def _build_messages(self, prompt: str, target: str) -> List[Dict[str, str]]:
+        return [self._system_message, {"role": "user", "content": self._build_improvement_prompt(prompt, target)}]
+
+    def _improve(self, prompt: str, target: str, max_tokens: int, model: str) -> ChatCompletionResult:
+        messages = self._build_messages(prompt, self._normalize_target(target))
+
+        return create_chat_completion(
+            self.client,
+            model,
+            messages,
+            **{**self.settings.improver_generation_config, "max_tokens": max_tokens},
         )
-        content = response.choices[0].message.content.strip()
-        return content, normalized_target
 
-    async def improve_prompt(self, request: ImproveRequest) -> ImproveResponse:
+    async def _generate(
+        self,
+        user_prompt: str,
+        target: str,
+        model: str,
+        sender: Optional[str],
+        key: str,
+        priority: str,
+    ) -> ChatCompletionResult:
+        max_tokens = self.output_budget.max_tokens(model, "improve", target, self.settings.improver_generation_config["max_tokens"])
+        estimated = estimate_tokens((self.settings.improver_system_prompt, user_prompt), max_tokens)
+        async with self.admission.admit(key, estimated, priority) as ticket:
+            # Run the blocking OpenAI call in a thread to keep the event loop responsive.
+            result = await run_upstream(
+                "improve",
+                model,
+                self._improve,
+                user_prompt,
+                target,
+                max_tokens,
+                model,
+                sender=sender,
+                ticket=ticket,
+            )
+        self.output_budget.observe(model, "improve", target, result.usage, result.finish_reason, max_tokens)
+        return result
+
+    async def improve_prompt(
+        self,
+        request: ImproveRequest,
+        client_id: Optional[str] = None,
+        priority: Optional[str] = None,
+        sender_trusted: bool = True,
+    ) -> ImproveResponse:
         user_prompt = (request.prompt or "").strip()
         target = request.target or "text"
+        candidates = candidate_models(request.models, self.settings.race_max_models)
+        mode = (request.mode or RACE).strip().lower()
+        use_fallback = not candidates and self.fallback.enabled
+        if candidates:
+            model = candidates[0]
+        elif use_fallback:
+            model = self.fallback.order()[0]
+        else:
+            model = self.settings.improver_model
+        priority = resolve_priority(priority, self.settings.improve_priority)
+        use_route_budget(self.settings.improve_timeout_seconds)
+        tag_request(
+            sender=request.sender,
+            model=model,
+            target=self._normalize_target(target),
+            priority=priority,
+        )
 
         if not user_prompt:
             return ImproveResponse(
                 response="",
                 target=self._normalize_target(target),
-                model=self.settings.improver_model,
+                model=model,
                 error="Please provide a prompt to improve.",
             )
+        if mode not in MODES:
+            return ImproveResponse(
+                response="",
+                target=self._normalize_target(target),
+                model=model,
+                error=f"mode must be one of {', '.join(MODES)}.",
+            )
+
+        normalized_target = self._normalize_target(target)
+        # A cached improvement from any candidate (or chain model) beats calling upstream again.
+        # Compare mode asks for every candidate's answer, so it always goes upstream.
+        cached = None
+        if not (len(candidates) > 1 and mode == COMPARE):
+            with timed("cache"):
+                for cached_model in candidates or (self.fallback.order() if use_fallback else [model]):
+                    cached, kind = self.cache.lookup(cached_model, normalized_target, user_prompt)
+                    if cached is not None:
+                        break
+        if cached is not None:
+            tag_request(cache=kind, model=cached_model)
+            await self.state.increment()
+            return ImproveResponse(
+                response=cached,
+                target=normalized_target,
+                model=cached_model,
+                cache=kind,
+            )
+
+        key = admission_key(request.sender, client_id, sender_trusted)
 
+        async def generate(candidate: str) -> ChatCompletionResult:
+            return await self._generate(user_prompt, normalized_target, candidate, request.sender, key, priority)
+
+        legs: Optional[List[RaceLeg]] = None
         try:
-            # Run the blocking OpenAI call in a thread to keep the event loop responsive.
-            content, normalized_target = await asyncio.to_thread(self._improve, user_prompt, target)
+            if len(candidates) > 1:
+                winner, legs = await run_race("improve", candidates, generate, mode=mode, accept=lambda result: bool(result.content))
+                result, model = winner.result, winner.model
+                tag_request(model=model)
+            elif use_fallback:
+                model, result = await run_fallback(self.fallback, generate, accept=lambda result: bool(result.content))
+                tag_request(model=model)
+            else:
+                result = await generate(model)
             await self.state.increment()
+            # A reply cut off at max_tokens is not worth replaying.
+            if result.content and result.finish_reason in (None, "stop"):
+                self.cache.store(model, normalized_target, user_prompt, result.content)
             return ImproveResponse(
-                response=content,
+                response=result.content,
                 target=normalized_target,
-                model=self.settings.improver_model,
+                model=model,
+                truncated=result.finish_reason == "length",
+                candidates=describe_legs(legs, lambda result: result.content) if legs else None,
             )
+        except (RateLimited, DeadlineExceeded):
+            raise
         except Exception:
             return ImproveResponse(
                 response="",
                 target=self._normalize_target(target),
-                model=self.settings.improver_model,
+                model=model,
                 error="Failed to improve prompt. Please try again.",
             )
 
     async def health(self) -> HealthResponse:
         total = await self.state.total_requests()
-        return HealthResponse(status="ok", agent_name=self.settings.improver_agent_name, total_requests=total)
+        upstream = self.prober.status("improve")
+        return HealthResponse(
+            status=upstream["status"] if upstream else "ok",
+            agent_name=self.settings.improver_agent_name,
+            total_requests=total,
+            ready=upstream["ready"] if upstream else True,
+            upstream=upstream,
+            load=get_load_monitor().snapshot(),
+            fallback=self.fallback.snapshot() if self.fallback.enabled else None,
+        )
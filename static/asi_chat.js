@@ -0,0 +1,198 @@
+function escapeHtml(text) {
+    if (!text && text !== 0) return "";
+    const div = document.createElement("div");
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+function renderHistory(history, total) {
+    const log = document.getElementById("chat-log");
+    if (!history || history.length === 0) {
+        log.innerHTML = '<div class="bubble"><div class="meta">No messages yet</div></div>';
+        document.getElementById("message-count").textContent = `Messages: ${total || 0}`;
+        return;
+    }
+    log.innerHTML = history
+        .map(item => `
+            <div class="bubble ${item.role}">
+                <div class="meta">${item.role}</div>
+                <div>${escapeHtml(item.text)}</div>
+            </div>
+        `)
+        .join("");
+    document.getElementById("message-count").textContent = `Messages: ${total}`;
+    log.scrollTop = log.scrollHeight;
+}
+
+async function checkHealth() {
+    const btn = document.getElementById("health-btn");
+    const pill = document.getElementById("health-pill");
+    btn.disabled = true;
+    pill.textContent = "Checking...";
+    try {
+        const res = await fetch("/api/health");
+        const data = await res.json();
+        if (data.ok) {
+            pill.textContent = `Status: ${data.agent.status} · total ${data.agent.total_messages}`;
+            pill.className = "pill ok";
+        } else {
+            pill.textContent = "Agent offline";
+            pill.className = "pill bad";
+        }
+    } catch (err) {
+        pill.textContent = "Health check failed";
+        pill.className = "pill bad";
+    } finally {
+        btn.disabled = false;
+    }
+}
+
+async function sendChat(event) {
+    event.preventDefault();
+    const btn = document.getElementById("send-btn");
+    const errorBox = document.getElementById("error-box");
+    const sender = document.getElementById("sender").value || "frontend_user";
+    const message = document.getElementById("message").value;
+    const model = document.getElementById("model-select").value || null;
+
+    errorBox.style.display = "none";
+    btn.disabled = true;
+    btn.textContent = "Sending...";
+
+    try {
+        const res = await fetch("/api/chat", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ message, sender, model })
+        });
+        const data = await res.json();
+
+        if (res.ok && !data.error) {
+            renderHistory(data.history, data.total_messages);
+            document.getElementById("message").value = "";
+        } else {
+            errorBox.textContent = data.error || "Something went wrong.";
+            errorBox.style.display = "block";
+        }
+    } catch (err) {
+        errorBox.textContent = err.message;
+        errorBox.style.display = "block";
+    } finally {
+        btn.disabled = false;
+        btn.textContent = "Send to agent";
+    }
+}
+
+async function loadModels() {
+    const select = document.getElementById("model-select");
+    const hint = document.getElementById("model-hint");
+    select.innerHTML = '<option value=\"\" selected>Loading...</option>';
+    hint.textContent = "";
+    try {
+        const res = await fetch("/api/models");
+        const data = await res.json();
+        if (!res.ok || data.error) {
+            throw new Error(data.error || "Unable to load models");
+        }
+
+        const { models = [], model_details = {}, categories = {} } = data;
+        if (!models.length) {
+            throw new Error("No models returned");
+        }
+
+        const byCategory = Object.entries(categories || {});
+        if (byCategory.length) {
+            select.innerHTML = "";
+            byCategory.forEach(([category, names]) => {
+                if (!names || !names.length) return;
+                const optgroup = document.createElement("optgroup");
+                optgroup.label = category;
+                names.forEach(name => {
+                    const option = document.createElement("option");
+                    option.value = name;
+                    const detail = model_details[name] || {};
+                    const display = detail.display_name || name;
+                    option.textContent = `${display} (${name})`;
+                    optgroup.appendChild(option);
+                });
+                select.appendChild(optgroup);
+            });
+        } else {
+            select.innerHTML = models
+                .map(name => {
+                    const detail = model_details[name] || {};
+                    const display = detail.display_name || name;
+                    return `<option value=\"${name}\">${display} (${name})</option>`;
+                })
+                .join("");
+        }
+        hint.textContent = `Loaded ${models.length} models (ASI)`;
+    } catch (err) {
+        select.innerHTML = '<option value="" selected>Default agent model</option>';
+        hint.textContent = err.message;
+    }
+}
+
+async function checkImproverHealth() {
+    const btn = document.getElementById("improver-health-btn");
+    const pill = document.getElementById("improver-health-pill");
+    btn.disabled = true;
+    pill.textContent = "Checking...";
+    try {
+        const res = await fetch("/api/improver/health");
+        const data = await res.json();
+        if (data.ok) {
+            pill.textContent = `Status: ${data.agent.status} · total ${data.agent.total_requests}`;
+            pill.className = "pill ok";
+        } else {
+            pill.textContent = "Improver offline";
+            pill.className = "pill bad";
+        }
+    } catch (err) {
+        pill.textContent = "Improver check failed";
+        pill.className = "pill bad";
+    } finally {
+        btn.disabled = false;
+    }
+}
+
+async function sendImprove(event) {
+    event.preventDefault();
+    const btn = document.getElementById("improve-btn");
+    const errorBox = document.getElementById("improve-error");
+    const promptText = document.getElementById("improve-text").value;
+    const target = document.getElementById("target").value;
+
+    errorBox.style.display = "none";
+    btn.disabled = true;
+    btn.textContent = "Improving...";
+
+    try {
+        const res = await fetch("/api/improve", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ prompt: promptText, target })
+        });
+        const data = await res.json();
+
+        if (res.ok && !data.error) {
+            document.getElementById("improved-output").textContent = data.response || "(no response)";
+            document.getElementById("improve-meta").textContent = `Target: ${data.target || target} · Model: ${data.model || "unknown"}`;
+            document.getElementById("improve-text").focus();
+        } else {
+            errorBox.textContent = data.error || "Something went wrong.";
+            errorBox.style.display = "block";
+        }
+    } catch (err) {
+        errorBox.textContent = err.message;
+        errorBox.style.display = "block";
+    } finally {
+        btn.disabled = false;
+        btn.textContent = "Improve prompt";
+    }
+}
+
+checkHealth();
+checkImproverHealth();
+loadModels();
+renderHistory([], 0);